@@ -6,7 +6,7 @@ from ..loggers import StructurePredictionEvaluator, LinkerEvaluator, FilteringEv
 import pandas as pd
 import numpy as np
 from ..helpers.jupyter import table_to_html
-from axcell.models.linking.format import extract_value
+from axcell.models.linking.format import extract_values
 from axcell.helpers.optimize import optimize_filters
 
 
@@ -145,8 +145,7 @@ class Explainer:
                 record.model_type = model_type_col[col] or model_type_row[row]
                 record.raw_value = matrix[row, col]
 
-            sota_records["parsed"] = sota_records[["raw_value", "format"]].apply(
-                lambda row: float(extract_value(row.raw_value, row.format)), axis=1)
+            sota_records["parsed"] = extract_values(sota_records["raw_value"].values, sota_records["format"].values)
 
             sota_records = sota_records[sota_records["parsed"] == sota_records["parsed"]]
 
@@ -1,8 +1,6 @@
 #  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
 
 import pandas as pd, numpy as np
-from dataclasses import dataclass, replace
-from axcell.models.linking.metrics import CM
 from matplotlib import pyplot as plt
 import matplotlib.tri as tri
 
@@ -110,7 +108,33 @@ def merge_gold_records(explainer):
     return df
 
 
+def metric_direction(metrics_info, task, dataset, metric):
+    """
+    Returns 1 if higher values of a metric are better, -1 otherwise.
+    """
+    key = (task, dataset, metric)
+    d = 0
+    if key in metrics_info:
+        d = metrics_info[key]
+    elif metric in metrics_info:
+        d = metrics_info[metric]
+    elif 'error' in metric.lower():
+        d = -1
+    elif 'accuracy' in metric.lower():
+        d = 1
+    return 1 if d >= 0 else -1
+
+
 def find_threshold_intervals(proposals, metrics_info, context="paper"):
+    """
+    Computes for each proposal an interval of confidence thresholds for which it is returned.
+
+    Proposal is superseded by all strictly better results of the same (task, dataset, metric) in
+    the same context (paper or table), so its `min_threshold` is the maximal confidence of these results.
+    Proposals with values equal to the best one are superseded by the first of them.
+    Proposals within each (context, task, dataset, metric) group are sorted once by value, adjusted
+    by the direction of metric, and the maximal confidences are computed as running maxima.
+    """
     # maximal threshold to have this proposal returned
     proposals["max_threshold"] = proposals.confidence
 
@@ -126,62 +150,74 @@ def find_threshold_intervals(proposals, metrics_info, context="paper"):
     all_proposals = proposals
     proposals = proposals[~ignore]
 
+    parts = proposals.index.to_series().str.split('/', expand=False)
     if context == "paper":
-        context_column = proposals.index.to_series().str.split('/', expand=False).apply(lambda x: x[0])
+        context_column = parts.str[0]
     else:
-        context_column = proposals.index.to_series().str.split('/', expand=False).apply(lambda x: x[0] + "/" + x[1])
-
-    for i, p in proposals.iterrows():
-        key = (p.task_pred, p.dataset_pred, p.metric_pred)
-        proposals_context = proposals[context_column == context_column[p.name]]
-        proposals_context = proposals_context[~proposals_context.parsed_pred.isna()]
-        proposals_context = proposals_context[
-            (proposals_context.task_pred == p.task_pred) &
-            (proposals_context.dataset_pred == p.dataset_pred) &
-            (proposals_context.metric_pred == p.metric_pred)
-            ]
-        d = 0
-        if key in metrics_info:
-            d = metrics_info[key]
-        elif p.metric_pred in metrics_info:
-            d = metrics_info[p.metric_pred]
-        elif 'error' in p.metric_pred.lower():
-            d = -1
-        elif 'accuracy' in p.metric_pred.lower():
-            d = 1
-
-        if d >= 0:
-            d = 1
-        else:
-            d = -1
+        context_column = parts.str[0] + "/" + parts.str[1]
+
+    # proposals without value are never superseded
+    valid = ~proposals.parsed_pred.isna().values
+    proposals = proposals[valid]
+    min_threshold = np.zeros(len(valid))
+    if len(proposals):
+        keys = pd.MultiIndex.from_arrays([proposals.task_pred, proposals.dataset_pred, proposals.metric_pred])
+        codes, uniques = pd.factorize(keys)
+        directions = np.array([metric_direction(metrics_info, *key) for key in uniques])
+        groups, _ = pd.factorize(pd.MultiIndex.from_arrays([context_column.values[valid], codes]))
+
+        _, ranks = np.unique(proposals.parsed_pred.values, return_inverse=True)
+        # better results first, ties in the order of proposals
+        order = np.lexsort((-directions[codes] * ranks, groups))
+        groups = groups[order]
+        ranks = ranks[order]
+        confidences = proposals.confidence.values.astype(float)[order]
+
+        positions = np.arange(len(order))
+        new_group = np.ones(len(order), dtype=bool)
+        new_group[1:] = groups[1:] != groups[:-1]
+        new_value = new_group.copy()
+        new_value[1:] |= ranks[1:] != ranks[:-1]
+        group_start = np.maximum.accumulate(np.where(new_group, positions, 0))
+        value_start = np.maximum.accumulate(np.where(new_value, positions, 0))
 
         # the minimal threshold above which all superior results are ignored
-        which = d * proposals_context.parsed_pred > d * p.parsed_pred
-        if np.any(which.values):
-            all_proposals.at[i, "min_threshold"] = proposals_context[which].confidence.values.max()
-        else:
-            which = proposals_context[proposals_context.parsed_pred == p.parsed_pred].iloc[0]
-            if which.name != p.name:
-                all_proposals.at[i, "min_threshold"] = which.confidence
+        best = pd.Series(confidences).groupby(groups).cummax().values
+        top = value_start == group_start
+        superseded = np.where(top, confidences[value_start], best[value_start - 1])
+        superseded[top & (positions == value_start)] = 0.0
+        min_threshold[np.flatnonzero(valid)[order]] = superseded
+
+    all_proposals.loc[~ignore, "min_threshold"] = min_threshold
 
     return all_proposals
 
 
-def update_cm(proposal, cm, is_activated):
-    d = 1 if is_activated else -1
-    if proposal.equal and proposal.pred_positive and proposal.gold_positive:
-        cm = replace(cm, tp=cm.tp + d, fn=cm.fn - d)
-    if proposal.equal and not proposal.pred_positive and not proposal.gold_positive:
-        cm = replace(cm, tn=cm.tn + d)
-    if proposal.pred_positive and (not proposal.equal or not proposal.gold_positive):
-        cm = replace(cm, fp=cm.fp + d)
-    #     if proposal.gold_positive and (not proposal.equal or not proposal.pred_positive):
-    #         cm = replace(cm, fn = cm.fn+d)
-    return cm
+def cm_deltas(df):
+    """
+    Returns changes of tp, tn, fp and fn (in columns) caused by activating each proposal. Activating
+    a correct positive proposal moves a result from fn to tp, a correct negative one adds a tn and
+    an incorrect positive one adds a fp. Deactivation reverts these changes.
+    """
+    equal = df.equal.values.astype(bool)
+    pred_positive = df.pred_positive.values.astype(bool)
+    gold_positive = df.gold_positive.values.astype(bool)
+    tp = equal & pred_positive & gold_positive
+    tn = equal & ~pred_positive & ~gold_positive
+    fp = pred_positive & (~equal | ~gold_positive)
+    return np.stack([tp, tn, fp, -tp.astype(np.int64)], axis=1).astype(np.int64)
 
 
 def sweep_thresholds(df):
-    cm = CM(fn=sum(df.gold_positive))
+    """
+    Computes confusion matrices, precision, recall and F1 for all pairs of distinct thresholds
+    threshold1 <= threshold2. Proposal is returned if min_threshold < threshold1 <= max_threshold,
+    but proposals activated below threshold1 are ignored once threshold2 exceeds their max_threshold.
+
+    Activation and deactivation events are sorted once, confusion matrices for consecutive
+    thresholds are computed with cumulative sums of changes caused by events.
+    """
+    cm = np.array([0, 0, 0, sum(df.gold_positive)], dtype=np.int64)  # tp, tn, fp, fn
     df = df[df.min_threshold < df.max_threshold]
 
     sweeps = df.reset_index().melt(id_vars="cell_ext_id", value_vars=["min_threshold", "max_threshold"],
@@ -191,43 +227,44 @@ def sweep_thresholds(df):
 
     steps = sweeps.threshold.drop_duplicates().index
 
-    results = []
-    for i, idx1 in enumerate(steps[:-1]):
-        th1 = sweeps.threshold[idx1]
-
-        to_restore = cm
-        for j, idx2 in enumerate(steps[i + 1:], i + 1):
-            th2 = sweeps.threshold[idx2]
-            precision = cm.tp / (cm.tp + cm.fp + 1e-8)
-            recall = cm.tp / (cm.tp + cm.fn + 1e-8)
-            f1 = 2 * precision * recall / (precision + recall + 1e-8)
-
-            result = dict(threshold1=th1, threshold2=sweeps.threshold[idx2 - 1], tp=cm.tp, tn=cm.tn, fp=cm.fp, fn=cm.fn,
-                          precision=precision, recall=recall, f1=f1)
-            results.append(result)
-            for _, row in sweeps[sweeps.threshold == sweeps.threshold[idx2 - 1]].iterrows():
-                proposal = df.loc[row.cell_ext_id]
-                is_activated = row.threshold_type == 'min_threshold'
-                if not is_activated and proposal.min_threshold < th1:
-                    cm = update_cm(proposal, cm, is_activated)
-
-        precision = cm.tp / (cm.tp + cm.fp + 1e-8)
-        recall = cm.tp / (cm.tp + cm.fn + 1e-8)
-        f1 = 2 * precision * recall / (precision + recall + 1e-8)
-
-        result = dict(threshold1=th1, threshold2=th2, tp=cm.tp, tn=cm.tn, fp=cm.fp, fn=cm.fn,
-                      precision=precision, recall=recall, f1=f1)
-        results.append(result)
-
-        cm = to_restore
-
-        for _, row in sweeps[sweeps.threshold == th1].iterrows():
-            proposal = df.loc[row.cell_ext_id]
-
-            is_activated = row.threshold_type == 'min_threshold'
-            cm = update_cm(proposal, cm, is_activated)
-
-    return df, sweeps, steps, pd.DataFrame(results)
+    thresholds = sweeps.threshold.values[steps]
+    n = len(thresholds)
+    if n < 2:
+        return df, sweeps, steps, pd.DataFrame([])
+
+    deltas = cm_deltas(df)
+    starts = np.searchsorted(thresholds, df.min_threshold.values)
+    ends = np.searchsorted(thresholds, df.max_threshold.values)
+    changes = np.zeros((n, 4), dtype=np.int64)
+    np.add.at(changes, starts, deltas)
+    np.subtract.at(changes, ends, deltas)
+    # confusion matrices before processing events at each threshold1
+    bases = cm + np.concatenate([np.zeros((1, 4), dtype=np.int64), np.cumsum(changes, axis=0)[:-1]])
+
+    # deactivations (by threshold) of proposals activated below the current threshold1
+    deactivations = np.zeros((n, 4), dtype=np.int64)
+    order = np.argsort(starts, kind="stable")
+    activated = 0
+
+    threshold1, threshold2, cms = [], [], []
+    for i in range(n - 1):
+        while activated < len(order) and starts[order[activated]] < i:
+            deactivations[ends[order[activated]]] += deltas[order[activated]]
+            activated += 1
+        # for threshold2 = thresholds[j] deactivations below thresholds[j-1] are subtracted
+        deactivated = np.cumsum(deactivations[i:n - 1], axis=0)
+        cms.append(bases[i] - np.concatenate([np.zeros((1, 4), dtype=np.int64), deactivated]))
+        threshold1.append(np.full(n - i, thresholds[i]))
+        threshold2.append(thresholds[i:])
+
+    cms = np.concatenate(cms)
+    tp, tn, fp, fn = cms.T
+    precision = tp / (tp + fp + 1e-8)
+    recall = tp / (tp + fn + 1e-8)
+    f1 = 2 * precision * recall / (precision + recall + 1e-8)
+    results = pd.DataFrame(dict(threshold1=np.concatenate(threshold1), threshold2=np.concatenate(threshold2),
+                                tp=tp, tn=tn, fp=fp, fn=fn, precision=precision, recall=recall, f1=f1))
+    return df, sweeps, steps, results
 
 
 class PRResults:
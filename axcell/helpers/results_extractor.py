@@ -3,6 +3,7 @@
 from axcell.data.structure import CellEvidenceExtractor
 from axcell.models.structure import TableType, TableStructurePredictor, TableTypePredictor
 from axcell.models.linking import *
+from axcell.models.linking.bundle import load_bundle
 from pathlib import Path
 
 
@@ -12,10 +13,19 @@ class ResultsExtractor:
         self.cell_evidences = CellEvidenceExtractor()
         self.ttp = TableTypePredictor(models_path, "table-type-classifier.pth")
         self.tsp = TableStructurePredictor(models_path, "table-structure-classifier.pth")
-        self.taxonomy = Taxonomy(taxonomy=models_path / "taxonomy.json", metrics_info=models_path / "metrics.json")
+        bundle_path = models_path / "linking.bundle"
+        if bundle_path.exists():
+            # compiled with python -m axcell.models.linking.bundle models_path,
+            # outdated bundles are compiled again from the json files
+            bundle = load_bundle(models_path)
+            self.taxonomy = bundle.taxonomy
+            self.evidence_finder = bundle.evidence_finder
+            self.context_search = bundle.context_search()
+        else:
+            self.taxonomy = Taxonomy(taxonomy=models_path / "taxonomy.json", metrics_info=models_path / "metrics.json")
 
-        self.evidence_finder = EvidenceFinder(self.taxonomy, abbreviations_path=models_path / "abbreviations.json")
-        self.context_search = ContextSearch(self.taxonomy, self.evidence_finder)
+            self.evidence_finder = EvidenceFinder(self.taxonomy, abbreviations_path=models_path / "abbreviations.json")
+            self.context_search = ContextSearch(self.taxonomy, self.evidence_finder)
         self.dataset_extractor = DatasetExtractor(self.evidence_finder)
 
         self.linker = Linker("linking", self.context_search, self.dataset_extractor)
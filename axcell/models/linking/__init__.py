@@ -6,4 +6,5 @@ from .context_search import ContextSearch, DatasetExtractor, EvidenceFinder
 from .proposals_filters import *
 
 __all__ = ["Taxonomy", "Linker", "ContextSearch", "DatasetExtractor", "EvidenceFinder", "ProposalsFilter", "NopFilter",
-           "BestResultFilter", "StructurePredictionFilter", "ConfidenceFilter", "CompoundFilter"]
+           "BestResultFilter", "StructurePredictionFilter", "ConfidenceFilter", "CompoundFilter", "MaskFilter",
+           "Reasons", "FilterOutReason"]
@@ -1,18 +1,47 @@
 #  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
 
+import hashlib
+from pathlib import Path
+
 import spacy
 from scispacy.abbreviation import AbbreviationDetector
 from .utils import normalize_cell, normalize_dataset
 
 class AcronymExtractor:
-    def __init__(self):
+    """
+    Extracts abbreviations and their long forms from texts.
+
+    Parameters
+    ----------
+    cache_path: optional path of an on-disk cache of extracted abbreviations keyed by hash of text
+    """
+    def __init__(self, cache_path=None):
         self.nlp = spacy.load("en_core_sci_sm")
         abbreviation_pipe = AbbreviationDetector(self.nlp)
         self.nlp.add_pipe(abbreviation_pipe)
         self.nlp.disable_pipes("tagger", "ner", "parser")
+        self.cache_path = None if cache_path is None else Path(cache_path)
+        self.cache = None
 
-    def __call__(self, text):
-        doc = self.nlp(text)
+    def get_cache(self):
+        if self.cache is None and self.cache_path is not None:
+            # diskcache is needed only if the on-disk cache is used
+            import diskcache as dc
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self.cache = dc.Cache(self.cache_path)
+        return self.cache
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _abbreviations(doc):
         abbrvs = {}
         for abrv in doc._.abbreviations:
             # abbrvs.setdefault(normalize_cell(str(abrv)), Counter())[str(abrv._.long_form)] += 1
@@ -20,3 +49,31 @@ class AcronymExtractor:
             if norm != '':
                 abbrvs[norm] = normalize_cell(normalize_dataset(str(abrv._.long_form)))
         return abbrvs
+
+    def extract_many(self, texts, batch_size=1000, n_process=1):
+        """
+        Extracts abbreviations from many texts. Identical texts and texts found in the on-disk
+        cache are processed only once, the remaining ones are streamed through `nlp.pipe`.
+
+        Returns
+        -------
+        abbreviations : list of dictionaries from abbreviations to their long forms, one per text
+        """
+        texts = list(texts)
+        cache = self.get_cache()
+        found = {}
+        missing = []
+        for text in dict.fromkeys(texts):
+            abbrvs = cache.get(self._key(text)) if cache is not None else None
+            if abbrvs is None:
+                missing.append(text)
+            else:
+                found[text] = abbrvs
+        for text, doc in zip(missing, self.nlp.pipe(missing, batch_size=batch_size, n_process=n_process)):
+            found[text] = self._abbreviations(doc)
+            if cache is not None:
+                cache[self._key(text)] = found[text]
+        return [dict(found[text]) for text in texts]
+
+    def __call__(self, text):
+        return self.extract_many([text])[0]
@@ -0,0 +1,480 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+# In-memory replacement of the et_taxonomy Elasticsearch index (see axcell.data.elastic.ETTaxonomy)
+# serving the subset of Elasticsearch client API used by MatchSearch.
+#
+# Analyzers emulate taxonomy_standard (standard tokenizer, word delimiter, lowercase and shingles)
+# and taxonomy_ngrams (2-4 character n-grams of letters and digits). Queries are built the way
+# Elasticsearch builds multi_match (best_fields) queries for these analyzers: the query of a field
+# is a disjunction of its positions, where the unigram and the shingles starting at the same position
+# form a single synonym query. Documents are scored with BM25 as configured for indices created
+# with Elasticsearch 6, in single precision and with the one byte encoding of field lengths.
+
+from collections import Counter
+import math
+import re
+import unicodedata
+
+import numpy as np
+
+
+# Word break property values of UAX#29 (as used by Lucene's StandardTokenizer), one letter per
+# character: A - letter, N - numeric, K - katakana, X - extend num let (e.g., underscore),
+# L - mid letter, B - mid num let or single quote, M - mid num, E - extend or format,
+# I - ideograph or hiragana (a token on its own), S - south east asian, J - emoji, O - other.
+_MID_LETTER = ":\u00b7\u0387\u05f4\u2027\ufe13\ufe55\uff1a"
+_MID_NUM_LET = ".'\u2018\u2019\u2024\ufe52\uff07\uff0e"
+_MID_NUM = ",;\u037e\u0589\u060c\u060d\u066c\u07f8\u2044\ufe10\ufe14\ufe50\ufe54\uff0c\uff1b"
+_SCRIPT_RANGES = [
+    (0x0e00, 0x0eff, "S"),  # Thai, Lao
+    (0x1000, 0x109f, "S"),  # Myanmar
+    (0x1780, 0x17ff, "S"),  # Khmer
+    (0x1950, 0x19df, "S"),  # Tai Le, New Tai Lue
+    (0x1a20, 0x1aaf, "S"),  # Tai Tham
+    (0xa9e0, 0xa9ff, "S"),  # Myanmar Extended-B
+    (0xaa60, 0xaadf, "S"),  # Myanmar Extended-A, Tai Viet
+    (0x3041, 0x309f, "I"),  # Hiragana
+    (0x30a0, 0x30ff, "K"),
+    (0x31f0, 0x31ff, "K"),
+    (0xff66, 0xff9d, "K"),
+    (0x2e80, 0x2fdf, "I"),  # CJK radicals
+    (0x3005, 0x3007, "I"),
+    (0x3021, 0x3029, "I"),
+    (0x3038, 0x303b, "I"),
+    (0x3400, 0x4dbf, "I"),
+    (0x4e00, 0x9fff, "I"),
+    (0xf900, 0xfaff, "I"),
+    (0x20000, 0x3134f, "I"),
+]
+
+
+def _word_break_type(c):
+    cp = ord(c)
+    for start, end, wb_type in _SCRIPT_RANGES:
+        if start <= cp <= end:
+            return wb_type
+    if c in _MID_LETTER:
+        return "L"
+    if c in _MID_NUM_LET:
+        return "B"
+    if c in _MID_NUM:
+        return "M"
+    category = unicodedata.category(c)
+    if category in ("Mn", "Me", "Mc") or (category == "Cf" and c != "\u200b") or 0x1f3fb <= cp <= 0x1f3ff:
+        return "E"
+    if category == "Pc":
+        return "X"
+    if category == "Nd":
+        return "N"
+    if category[0] == "L" or category == "Nl":
+        return "A"
+    if category == "So" and 0x1f000 <= cp <= 0x1faff:
+        return "J"
+    return "O"
+
+
+class _WordBreakTypes(dict):
+    """Translation table from characters to their word break types, filled on demand."""
+    def __missing__(self, cp):
+        wb_type = self[cp] = _word_break_type(chr(cp))
+        return wb_type
+
+
+_word_break_types = _WordBreakTypes()
+
+_word_re = r"(?:K(?:X*K)*|(?:A(?:X*A|[LB]A)*|N(?:X*N|[MB]N)*)+)"
+_token_re = re.compile(rf"X*{_word_re}(?:X+{_word_re})*X*|[IJ]|S+")
+_max_token_length = 255
+
+
+def standard_tokens(text):
+    """
+    Splits text into tokens as Lucene's StandardTokenizer, i.e., on word boundaries of UAX#29,
+    dropping tokens without letters or digits.
+    """
+    types = text.translate(_word_break_types)
+    # extend and format characters are ignored for word boundaries and belong to the preceding character
+    kept = [i for i, t in enumerate(types) if t != "E"]
+    kept_types = "".join(types[i] for i in kept)
+    kept.append(len(text))
+    tokens = []
+    for m in _token_re.finditer(kept_types):
+        token = text[kept[m.start()]:kept[m.end()]]
+        tokens.extend(token[i:i + _max_token_length] for i in range(0, len(token), _max_token_length))
+    return tokens
+
+
+# Character classes of Lucene's WordDelimiterIterator
+_LOWER, _UPPER, _DIGIT, _SUBWORD_DELIM = 0x01, 0x02, 0x04, 0x08
+_ALPHA = _LOWER | _UPPER
+
+_category_char_types = dict(Lu=_UPPER, Ll=_LOWER, Lt=_ALPHA, Lm=_ALPHA, Lo=_ALPHA, Mn=_ALPHA, Me=_ALPHA, Mc=_ALPHA,
+                            Nd=_DIGIT, Nl=_DIGIT, No=_DIGIT)
+
+
+def _delimiter_char_type(c):
+    cp = ord(c)
+    if cp < 256:
+        if c.islower():
+            return _LOWER
+        if c.isupper():
+            return _UPPER
+        return _DIGIT if "0" <= c <= "9" else _SUBWORD_DELIM
+    if cp > 0xffff:
+        # Lucene sees surrogate pairs, classified as both letters and digits
+        return _ALPHA | _DIGIT
+    return _category_char_types.get(unicodedata.category(c), _SUBWORD_DELIM)
+
+
+def _is_break(last_type, char_type):
+    # split_on_case_change and split_on_numerics, but not on upper to lower case changes
+    if char_type & last_type:
+        return False
+    if last_type & _UPPER and char_type & _ALPHA:
+        return False
+    return True
+
+
+def _subwords(token, types):
+    """Yields (start, end) of subwords of token, skipping english possessives."""
+    start, end = 0, len(token)
+    while start < end and types[start] == _SUBWORD_DELIM:
+        start += 1
+    while end > start and types[end - 1] == _SUBWORD_DELIM:
+        end -= 1
+
+    def ends_with_possessive(pos):
+        return (pos > 2 and token[pos - 2] == "'" and token[pos - 1] in "sS" and types[pos - 3] & _ALPHA
+                and (pos == end or types[pos] == _SUBWORD_DELIM))
+
+    current = start
+    while True:
+        last_type = 0
+        while current < end and types[current] == _SUBWORD_DELIM:
+            last_type = types[current]
+            current += 1
+        if current >= end:
+            return
+        last_type = types[current]
+        stop = current + 1
+        while stop < end and not _is_break(last_type, types[stop]):
+            last_type = types[stop]
+            stop += 1
+        yield current, stop
+        current = stop + 2 if stop < end - 1 and ends_with_possessive(stop + 2) else stop
+
+
+def word_delimiter(token):
+    """
+    Returns tokens emitted for token by Lucene's WordDelimiterFilter with generate_word_parts,
+    generate_number_parts, catenate_words, split_on_case_change, split_on_numerics,
+    stem_english_possessive and preserve_original, in the order of the filter.
+    """
+    types = [_delimiter_char_type(c) for c in token]
+    subwords = list(_subwords(token, types))
+    if not subwords:
+        return [token]
+    if len(subwords) == 1 and subwords[0] == (0, len(token)):
+        return [token]
+    end = len(token)
+    while end > 0 and types[end - 1] == _SUBWORD_DELIM:
+        end -= 1
+    possessive = end > 2 and token[end - 2] == "'" and token[end - 1] in "sS" and types[end - 3] & _ALPHA
+    if len(subwords) == 1 and (subwords[0][1] == end - 2 if possessive else subwords[0][1] == end):
+        # a single word surrounded by delimiters
+        return [token, token[slice(*subwords[0])]]
+
+    # buffered parts and catenated words as (start offset, position increment, term), where
+    # the position increments (0 for stacked tokens) only matter for their order
+    buffered = []
+    concat, concat_type = [], 0
+    has_output = False
+
+    def flush():
+        nonlocal has_output
+        if len(concat) > 1:
+            buffered.append((concat[0][0], 0 if has_output else 1, "".join(token[s:e] for s, e in concat)))
+            has_output = True
+        concat.clear()
+
+    for i, (start, stop) in enumerate(subwords):
+        word_type = _ALPHA if types[start] & _ALPHA and not types[start] & _DIGIT else types[start]
+        if concat and not concat_type & word_type:
+            flush()
+            has_output = False
+        if word_type & _ALPHA:
+            if not concat:
+                concat_type = word_type
+            concat.append((start, stop))
+        buffered.append((start, 1 if has_output or i else 0, token[start:stop]))
+        has_output = True
+    flush()
+    buffered.sort(key=lambda part: (part[0], -part[1]))
+    return [token] + [term for _, _, term in buffered]
+
+
+def lowercase(term):
+    """Lowercases term code point by code point, as Lucene's LowerCaseFilter."""
+    if term.isascii():
+        return term.lower()
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in term).replace("\u0130", "i")
+
+
+def analyze_standard(text, min_shingle_size=2, max_shingle_size=5):
+    """
+    Emulates taxonomy_standard analyzer. Returns a list of positions, each a list of the unigram
+    and the shingles starting at the position.
+    """
+    tokens = [lowercase(term) for token in standard_tokens(text) for term in word_delimiter(token)]
+    return [[token] + [" ".join(tokens[i:i + size]) for size in range(min_shingle_size, max_shingle_size + 1)
+                       if i + size <= len(tokens)]
+            for i, token in enumerate(tokens)]
+
+
+_ngram_run_re = re.compile(r"[^\W_]+")
+
+
+def analyze_ngrams(text, min_gram=2, max_gram=4):
+    """Emulates taxonomy_ngrams analyzer. Returns a list of positions, a single n-gram each."""
+    positions = []
+    for m in _ngram_run_re.finditer(text):
+        # runs of word characters can include numbers other than digits (e.g., superscripts)
+        runs = [m.group()] if m.group().isascii() else \
+            "".join(c if c.isalpha() or c.isdecimal() else " " for c in m.group()).split()
+        for run in map(lowercase, runs):
+            for start in range(len(run)):
+                positions.extend([run[start:start + size]] for size in range(min_gram, max_gram + 1)
+                                 if start + size <= len(run))
+    return positions
+
+
+# Lucene's SmallFloat.intToByte4 / byte4ToInt used to store field lengths in a single byte
+def _long_to_int4(i):
+    num_bits = i.bit_length()
+    if num_bits < 4:
+        return i
+    shift = num_bits - 4
+    return ((i >> shift) & 0x07) | ((shift + 1) << 3)
+
+
+def _int4_to_long(i):
+    bits = i & 0x07
+    shift = (i >> 3) - 1
+    return bits if shift == -1 else (bits | 0x08) << shift
+
+
+_num_free_values = 255 - _long_to_int4(2 ** 31 - 1)
+
+
+def quantize_length(length):
+    """Returns field length as decoded by Lucene from its one byte encoding."""
+    if length < _num_free_values:
+        return length
+    return _num_free_values + _int4_to_long(_long_to_int4(length - _num_free_values))
+
+
+class FieldIndex:
+    """
+    Postings of a single field stored as CSR arrays: documents containing term t and term frequencies
+    are docs[indptr[t]:indptr[t+1]] and freqs[indptr[t]:indptr[t+1]].
+
+    Field length of a document is the number of its positions, while the average field length
+    counts all terms, including shingles.
+    """
+    def __init__(self, values, analyzer, k1=1.2, b=0.75):
+        self.terms = {}
+        postings = []
+        lengths = np.zeros(len(values), dtype=np.int64)
+        total_freq = 0
+        for doc, value in enumerate(values):
+            if value is None:
+                continue
+            positions = analyzer(value)
+            lengths[doc] = quantize_length(len(positions))
+            for term, freq in Counter(term for terms in positions for term in terms).items():
+                postings.append((self.terms.setdefault(term, len(self.terms)), doc, freq))
+                total_freq += freq
+
+        postings.sort()
+        self.docs = np.array([doc for term, doc, freq in postings], dtype=np.int32)
+        self.freqs = np.array([freq for term, doc, freq in postings], dtype=np.float32)
+        self.indptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount([term for term, doc, freq in postings], minlength=len(self.terms)),
+                  out=self.indptr[1:])
+
+        # scores are computed in single precision in the order of Lucene's BM25Similarity
+        self.k1 = np.float32(k1)
+        self.b = np.float32(b)
+        self.doc_count = len(np.unique(self.docs))
+        self.avg_length = np.float32(total_freq / self.doc_count if self.doc_count else 1.0)
+        self.lengths = lengths
+        self.norms = self.k1 * ((np.float32(1) - self.b) + self.b * lengths.astype(np.float32) / self.avg_length)
+        self.analyzer = analyzer
+
+    def idf(self, doc_freq):
+        return np.float32(math.log(1 + (self.doc_count - doc_freq + 0.5) / (doc_freq + 0.5)))
+
+    def postings(self, term):
+        idx = self.terms.get(term)
+        if idx is None:
+            return self.docs[:0], self.freqs[:0]
+        start, end = self.indptr[idx], self.indptr[idx + 1]
+        return self.docs[start:end], self.freqs[start:end]
+
+    def synonym_postings(self, terms):
+        """
+        Returns documents containing any of terms, their summed term frequencies and the highest
+        document frequency of terms, as scored by Lucene's SynonymQuery.
+        """
+        postings = [self.postings(term) for term in terms]
+        if len(postings) == 1:
+            docs, freqs = postings[0]
+            return docs, freqs, len(docs)
+        doc_freq = max(len(docs) for docs, _ in postings)
+        docs, inverse = np.unique(np.concatenate([docs for docs, _ in postings]), return_inverse=True)
+        freqs = np.bincount(inverse, weights=np.concatenate([freqs for _, freqs in postings]),
+                            minlength=len(docs)).astype(np.float32)
+        return docs, freqs, doc_freq
+
+    def clauses(self, query):
+        """Returns distinct clauses of the query of the field, i.e., terms at each position, and their counts."""
+        return Counter(tuple(sorted(set(terms))) for terms in self.analyzer(query))
+
+    def clause_scores(self, terms, boost):
+        """Returns documents matching the clause of terms and their scores."""
+        docs, freqs, doc_freq = self.synonym_postings(terms)
+        if not len(docs):
+            return docs, freqs
+        # Elasticsearch 6 scores include the (k1 + 1) factor dropped by Lucene 8
+        weight = np.float32(boost) * (np.float32(1) + self.k1) * self.idf(doc_freq)
+        return docs, weight * (freqs / (freqs + self.norms[docs].astype(np.float64))).astype(np.float32)
+
+    def scores(self, query, boost, out):
+        """Sets out to the scores of documents for the query, returns a mask of matching documents."""
+        matching = np.zeros(len(out), dtype=bool)
+        scores = np.zeros(len(out))
+        for terms, count in self.clauses(query).items():
+            docs, clause_scores = self.clause_scores(terms, boost * count)
+            scores[docs] += clause_scores
+            matching[docs] = True
+        out[:] = scores.astype(np.float32)
+        return matching
+
+    def explain(self, field, query, boost, doc):
+        details = []
+        for terms, count in self.clauses(query).items():
+            docs, freqs, doc_freq = self.synonym_postings(terms)
+            pos = np.searchsorted(docs, doc)
+            if pos >= len(docs) or docs[pos] != doc:
+                continue
+            _, score = self.clause_scores(terms, boost * count)
+            clause = " ".join(f"{field}:{term}" for term in terms)
+            details.append(dict(
+                value=float(score[pos]),
+                description=f"weight(Synonym({clause}) in {doc}), result of:" if len(terms) > 1 else
+                            f"weight({clause} in {doc}), result of:",
+                details=[
+                    dict(value=float(np.float32(boost * count) * (np.float32(1) + self.k1)), description="boost",
+                         details=[]),
+                    dict(value=float(self.idf(doc_freq)),
+                         description="idf, computed as log(1 + (N - n + 0.5) / (n + 0.5)) from:",
+                         details=[dict(value=doc_freq, description="n, number of documents containing term",
+                                       details=[]),
+                                  dict(value=self.doc_count, description="N, total number of documents with field",
+                                       details=[])]),
+                    dict(value=float(freqs[pos]), description="freq, occurrences of term within document",
+                         details=[]),
+                    dict(value=float(self.k1), description="k1, term saturation parameter", details=[]),
+                    dict(value=float(self.b), description="b, length normalization parameter", details=[]),
+                    dict(value=float(self.lengths[doc]), description="dl, length of field", details=[]),
+                    dict(value=float(self.avg_length), description="avgdl, average length of field", details=[])
+                ]))
+        return dict(value=float(np.float32(sum(d["value"] for d in details))), description="sum of:",
+                    details=details)
+
+
+field_re = re.compile(r"^(?P<field>[^\^]+)(\^(?P<boost>[0-9.]+))?$")
+
+
+class TaxonomyIndex:
+    """
+    In-memory BM25 index of taxonomy entries usable in place of Elasticsearch client in `MatchSearch`.
+    Supports `search`, `msearch` and `explain` with multi_match (best_fields) queries.
+
+    Parameters
+    ----------
+    documents: list of dictionaries with task, dataset, metric and optionally custom fields
+    ids: list of documents' ids, by default positions of documents
+    """
+    fields = ["dataset", "task", "metric", "custom"]
+    index_name = "et_taxonomy"
+
+    def __init__(self, documents, ids=None):
+        self.documents = list(documents)
+        self.ids = [str(i) for i in range(len(self.documents))] if ids is None else [str(i) for i in ids]
+        self.id_positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.field_indices = {}
+        for field in self.fields:
+            values = [doc.get(field) for doc in self.documents]
+            self.field_indices[field] = FieldIndex(values, analyze_standard)
+            self.field_indices[field + ".ngrams"] = FieldIndex(values, analyze_ngrams)
+
+    @classmethod
+    def from_taxonomy(cls, taxonomy):
+        return cls([dict(task=r["task"], dataset=r["dataset"], metric=r["metric"]) for r in taxonomy.canonical_records])
+
+    @staticmethod
+    def _parse_query(body):
+        query = body["query"]
+        if "multi_match" not in query:
+            raise ValueError(f"Unsupported query: {query}")
+        multi_match = query["multi_match"]
+        fields = []
+        for spec in multi_match["fields"]:
+            m = field_re.match(spec)
+            fields.append((m.group("field"), float(m.group("boost") or 1.0)))
+        return multi_match["query"], fields
+
+    def _scores(self, body):
+        query, fields = self._parse_query(body)
+        # best_fields: score of a document is the score of its best matching field
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        matching = np.zeros(len(self.documents), dtype=bool)
+        field_scores = np.zeros(len(self.documents), dtype=np.float32)
+        for field, boost in fields:
+            if field in self.field_indices:
+                matching |= self.field_indices[field].scores(query, boost, field_scores)
+                np.maximum(scores, field_scores, out=scores)
+        return scores, matching
+
+    def _source(self, doc, source):
+        if source is True:
+            return dict(self.documents[doc])
+        return {k: v for k, v in self.documents[doc].items() if k in source}
+
+    def search(self, index=None, doc_type=None, body=None, params=None):
+        size = body.get("size", 10)
+        source = body.get("_source", True)
+        scores, matching = self._scores(body)
+        matching = np.flatnonzero(matching)
+        order = matching[np.argsort(-scores[matching], kind="stable")][:size]
+        hits = []
+        for doc in order:
+            hit = {"_index": self.index_name, "_type": "doc", "_id": self.ids[doc], "_score": float(scores[doc])}
+            if source:
+                hit["_source"] = self._source(doc, source)
+            hits.append(hit)
+        return {"hits": {"total": len(matching), "max_score": hits[0]["_score"] if hits else None, "hits": hits}}
+
+    def msearch(self, body, index=None, doc_type=None, params=None):
+        return {"responses": [self.search(index, doc_type, query) for query in body[1::2]]}
+
+    def explain(self, index=None, doc_type=None, id=None, body=None, params=None):
+        doc = self.id_positions[str(id)]
+        query, fields = self._parse_query(body)
+        details = [self.field_indices[field].explain(field, query, boost, doc)
+                   for field, boost in fields if field in self.field_indices]
+        details = [d for d in details if d["details"]]
+        score = max((d["value"] for d in details), default=0.0)
+        return {"_index": self.index_name, "_type": "doc", "_id": self.ids[doc], "matched": bool(details),
+                "explanation": dict(value=score, description="max of:", details=details)}
@@ -11,6 +11,7 @@ import logging
 import spacy
 from scispacy.abbreviation import AbbreviationDetector
 from axcell.models.linking.format import extract_value
+from axcell.models.linking.lru_cache import LRUCache
 
 
 @dataclass()
@@ -122,28 +123,70 @@ def mkquery_fullmatch(query):
         }
     }
 
+split_re = re.compile('([^a-zA-Z0-9])')
+
+# (short form, long form) -> True if scispacy recognizes the long form of the abbreviation,
+# shared by all MatchSearch instances, so it persists across papers
+abbreviations_cache = LRUCache(maxsize=1000000)
+
+
 class MatchSearch:
-    def __init__(self, mkquery=mkquery_ngrams, es=None):
+    """
+    Links cells to taxonomy entries with full-text search of the cell's query and table caption
+    in an Elasticsearch index of taxonomy entries.
+
+    Parameters
+    ----------
+    es: Elasticsearch client or an object with the same search API, e.g.,
+        `axcell.models.linking.bm25_index.TaxonomyIndex` built from the taxonomy entries
+    taxonomy: optional `Taxonomy`, its metric ranges are used to convert values of linked cells
+    """
+    def __init__(self, mkquery=mkquery_ngrams, es=None, norm_cache_size=10000, abbreviations_batch_size=256,
+                 taxonomy=None):
         self.case = True
         self.all_fields = True
         self.es = es or Elasticsearch()
         self.log = logging.getLogger(__name__)
         self.mkquery = mkquery
+        self.taxonomy = taxonomy
+        # normalization scores depend only on the dataset name
+        self.norm_scores = LRUCache(maxsize=norm_cache_size)
+        self.abbreviations_batch_size = abbreviations_batch_size
+        self._nlp = None
 
-        self.nlp = spacy.load("en_core_web_sm")
-        abbreviation_pipe = AbbreviationDetector(self.nlp)
-        self.nlp.add_pipe(abbreviation_pipe)
-        self.nlp.disable_pipes("tagger", "ner", "parser")
+    # loading the spacy model is slow and it's needed only to resolve abbreviations
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            nlp = spacy.load("en_core_web_sm")
+            abbreviation_pipe = AbbreviationDetector(nlp)
+            nlp.add_pipe(abbreviation_pipe)
+            nlp.disable_pipes("tagger", "ner", "parser")
+            self._nlp = nlp
+        return self._nlp
+
+    def resolve_abbreviations(self, pairs):
+        """
+        For each (short, long) pair returns True if long is recognized as the long form of short.
+        Results are memoized in a process-wide cache and pairs missing from it are processed
+        in batches with `nlp.pipe`.
+        """
+        resolved = {pair: abbreviations_cache.get(pair) for pair in dict.fromkeys(pairs)}
+        missing = [pair for pair, is_abbreviation in resolved.items() if is_abbreviation is None]
+        if not missing:
+            return [resolved[pair] for pair in pairs]
+        # "!" is a workaround to scispacy error
+        docs = self.nlp.pipe((f"! {ds} ({dataset})" for dataset, ds in missing),
+                             batch_size=self.abbreviations_batch_size)
+        for (dataset, ds), doc in zip(missing, docs):
+            resolved[(dataset, ds)] = any(str(abrv) == dataset and str(abrv._.long_form) == ds
+                                          for abrv in doc._.abbreviations)
+            abbreviations_cache[(dataset, ds)] = resolved[(dataset, ds)]
+        return [resolved[pair] for pair in pairs]
 
     def match_abrv(self, dataset, datasets):
-        abrvs = []
-        for ds in datasets:
-            # "!" is a workaround to scispacy error
-            doc = self.nlp(f"! {ds} ({dataset})")
-            for abrv in doc._.abbreviations:
-                if str(abrv) == dataset and str(abrv._.long_form) == ds:
-                    abrvs.append(str(abrv._.long_form))
-        abrvs = list(set(abrvs))
+        resolved = self.resolve_abbreviations([(dataset, ds) for ds in datasets])
+        abrvs = list(set(ds for ds, is_abbreviation in zip(datasets, resolved) if is_abbreviation))
         if len(abrvs) == 1:
             print(f"abrv. for {dataset}: {abrvs[0]}")
             return abrvs[0]
@@ -153,9 +196,13 @@ class MatchSearch:
             print(f"Multiple abrvs. for {dataset}: {abrvs}")
             return None
 
-    def preproc(self, val, datasets=None):
+    @staticmethod
+    def _clean(val):
         val = val.strip(',- ')
-        val = re.sub("dataset", '', val, flags=re.I)
+        return re.sub("dataset", '', val, flags=re.I)
+
+    def preproc(self, val, datasets=None):
+        val = self._clean(val)
         if datasets:
             abrv = self.match_abrv(val, datasets)
             if abrv:
@@ -172,13 +219,42 @@ class MatchSearch:
             return self.es.explain('et_taxonomy', doc_type='doc', id=explain_doc_id, body=body)
         return self.es.search('et_taxonomy', doc_type='doc', body=body)["hits"]
 
-    def __call__(self, query, datasets, caption):
-        split_re = re.compile('([^a-zA-Z0-9])')
-        query = self.preproc(query, datasets).strip()
-        if caption:
-            query += " " + self.preproc(caption).strip()[:400]
-        results = self.search(query)
-        hits = results["hits"][:3]
+    def msearch(self, queries, size=10, source=True):
+        """
+        Runs many queries in a single request. Returns a list of hits of each query, with
+        only dataset, metric and task fields of documents if source is True and no fields otherwise.
+        """
+        if not queries:
+            return []
+        body = []
+        for query in queries:
+            body.append({})
+            body.append(dict(self.mkquery(query), size=size, _source=["dataset", "metric", "task"] if source else False))
+        responses = self.es.msearch(body=body, index='et_taxonomy', doc_type='doc')["responses"]
+        for query, response in zip(queries, responses):
+            if "error" in response:
+                raise RuntimeError(f"Elasticsearch query '{query}' failed: {response['error']}")
+        return [response["hits"] for response in responses]
+
+    def normalization_scores(self, datasets):
+        """
+        Returns (ok_score, bad_score) for each dataset name: scores of the best and the second best
+        hit of a query with the dataset name, divided by its length, NaN if there are fewer hits.
+        Scores are memoized and all datasets missing from the cache are searched for in a single request.
+        """
+        scores = {dataset: self.norm_scores.get(dataset) for dataset in dict.fromkeys(datasets)}
+        missing = [dataset for dataset, score in scores.items() if score is None]
+        for dataset, hits in zip(missing, self.msearch(missing, size=2, source=False)):
+            length = len(split_re.split(dataset))
+            hit_scores = [hit['_score'] / length for hit in hits['hits'][:2]]
+            scores[dataset] = tuple(hit_scores + [np.nan] * (2 - len(hit_scores)))
+            self.norm_scores[dataset] = scores[dataset]
+        return [scores[dataset] for dataset in datasets]
+
+    def cache_info(self):
+        return dict(norm_scores=self.norm_scores.info())
+
+    def _proposals(self, query, hits, norm_scores):
         df = pd.DataFrame.from_records([
             dict(**hit["_source"],
                  confidence=hit["_score"] / len(split_re.split(query)),
@@ -188,17 +264,44 @@ class MatchSearch:
         if not len(df):
             self.log.debug("Elastic query didn't produce any output", query, hits)
         else:
-            scores = []
-            for dataset in df["dataset"]:
-                r = self.search(dataset)
-                scores.append(
-                    dict(ok_score=r['hits'][0]['_score'] / len(split_re.split(dataset)),
-                         bad_score=r['hits'][1]['_score'] / len(split_re.split(dataset))))
-
-            scores = pd.DataFrame.from_records(scores)
-            df['confidence'] = ((scores['ok_score'] - scores['bad_score']) / scores['bad_score']) * df['confidence'] / scores['ok_score']
+            scores = pd.DataFrame.from_records([norm_scores[dataset] for dataset in df["dataset"]],
+                                               columns=["ok_score", "bad_score"])
+            normalized = ((scores['ok_score'] - scores['bad_score']) / scores['bad_score']) * df['confidence'] / scores['ok_score']
+            # confidence of datasets without the second best hit is not normalized
+            df['confidence'] = normalized.where(scores['bad_score'] > 0, df['confidence'])
         return df[["dataset", "metric", "task", "confidence", "evidence"]]
 
+    def match_many(self, queries, datasets, caption):
+        """
+        Links many cells sharing datasets and caption (e.g., all cells of a table) with two requests:
+        one with all distinct queries and one with names of found datasets missing from normalization cache.
+        Returns a list of proposals frames, one per query.
+        """
+        if datasets:
+            # resolve abbreviations of all queries in a single batch
+            self.resolve_abbreviations([(self._clean(query), ds) for query in queries for ds in datasets])
+        caption_query = " " + self.preproc(caption).strip()[:400] if caption else ""
+        queries = [self.preproc(query, datasets).strip() + caption_query for query in queries]
+        # the same query can appear many times in a table
+        distinct = list(dict.fromkeys(queries))
+        all_hits = {query: hits["hits"][:3] for query, hits in zip(distinct, self.msearch(distinct, size=3))}
+        found = list(dict.fromkeys(hit["_source"]["dataset"] for hits in all_hits.values() for hit in hits))
+        norm_scores = dict(zip(found, self.normalization_scores(found)))
+        return [self._proposals(query, all_hits[query], norm_scores) for query in queries]
+
+    def link_cells(self, queries, paper_context, abstract_context, table_context, caption, topk=1, debug_infos=None):
+        """
+        Links many cells of a single table with `match_many`. Has the same interface as
+        `ContextSearch.link_cells`, so that proposals generation searches for all cells of a table
+        at once. As with single queries, abbreviations are not expanded (no datasets are given).
+        Returns a list of proposals frames, one per query. Linked metrics are never complementary.
+        """
+        return [df.head(topk).assign(true_metric=df["metric"])
+                for df in self.match_many(queries, None, caption)]
+
+    def __call__(self, query, datasets, caption):
+        return self.match_many([query], datasets, caption)[0]
+
 float_pm_re = re.compile(r"(±?)([+-]?\s*(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?)\s*(%?)")
 whitespace_re = re.compile(r"\s+")
 def handle_pm(value):
@@ -214,6 +317,23 @@ def handle_pm(value):
             # %%
 
 
+def _convert_value(value, percentage, rng, complementary):
+    # has to be called with InvalidOperation trap disabled
+    parsed = MetricValue(value, '%' if percentage else None)
+
+    if complementary:
+        parsed = parsed.complement()
+    if rng == '0-1':
+        parsed = parsed.to_percentage() / 100
+    elif rng == '1-100':
+        parsed = parsed.to_percentage()
+    elif rng == 'abs':
+        parsed = parsed.to_absolute()
+    else:
+        parsed = parsed.to_unitless()
+    return parsed
+
+
 def convert_metric(raw_value, rng, complementary):
     format = "{x}"
 
@@ -224,43 +344,127 @@ def convert_metric(raw_value, rng, complementary):
     with localcontext() as ctx:
         ctx.traps[InvalidOperation] = 0
         parsed = extract_value(raw_value, format)
-        parsed = MetricValue(parsed, '%' if percentage else None)
-
-        if complementary:
-            parsed = parsed.complement()
-        if rng == '0-1':
-            parsed = parsed.to_percentage() / 100
-        elif rng == '1-100':
-            parsed = parsed.to_percentage()
-        elif rng == 'abs':
-            parsed = parsed.to_absolute()
-        else:
-            parsed = parsed.to_unitless()
-    return parsed
+        return _convert_value(parsed, percentage, rng, complementary)
+
+
+class TableValues:
+    """
+    Numeric values of table cells. Percent signs are found for all cells at once, while parsing
+    and conversion to `Decimal` values run once per distinct raw value and are then broadcast
+    to the cells. Converted values are the same as computed by `convert_metric`.
+
+    Parameters
+    ----------
+    raw_values: list of raw values of cells
+
+    Attributes
+    ----------
+    values: object array of parsed `Decimal` values (NaN if the value can't be parsed)
+    percent: boolean array, True if the raw value contains a percent sign
+    valid: boolean array, True if the value was parsed
+    """
+    def __init__(self, raw_values):
+        raw_values = np.array([str(value) for value in raw_values], dtype=str)
+        unique, self._inverse = np.unique(raw_values, return_inverse=True)
+        self._percent = np.char.find(unique, '%') >= 0
+        self._values = np.empty(len(unique), dtype=object)
+        with localcontext() as ctx:
+            ctx.traps[InvalidOperation] = 0
+            for i, (value, percentage) in enumerate(zip(unique, self._percent)):
+                self._values[i] = extract_value(str(value), "{x}%" if percentage else "{x}")
+        self._valid = np.array([not value.is_nan() for value in self._values], dtype=bool)
+        self.percent = self._percent[self._inverse]
+        self.values = self._values[self._inverse]
+        self.valid = self._valid[self._inverse]
+        self._converted = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def converted(self, rng, complementary):
+        """Returns float array of values converted to a given metric range (see `convert_metric`)."""
+        key = (rng, complementary)
+        if key not in self._converted:
+            converted = np.full(len(self._values), np.nan)
+            with localcontext() as ctx:
+                ctx.traps[InvalidOperation] = 0
+                for i in np.flatnonzero(self._valid):
+                    converted[i] = float(_convert_value(self._values[i], self._percent[i], rng, complementary))
+            self._converted[key] = converted[self._inverse]
+        return self._converted[key]
+
 
 proposal_columns = ['dataset', 'metric', 'task', 'format', 'raw_value', 'model', 'model_type', 'cell_ext_id',
                     'confidence', 'parsed', 'struct_model_type', 'struct_dataset']
 
 
-def generate_proposals_for_table(table_ext_id,  matrix, structure, desc, taxonomy_linking,
-                                 paper_context, abstract_context, table_context, topk=1):
+number_re = re.compile(r'(^[± Ee/()^0-9.%,_+-]{2,}$)|(^\s*[0-9]\s*$)')
+
+
+def numeric_cells_mask(matrix, structure):
+    """Returns a boolean mask of untagged cells looking like numbers, each distinct value is matched once."""
+    if not matrix.size:
+        return np.zeros(matrix.shape, dtype=bool)
+    values, inverse = np.unique(matrix, return_inverse=True)
+    numeric = np.array([number_re.match(value.strip()) is not None for value in values], dtype=bool)
+    return numeric[inverse].reshape(matrix.shape) & (structure == '')
+
+
+class HeaderAnnotations:
+    """
+    Values of cells with a given type of tag (e.g., 'model' or 'dataset') preceding each cell
+    in its row and then in its column, precomputed once per table.
+    """
+    def __init__(self, matrix, structure, type):
+        is_type = np.char.find(structure.astype(str), type) >= 0
+        rows, cols = is_type.shape
+        # number of tagged cells before each cell in its row and in its column
+        self.row_counts = np.cumsum(is_type, axis=1) - is_type
+        self.col_counts = np.cumsum(is_type, axis=0) - is_type
+        self.row_values = [[Value(structure[r, c], matrix[r, c]) for c in np.flatnonzero(is_type[r])]
+                           for r in range(rows)]
+        self.col_values = [[Value(structure[r, c], matrix[r, c]) for r in np.flatnonzero(is_type[:, c])]
+                           for c in range(cols)]
+
+    def __call__(self, r, c):
+        return self.row_values[r][:self.row_counts[r, c]] + self.col_values[c][:self.col_counts[r, c]]
+
+
+class ProposalColumns:
+    """
+    Column buffers of linked proposals, turned into a single data frame with `proposal_columns`.
+    """
+    def __init__(self):
+        self.columns = {column: [] for column in proposal_columns}
+
+    def __len__(self):
+        return len(self.columns['cell_ext_id'])
+
+    def extend(self, **columns):
+        for name, values in columns.items():
+            self.columns[name].extend(values)
+
+    def frame(self):
+        if not len(self):
+            # specify columns in case there's no proposal
+            return pd.DataFrame(columns=proposal_columns)
+        return pd.DataFrame(self.columns, columns=proposal_columns)
+
+
+def add_proposals_for_table(columns, table_ext_id, matrix, structure, desc, taxonomy_linking,
+                            paper_context, abstract_context, table_context, topk=1, session=None):
+    """
+    Links numeric cells of a table and appends proposals to `columns` (a `ProposalColumns` instance).
+    """
     # %%
     # Proposal generation
-    def consume_cells(matrix):
-        for row_id, row in enumerate(matrix):
-            for col_id, cell in enumerate(row):
-                yield (row_id, col_id, cell)
-
-
-    def annotations(r, c, type='model'):
-        for nc in range(0, c):
-            if type in structure[r, nc]:
-                yield Value(structure[r, nc], matrix[r, nc])
-        for nr in range(0, r):
-            if type in structure[nr, c]:
-                yield Value(structure[nr, c], matrix[nr, c])
-
-    number_re = re.compile(r'(^[± Ee/()^0-9.%,_+-]{2,}$)|(^\s*[0-9]\s*$)')
+    if matrix.ndim == 2:
+        models = HeaderAnnotations(matrix, structure, 'model')
+        datasets = HeaderAnnotations(matrix, structure, 'dataset')
+        cells = np.argwhere(numeric_cells_mask(matrix, structure)).tolist()
+    else:
+        # table without any cells
+        cells = []
 
     proposals = [Proposal(
         cell=Cell(cell_ext_id=f"{table_ext_id}/{r}.{c}",
@@ -270,11 +474,12 @@ def generate_proposals_for_table(table_ext_id,  matrix, structure, desc, taxonom
                   ),
         # TODO Add table type: sota / error ablation
         table_description=desc,
-        model_values=list(annotations(r, c, 'model')),
-        dataset_values=list(annotations(r, c, 'dataset')),
-        raw_value=val)
-        for r, c, val in consume_cells(matrix)
-        if structure[r, c] == '' and number_re.match(matrix[r, c].strip())]
+        model_values=models(r, c),
+        dataset_values=datasets(r, c),
+        raw_value=matrix[r, c])
+        for r, c in cells]
+    if not proposals:
+        return columns
 
     # def empty_proposal(cell_ext_id, reason):
     #     np = "not-present"
@@ -283,64 +488,70 @@ def generate_proposals_for_table(table_ext_id,  matrix, structure, desc, taxonom
     #         model_type=np, cell_ext_id=cell_ext_id, confidence=-1, debug_reason=reason
     #     )
 
-    def linked_proposals(proposals):
-        for prop in proposals:
-            # heuristyic to handle accuracy vs error
-            format = "{x}"
-
-            percentage = '%' in prop.raw_value
-            if percentage:
-                format += '%'
-
-            df = taxonomy_linking(prop.dataset, paper_context, abstract_context, table_context,
-                                  desc, topk=topk, debug_info=prop)
-            for _, row in df.iterrows():
-                raw_value = prop.raw_value
-                task = row['task']
-                dataset = row['dataset']
-                metric = row['metric']
-
-                complementary = False
-                if metric != row['true_metric']:
-                    metric = row['true_metric']
-                    complementary = True
-
-                # todo: pass taxonomy directly to proposals generation
-                ranges = taxonomy_linking.taxonomy.metrics_range
-                key = (task, dataset, metric)
-                rng = ranges.get(key, '')
-                if not rng: rng = ranges.get(metric, '')
-
-                parsed = float(convert_metric(raw_value, rng, complementary))
-
-                linked = {
-                    'dataset': dataset,
-                    'metric': metric,
-                    'task': task,
-                    'format': format,
-                    'raw_value': raw_value,
-                    'model': prop.model_name,
-                    'model_type': prop.model_type,
-                    'cell_ext_id': prop.cell.cell_ext_id,
-                    'confidence': row['confidence'],
-                    'struct_model_type': prop.model_type,
-                    'struct_dataset': prop.dataset,
-                    'parsed': parsed
-                }
-                yield linked
-
-    # specify columns in case there's no proposal
-
-    proposals = pd.DataFrame.from_records(list(linked_proposals(proposals)), columns=proposal_columns)
-    return proposals
+    # taxonomy linkers return, for each cell, record arrays or data frames of linked proposals
+    if session is not None:
+        linked = session.link_cells([prop.dataset for prop in proposals], table_context, desc,
+                                    topk=topk, debug_infos=proposals)
+    elif hasattr(taxonomy_linking, "link_cells"):
+        linked = taxonomy_linking.link_cells([prop.dataset for prop in proposals], paper_context, abstract_context,
+                                             table_context, desc, topk=topk, debug_infos=proposals)
+    else:
+        linked = (taxonomy_linking(prop.dataset, paper_context, abstract_context, table_context,
+                                   desc, topk=topk, debug_info=prop) for prop in proposals)
+    values = TableValues([prop.raw_value for prop in proposals])
+    # todo: pass taxonomy directly to proposals generation
+    taxonomy = getattr(taxonomy_linking, "taxonomy", None)
+    ranges = taxonomy.metrics_range if taxonomy is not None else {}
+    for i, (prop, records) in enumerate(zip(proposals, linked)):
+        n = len(records)
+        # heuristyic to handle accuracy vs error
+        format = "{x}%" if values.percent[i] else "{x}"
+        tasks = list(records['task'])
+        datasets = list(records['dataset'])
+        metrics = []
+        parsed = []
+        for task, dataset, metric, true_metric in zip(tasks, datasets, records['metric'], records['true_metric']):
+            complementary = metric != true_metric
+            metric = true_metric
+
+            rng = ranges.get((task, dataset, metric), '')
+            if not rng: rng = ranges.get(metric, '')
+
+            metrics.append(metric)
+            parsed.append(values.converted(rng, complementary)[i])
+
+        columns.extend(
+            dataset=datasets,
+            metric=metrics,
+            task=tasks,
+            format=[format] * n,
+            raw_value=[prop.raw_value] * n,
+            model=[prop.model_name] * n,
+            model_type=[prop.model_type] * n,
+            cell_ext_id=[prop.cell.cell_ext_id] * n,
+            confidence=list(records['confidence']),
+            struct_model_type=[prop.model_type] * n,
+            struct_dataset=[prop.dataset] * n,
+            parsed=parsed
+        )
+    return columns
+
+
+def generate_proposals_for_table(table_ext_id,  matrix, structure, desc, taxonomy_linking,
+                                 paper_context, abstract_context, table_context, topk=1, session=None):
+    return add_proposals_for_table(ProposalColumns(), table_ext_id, matrix, structure, desc, taxonomy_linking,
+                                   paper_context, abstract_context, table_context, topk=topk, session=session).frame()
 
 
 def linked_proposals(paper_ext_id, paper, annotated_tables, taxonomy_linking=None,
                      dataset_extractor=None, topk=1):
     #                     dataset_extractor=DatasetExtractor()):
-    proposals = []
-    paper_context, abstract_context = dataset_extractor.from_paper(paper)
-    table_contexts = dataset_extractor.get_table_contexts(paper, annotated_tables)
+    # proposals of all tables are accumulated column-wise into a single data frame
+    proposals = ProposalColumns()
+    paper_context, abstract_context, table_contexts = dataset_extractor.contexts(paper, annotated_tables)
+    session = None
+    if hasattr(taxonomy_linking, "session"):
+        session = taxonomy_linking.session(paper_context, abstract_context)
     #print(f"Extracted datasets: {datasets}")
     for idx, (table, table_context) in enumerate(zip(annotated_tables, table_contexts)):
         matrix = np.array(table.matrix)
@@ -350,16 +561,12 @@ def linked_proposals(paper_ext_id, paper, annotated_tables, taxonomy_linking=Non
         table_ext_id = f"{paper_ext_id}/{table.name}"
 
         if 'sota' in tags and 'no_sota_records' not in tags: # only parse tables that are marked as sota
-            proposals.append(
-                generate_proposals_for_table(
-                    table_ext_id, matrix, structure, desc, taxonomy_linking,
-                    paper_context, abstract_context, table_context,
-                    topk=topk
-                )
+            add_proposals_for_table(
+                proposals, table_ext_id, matrix, structure, desc, taxonomy_linking,
+                paper_context, abstract_context, table_context,
+                topk=topk, session=session
             )
-    if len(proposals):
-        return pd.concat(proposals)
-    return pd.DataFrame(columns=proposal_columns)
+    return proposals.frame()
 
 
 def test_link_taxonomy():
@@ -0,0 +1,173 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+# A linking bundle is a single file containing everything needed to construct
+# Taxonomy, EvidenceFinder and ContextSearch without reading the json files,
+# computing auto evidences, building automata or computing probabilities.
+#
+# File layout:
+#   magic (8 bytes) | version (uint32) | header length (uint64) | pickled header | padding | arrays
+# The header contains pickled taxonomy, evidence finder (including Aho-Corasick automata),
+# interned names of axes and evidences, offsets of probability arrays and digests of the
+# source files, so that outdated bundles can be detected. The arrays are memory-mapped on load,
+# so processes forked after loading share their pages.
+
+import hashlib
+from pathlib import Path
+import pickle
+import struct
+import warnings
+
+import numpy as np
+
+from axcell.models.linking.taxonomy import Taxonomy
+from axcell.models.linking.context_search import EvidenceFinder, ContextSearch, get_sparse_axes
+from axcell.models.linking.sparse_scoring import SparseAxis
+
+
+BUNDLE_MAGIC = b"AXCLINK\0"
+BUNDLE_VERSION = 5
+_prefix = struct.Struct("<8sIQ")
+_alignment = 64
+
+
+def _align(offset):
+    return (offset + _alignment - 1) // _alignment * _alignment
+
+
+def file_digest(path):
+    """Returns sha1 digest of a file content, None if path is None."""
+    if path is None:
+        return None
+    return hashlib.sha1(Path(path).read_bytes()).hexdigest()
+
+
+def sources_digests(taxonomy_path, metrics_path, abbreviations_path=None, use_manual_dicts=False):
+    """Returns digests of everything a bundle is compiled from."""
+    return dict(taxonomy=file_digest(taxonomy_path), metrics=file_digest(metrics_path),
+                abbreviations=file_digest(abbreviations_path), use_manual_dicts=use_manual_dicts)
+
+
+class LinkingBundle:
+    """
+    Taxonomy, evidence finder and probabilities of evidences compiled from taxonomy.json,
+    metrics.json and abbreviations.json.
+
+    Parameters
+    ----------
+    sources: digests of the source files (see `sources_digests`), None if unknown
+    """
+    def __init__(self, taxonomy, evidence_finder, sparse_axes, sources=None):
+        self.taxonomy = taxonomy
+        self.evidence_finder = evidence_finder
+        self.sparse_axes = sparse_axes
+        self.sources = sources
+
+    @classmethod
+    def compile(cls, taxonomy_path, metrics_path, abbreviations_path=None, use_manual_dicts=False):
+        taxonomy = Taxonomy(taxonomy=taxonomy_path, metrics_info=metrics_path)
+        evidence_finder = EvidenceFinder(taxonomy, abbreviations_path=abbreviations_path,
+                                         use_manual_dicts=use_manual_dicts)
+        sources = sources_digests(taxonomy_path, metrics_path, abbreviations_path, use_manual_dicts)
+        return cls(taxonomy, evidence_finder, get_sparse_axes(taxonomy, evidence_finder), sources=sources)
+
+    def is_compiled_from(self, taxonomy_path, metrics_path, abbreviations_path=None, use_manual_dicts=False):
+        """Checks if the bundle was compiled from the current content of the source files."""
+        return self.sources == sources_digests(taxonomy_path, metrics_path, abbreviations_path, use_manual_dicts)
+
+    def context_search(self, backend="sparse", **kwargs):
+        """
+        Returns a ContextSearch over the bundled probabilities. The sparse backend scores directly
+        with the memory-mapped arrays, while the numba backend copies them into typed dicts first.
+        """
+        return ContextSearch(self.taxonomy, self.evidence_finder, sparse_axes=self.sparse_axes, backend=backend,
+                             **kwargs)
+
+    def save(self, path):
+        axes = []
+        arrays = []
+        offset = 0
+        for axis in self.sparse_axes:
+            names, evidences, data, indices, indptr = axis.to_arrays()
+            specs = []
+            for array in (data, indices, indptr):
+                array = np.ascontiguousarray(array)
+                offset = _align(offset)
+                specs.append((offset, array.dtype.str, array.shape))
+                arrays.append((offset, array))
+                offset += array.nbytes
+            axes.append((names, evidences, specs))
+        header = pickle.dumps(dict(
+            taxonomy=self.taxonomy,
+            evidence_finder=self.evidence_finder,
+            axes=axes,
+            sources=self.sources
+        ), protocol=pickle.HIGHEST_PROTOCOL)
+
+        data_start = _align(_prefix.size + len(header))
+        with Path(path).open("wb") as f:
+            f.write(_prefix.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(header)))
+            f.write(header)
+            for array_offset, array in arrays:
+                f.seek(data_start + array_offset)
+                f.write(array.tobytes())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        path = Path(path)
+        with path.open("rb") as f:
+            magic, version, header_len = _prefix.unpack(f.read(_prefix.size))
+            if magic != BUNDLE_MAGIC:
+                raise ValueError(f"{path} is not a linking bundle")
+            if version != BUNDLE_VERSION:
+                raise ValueError(f"Unsupported linking bundle version {version} (expected {BUNDLE_VERSION}), "
+                                 "recompile the bundle")
+            header = pickle.loads(f.read(header_len))
+        data_start = _align(_prefix.size + header_len)
+
+        def read_array(offset, dtype, shape):
+            if mmap:
+                return np.memmap(path, dtype=np.dtype(dtype), mode="r", offset=data_start + offset, shape=shape)
+            with path.open("rb") as f:
+                f.seek(data_start + offset)
+                return np.fromfile(f, dtype=np.dtype(dtype), count=int(np.prod(shape))).reshape(shape)
+
+        sparse_axes = tuple(
+            SparseAxis.from_arrays(names, evidences, *[read_array(*spec) for spec in specs])
+            for names, evidences, specs in header["axes"]
+        )
+        return cls(header["taxonomy"], header["evidence_finder"], sparse_axes, sources=header["sources"])
+
+
+def _sources(models_path):
+    abbreviations_path = models_path / "abbreviations.json"
+    return models_path / "taxonomy.json", models_path / "metrics.json", \
+        abbreviations_path if abbreviations_path.exists() else None
+
+
+def compile_bundle(models_path, output=None, use_manual_dicts=False):
+    """Compiles taxonomy.json, metrics.json and abbreviations.json from models_path into a linking bundle."""
+    models_path = Path(models_path)
+    bundle = LinkingBundle.compile(*_sources(models_path), use_manual_dicts=use_manual_dicts)
+    bundle.save(output or models_path / "linking.bundle")
+
+
+def load_bundle(models_path, path=None, use_manual_dicts=False, mmap=True):
+    """
+    Loads a linking bundle compiled with `compile_bundle` from models_path. If any of the source
+    files changed since the bundle was compiled, the bundle is compiled again (in memory only)
+    with a warning to recompile it.
+    """
+    models_path = Path(models_path)
+    path = path or models_path / "linking.bundle"
+    sources = _sources(models_path)
+    bundle = LinkingBundle.load(path, mmap=mmap)
+    if not bundle.is_compiled_from(*sources, use_manual_dicts=use_manual_dicts):
+        warnings.warn(f"Linking bundle {path} is outdated, compiling it from the sources in {models_path}. "
+                      f"Recompile it with python -m axcell.models.linking.bundle {models_path}")
+        bundle = LinkingBundle.compile(*sources, use_manual_dicts=use_manual_dicts)
+    return bundle
+
+
+if __name__ == "__main__":
+    from fire import Fire
+    Fire(compile_bundle)
@@ -1,10 +1,14 @@
 #  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
 
 # metrics[taxonomy name] is a list of normalized evidences for taxonomy name
+from bisect import bisect_right
 from collections import Counter
 
 from axcell.models.linking.acronym_extractor import AcronymExtractor
+from axcell.models.linking.lru_cache import LRUCache, PersistentCache
+from axcell.models.linking.taxonomy import SymbolTable
 from axcell.models.linking.probs import get_probs, reverse_probs
+from axcell.models.linking.sparse_scoring import SparseAxis, SparseScorer, top_k_indices
 from axcell.models.linking.utils import normalize_dataset, normalize_dataset_ws, normalize_cell, normalize_cell_ws
 from scipy.special import softmax
 import re
@@ -12,7 +16,9 @@ import pandas as pd
 import numpy as np
 import json
 import ahocorasick
-from numba import njit, typed, types
+from numba import njit, prange, typed, types
+import threading
+import hashlib
 from pathlib import Path
 
 from axcell.pipeline_logger import pipeline_logger
@@ -72,20 +78,100 @@ class EvidenceFinder:
         return list(set(evidences))
 
     @staticmethod
-    def find_names(text, names_trie):
-        text = text.lower()
+    def make_multi_trie(axes_names, symbols):
+        # payload of each word is its length and, for every axis, the name and id (in symbols)
+        # of evidence on that axis or None if the word isn't an evidence on the axis
+        entries = {}
+        for axis, names in enumerate(axes_names):
+            for name in names:
+                norm = name.replace(" ", "")
+                entry = entries.setdefault(norm, ([None] * len(axes_names), [None] * len(axes_names)))
+                entry[0][axis] = name
+                entry[1][axis] = symbols.ids[name]
+        trie = ahocorasick.Automaton()
+        for norm, (names, ids) in entries.items():
+            trie.add_word(norm, (len(norm), tuple(names), tuple(ids)))
+        trie.make_automaton()
+        return trie
+
+    @staticmethod
+    def _profile(text):
+        # marks beginnings and ends of words, so we can check if a match is aligned to word boundaries
         profile = EvidenceFinder.letter_re.sub("i", text)
         profile = EvidenceFinder.init_letter_re.sub("b", profile)
         profile = EvidenceFinder.end_letter_re.sub("e", profile)
         profile = EvidenceFinder.single_letter_re.sub("x", profile)
+        return profile.replace(" ", "")
+
+    @staticmethod
+    def find_names(text, names_trie):
+        text = text.lower()
+        profile = EvidenceFinder._profile(text)
         text = text.replace(" ", "")
-        profile = profile.replace(" ", "")
         s = Counter()
         for (end, (l, word)) in names_trie.iter(text):
             if profile[end] in ['e', 'x'] and profile[end - l + 1] in ['b', 'x']:
                 s[word] += 1
         return s
 
+    @staticmethod
+    def prepare(text):
+        """Returns lowercased text with spaces removed and its profile, as used for matching."""
+        text = text.lower()
+        return text.replace(" ", ""), EvidenceFinder._profile(text)
+
+    def _iter_all(self, text, profile):
+        # yields start, end and payload of evidences aligned to word boundaries
+        for end, entry in self.all_evidences_trie.iter(text):
+            start = end - entry[0] + 1
+            if profile[end] in ['e', 'x'] and profile[start] in ['b', 'x']:
+                yield start, end, entry
+
+    def find_all(self, text, ids=False):
+        """
+        Finds tasks, datasets and metrics evidences in a single pass over text.
+        Returns a tuple of Counters (tasks, datasets, metrics). If ids is True, the Counters
+        are indexed by ids of evidences in `self.evidence_symbols` instead of evidences.
+        """
+        found = (Counter(), Counter(), Counter())
+        payload = 2 if ids else 1
+        for start, end, entry in self._iter_all(*EvidenceFinder.prepare(text)):
+            for s, word in zip(found, entry[payload]):
+                if word is not None:
+                    s[word] += 1
+        return found
+
+    def find_all_segments(self, segments, ids=False):
+        """
+        Finds evidences in a text made of consecutive segments in a single pass.
+
+        Parameters
+        ----------
+        segments: list of segments of text, each prepared with `prepare`. Finding evidences in
+            space-joined segments is the same as finding them in the concatenation of segments
+
+        Returns
+        -------
+        found : list of (tasks, datasets, metrics) Counters of evidences contained in each segment
+        spanning : (tasks, datasets, metrics) Counters of evidences spanning more than one segment
+        """
+        offsets = [0]
+        for text, profile in segments:
+            offsets.append(offsets[-1] + len(text))
+        text = "".join(text for text, profile in segments)
+        profile = "".join(profile for text, profile in segments)
+
+        found = [(Counter(), Counter(), Counter()) for _ in segments]
+        spanning = (Counter(), Counter(), Counter())
+        payload = 2 if ids else 1
+        for start, end, entry in self._iter_all(text, profile):
+            segment = bisect_right(offsets, start) - 1
+            target = found[segment] if end < offsets[segment + 1] else spanning
+            for s, word in zip(target, entry[payload]):
+                if word is not None:
+                    s[word] += 1
+        return found, spanning
+
     def find_datasets(self, text):
         return EvidenceFinder.find_names(text, self.all_datasets_trie)
 
@@ -137,6 +223,11 @@ class EvidenceFinder:
         self.all_metrics_trie = EvidenceFinder.make_trie(self.all_metrics)
         self.all_tasks_trie = EvidenceFinder.make_trie(self.all_tasks)
 
+        axes = (self.all_tasks, self.all_datasets, self.all_metrics)
+        self.max_evidence_length = max((len(name.replace(" ", "")) for names in axes for name in names), default=0)
+        self.evidence_symbols = SymbolTable(name for names in axes for name in names)
+        self.all_evidences_trie = EvidenceFinder.make_multi_trie(axes, self.evidence_symbols)
+
 
 @njit
 def axis_logprobs(evidences_for, reverse_probs, found_evidences, noise, pb, max_repetitions):
@@ -183,6 +274,39 @@ def compute_logprobs(taxonomy, tasks, datasets, metrics,
     return logprobs, axes_logprobs
 
 
+# variant of compute_logprobs that releases the GIL, so that many threads can score concurrently
+compute_logprobs_nogil = njit(nogil=True)(compute_logprobs.py_func)
+
+
+axis_logprobs_nogil = njit(nogil=True)(axis_logprobs.py_func)
+
+
+@njit(nogil=True, parallel=True)
+def all_axis_logprobs(names, reverse_probs, found_evidences, noise, pb, max_repetitions):
+    logprobs = np.zeros(len(names))
+    for i in prange(len(names)):
+        # prange index is unsigned, while typed lists are indexed with signed integers
+        name = names[np.int64(i)]
+        logprobs[i] = axis_logprobs_nogil(name, reverse_probs, found_evidences, noise, pb, max_repetitions)
+    return logprobs
+
+
+# parallel variant of compute_logprobs. Log-probabilities of all values of each axis are computed
+# in parallel and then gathered into taxonomy entries given by (n, 3) array of indices of triples
+@njit(nogil=True, parallel=True)
+def compute_logprobs_parallel(triples, tasks, datasets, metrics,
+                              reverse_merged_p, reverse_metrics_p, reverse_task_p,
+                              dss, mss, tss, noise, ms_noise, ts_noise, ds_pb, ms_pb, ts_pb,
+                              max_repetitions):
+    ts_lp = all_axis_logprobs(tasks, reverse_task_p, tss, ts_noise, ts_pb, max_repetitions)
+    ds_lp = all_axis_logprobs(datasets, reverse_merged_p, dss, noise, ds_pb, 1)
+    ms_lp = all_axis_logprobs(metrics, reverse_metrics_p, mss, ms_noise, ms_pb, 1)
+    logprobs = np.zeros(len(triples))
+    for i in prange(len(triples)):
+        logprobs[i] = ds_lp[triples[i, 1]] + ms_lp[triples[i, 2]] + ts_lp[triples[i, 0]]
+    return logprobs, (ts_lp, ds_lp, ms_lp)
+
+
 def _to_typed_list(iterable):
     l = typed.List()
     for i in iterable:
@@ -190,42 +314,172 @@ def _to_typed_list(iterable):
     return l
 
 
+# proposals of a single cell returned by ContextSearch, sorted by decreasing confidence
+proposals_dtype = [("task", object), ("dataset", object), ("metric", object), ("evidence", object),
+                   ("confidence", np.float64), ("true_metric", object)]
+
+
+def descending_order(values):
+    # the same order as of pandas' sort_values(ascending=False), ties keep their original order
+    idx = np.arange(len(values))[::-1]
+    return idx[values[::-1].argsort(kind="quicksort")][::-1]
+
+
+def get_sparse_axes(taxonomy, evidence_finder):
+    """Computes reverse probabilities of tasks, datasets and metrics given evidences."""
+    def occurrences(evidences):
+        # sorted, so that sums of probabilities don't depend on the iteration order of sets
+        return {k: Counter(sorted(normalize_cell(normalize_dataset(x)) for x in v)) for k, v in sorted(evidences.items())}
+
+    merged_p = get_probs(occurrences(evidence_finder.datasets))[1]
+    metrics_p = get_probs(occurrences(evidence_finder.metrics))[1]
+    tasks_p = get_probs(occurrences(evidence_finder.tasks))[1]
+    return (
+        SparseAxis(taxonomy.task_symbols.names, reverse_probs(tasks_p)),
+        SparseAxis(taxonomy.dataset_symbols.names, reverse_probs(merged_p)),
+        SparseAxis(taxonomy.metric_symbols.names, reverse_probs(metrics_p))
+    )
+
+
 class ContextSearch:
+    """
+    Links cells to taxonomy entries based on evidences found in cell's query, caption and table,
+    paper and abstract contexts.
+
+    An instance can be shared by many threads. Caches are thread-safe and with numba_mode
+    set to "nogil" or "parallel", numba kernels of the numba backend release the GIL.
+    "parallel" additionally distributes scoring of each context over numba threads
+    (concurrent calls from many threads require a thread-safe numba threading layer,
+    i.e., tbb or omp, but these can't be forked, so `Linker.link_many` links in a single
+    process after parallel kernels started on them; use workqueue with link_many).
+
+    With cache_path set, cached queries and context log-probabilities are also stored on disk
+    (see `PersistentCache`) under a fingerprint of taxonomy, evidences, probabilities and
+    parameters, so they are reused by later runs with the same model.
+    """
+    numba_modes = ["default", "nogil", "parallel"]
+    # bump when cached values change for the same model
+    cache_version = 2
+
     def __init__(self, taxonomy, evidence_finder,
                  context_noise=(0.99, 1.0, 1.0, 0.25, 0.01),
                  metric_noise=(0.99, 1.0, 1.0, 0.25, 0.01),
                  task_noise=(0.1, 1.0, 1.0, 0.1, 0.1),
-                 ds_pb=0.001, ms_pb=0.01, ts_pb=0.01, debug_gold_df=None):
-        merged_p = \
-        get_probs({k: Counter([normalize_cell(normalize_dataset(x)) for x in v]) for k, v in evidence_finder.datasets.items()})[1]
-        metrics_p = \
-        get_probs({k: Counter([normalize_cell(normalize_dataset(x)) for x in v]) for k, v in evidence_finder.metrics.items()})[1]
-        tasks_p = \
-        get_probs({k: Counter([normalize_cell(normalize_dataset(x)) for x in v]) for k, v in evidence_finder.tasks.items()})[1]
-
-        # todo: use LRU cache to avoid OOM
-        self.queries = {}
-        self.logprobs_cache = {}
+                 ds_pb=0.001, ms_pb=0.01, ts_pb=0.01, debug_gold_df=None,
+                 queries_cache_size=100000, logprobs_cache_size=10000, logprobs_cache_bytes=None,
+                 backend="numba", sparse_axes=None, numba_mode="default", cache_path=None):
+        assert backend in ["numba", "sparse", "pruned"]
+        assert numba_mode in ContextSearch.numba_modes
+        if sparse_axes is None:
+            sparse_axes = get_sparse_axes(taxonomy, evidence_finder)
+        self.sparse_axes = sparse_axes
+        self.queries = LRUCache(maxsize=queries_cache_size)
+        self.logprobs_cache = LRUCache(maxsize=logprobs_cache_size, maxbytes=logprobs_cache_bytes)
         self.taxonomy = taxonomy
         self.evidence_finder = evidence_finder
 
-        self._taxonomy = _to_typed_list(self.taxonomy.taxonomy)
-        self._taxonomy_tasks = _to_typed_list(self.taxonomy.tasks)
-        self._taxonomy_datasets = _to_typed_list(self.taxonomy.datasets)
-        self._taxonomy_metrics = _to_typed_list(self.taxonomy.metrics)
+        self.backend = backend
+        # can be changed at runtime
+        self.numba_mode = numba_mode
+        self._lock = threading.Lock()
+        tasks_axis, datasets_axis, metrics_axis = sparse_axes
+        assert tasks_axis.names == taxonomy.task_symbols.names and \
+            datasets_axis.names == taxonomy.dataset_symbols.names and \
+            metrics_axis.names == taxonomy.metric_symbols.names, "axes must follow taxonomy symbols"
+        if backend == "numba":
+            self._taxonomy = _to_typed_list(self.taxonomy.taxonomy)
+            self._taxonomy_tasks = _to_typed_list(tasks_axis.names)
+            self._taxonomy_datasets = _to_typed_list(datasets_axis.names)
+            self._taxonomy_metrics = _to_typed_list(metrics_axis.names)
+        else:
+            # sparse backends work on interned ids only, so we don't pay for JIT compilation
+            self._taxonomy = self.taxonomy.triples
+            self._taxonomy_tasks = tasks_axis.names
+            self._taxonomy_datasets = datasets_axis.names
+            self._taxonomy_metrics = metrics_axis.names
 
-        self.extract_acronyms = AcronymExtractor()
+        self._extract_acronyms = None
         self.context_noise = context_noise
         self.metrics_noise = metric_noise if metric_noise else context_noise
         self.task_noise = task_noise if task_noise else context_noise
         self.ds_pb = ds_pb
         self.ms_pb = ms_pb
         self.ts_pb = ts_pb
-        self.reverse_merged_p = self._numba_update_nested_dict(reverse_probs(merged_p))
-        self.reverse_metrics_p = self._numba_update_nested_dict(reverse_probs(metrics_p))
-        self.reverse_tasks_p = self._numba_update_nested_dict(reverse_probs(tasks_p))
+        if backend == "numba":
+            self.reverse_merged_p = self._numba_update_nested_dict(datasets_axis.to_dict())
+            self.reverse_metrics_p = self._numba_update_nested_dict(metrics_axis.to_dict())
+            self.reverse_tasks_p = self._numba_update_nested_dict(tasks_axis.to_dict())
+        else:
+            self.sparse_scorer = SparseScorer(self._taxonomy, tasks_axis, datasets_axis, metrics_axis)
+        self._init_evidence_ids()
         self.debug_gold_df = debug_gold_df
         self.max_repetitions = 3
+        self.cache_path = cache_path
+        if cache_path is not None:
+            fingerprint = self.fingerprint()
+            self.queries = PersistentCache(self.queries, cache_path, f"{fingerprint}/queries")
+            self.logprobs_cache = PersistentCache(self.logprobs_cache, cache_path, f"{fingerprint}/logprobs",
+                                                  persistent_key=self._persistent_key)
+
+    # loading the scispacy model is slow and the acronyms extraction is currently unused
+    @property
+    def extract_acronyms(self):
+        if self._extract_acronyms is None:
+            self._extract_acronyms = AcronymExtractor()
+        return self._extract_acronyms
+
+    def warmup(self):
+        """Compiles numba kernels and precomputes structures used for all noise parameters."""
+        for noise, ms_noise, ts_noise in zip(self.context_noise, self.metrics_noise, self.task_noise):
+            self._compute_logprobs({}, {}, {}, noise, ms_noise, ts_noise)
+
+    def cache_info(self):
+        return dict(queries=self.queries.info(), logprobs=self.logprobs_cache.info())
+
+    def flush(self):
+        """Writes pending entries of persistent caches to disk."""
+        if self.cache_path is not None:
+            self.queries.flush()
+            self.logprobs_cache.flush()
+
+    def fingerprint(self):
+        """
+        Returns a digest of everything cached values depend on: taxonomy, evidences, reverse
+        probabilities, backend and parameters. It doesn't depend on the order of interned evidences,
+        but does on the order of tasks, datasets and metrics indexing cached arrays (sorted by
+        `Taxonomy`, so it's the same in all processes).
+        """
+        h = hashlib.sha1()
+
+        def update(obj):
+            h.update(repr(obj).encode("utf-8"))
+            h.update(b"\0")
+
+        update((self.cache_version, self.backend, self.context_noise, self.metrics_noise, self.task_noise,
+                self.ds_pb, self.ms_pb, self.ts_pb, self.max_repetitions))
+        update(self.taxonomy.taxonomy)
+        update(self.taxonomy.metric_symbols.lookup(self.taxonomy.true_metrics))
+        finder = self.evidence_finder
+        for evidences in (finder.all_tasks, finder.all_datasets, finder.all_metrics):
+            update(sorted(evidences))
+        for axis in self.sparse_axes:
+            names, evidences, data, indices, indptr = axis.to_arrays()
+            evidences = np.array(evidences, dtype=object)
+            ranks = np.empty(len(evidences), dtype=np.int64)
+            ranks[np.argsort(evidences, kind="stable")] = np.arange(len(evidences))
+            rows = np.repeat(np.arange(len(names)), np.diff(indptr))
+            cols = ranks[indices]
+            order = np.lexsort((cols, rows))
+            update(names)
+            update(sorted(evidences))
+            h.update(np.ascontiguousarray(cols[order], dtype=np.int64).tobytes())
+            h.update(np.ascontiguousarray(data[order], dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+    def _persistent_key(self, key):
+        # interned ids depend on the order of interning, evidences are stored by their names
+        names = self.evidence_symbols.names
+        return tuple(tuple(sorted((names[idx], count) for idx, count in items)) for items in key[:3]) + key[3:]
 
     def _numba_update_nested_dict(self, nested):
         d = typed.Dict()
@@ -246,61 +500,114 @@ class ContextSearch:
         d.update(dct)
         return d
 
-    def _hash_counter(self, d):
-        items = list(d.items())
-        items = sorted(items)
-        return ";".join([x[0]+":"+str(x[1]) for x in items])
-
-    def compute_context_logprobs(self, context, noise, ms_noise, ts_noise, logprobs, axes_logprobs):
+    def _compute_logprobs(self, dss, mss, tss, noise, ms_noise, ts_noise):
+        if self.backend != "numba":
+            return self.sparse_scorer(self._encode(dss, 1), self._encode(mss, 2), self._encode(tss, 0),
+                                      noise, ms_noise, ts_noise, self.ds_pb, self.ms_pb, self.ts_pb,
+                                      self.max_repetitions)
+        dss = self._numba_extend_dict(self._decode(dss))
+        mss = self._numba_extend_dict(self._decode(mss))
+        tss = self._numba_extend_dict(self._decode(tss))
+        if self.numba_mode == "parallel":
+            kernel, taxonomy = compute_logprobs_parallel, self.taxonomy.triples
+        else:
+            kernel = compute_logprobs_nogil if self.numba_mode == "nogil" else compute_logprobs
+            taxonomy = self._taxonomy
+        return kernel(taxonomy, self._taxonomy_tasks, self._taxonomy_datasets, self._taxonomy_metrics,
+                      self.reverse_merged_p, self.reverse_metrics_p, self.reverse_tasks_p,
+                      dss, mss, tss, noise, ms_noise, ts_noise, self.ds_pb, self.ms_pb, self.ts_pb,
+                      self.max_repetitions)
+
+    def _init_evidence_ids(self):
+        # ids of normalized evidences, evidences found by evidence finder are normalized only once here
+        finder_symbols = self.evidence_finder.evidence_symbols
+        self.evidence_symbols = SymbolTable(normalize_cell(name) for name in finder_symbols.names)
+        self._normalized_ids = [self.evidence_symbols.ids[normalize_cell(name)] for name in finder_symbols.names]
+        for axis in self.sparse_axes:
+            for evidence in axis.evidence_ids:
+                self.evidence_symbols.intern(evidence)
+        # evidence id -> column in axis matrix
+        self._axes_columns = [axis.columns(self.evidence_symbols) for axis in self.sparse_axes]
+
+    def _normalized_id(self, evidence):
+        idx = self.evidence_finder.evidence_symbols.get(evidence)
+        if idx >= 0:
+            return self._normalized_ids[idx]
+        evidence = normalize_cell(evidence)
+        idx = self.evidence_symbols.get(evidence)
+        if idx >= 0:
+            return idx
+        with self._lock:
+            return self.evidence_symbols.intern(evidence)
+
+    def _encode(self, found_evidences, axis):
+        # (columns, counts) of evidences found on axis, evidences missing from axis have column -1
+        columns = self._axes_columns[axis]
+        ids = np.fromiter(found_evidences.keys(), dtype=np.int64, count=len(found_evidences))
+        counts = np.fromiter(found_evidences.values(), dtype=np.float64, count=len(found_evidences))
+        cols = np.full(len(ids), -1, dtype=np.int64)
+        known = ids < len(columns)
+        cols[known] = columns[ids[known]]
+        return cols, counts
+
+    def _decode(self, found_evidences):
+        return {self.evidence_symbols[idx]: count for idx, count in found_evidences.items()}
+
+    def _context_evidences(self, context, noise, ms_noise, ts_noise):
         if isinstance(context, str) or context is None:
             context = context or ""
             #abbrvs = self.extract_acronyms(context)
             context = normalize_cell_ws(normalize_dataset_ws(context))
             #dss = set(self.evidence_finder.find_datasets(context)) | set(abbrvs.keys())
-            dss = self.evidence_finder.find_datasets(context)
-            mss = self.evidence_finder.find_metrics(context)
-            tss = self.evidence_finder.find_tasks(context)
+            tss, dss, mss = self.evidence_finder.find_all(context, ids=True)
 
             dss -= mss
             dss -= tss
+            normalized = self._normalized_ids
+            dss = {normalized[ds]: count for ds, count in dss.items()}
+            mss = {normalized[ms]: count for ms, count in mss.items()}
+            tss = {normalized[ts]: count for ts, count in tss.items()}
         else:
             tss, dss, mss = context
-
-        dss = {normalize_cell(ds): count for ds, count in dss.items()}
-        mss = {normalize_cell(ms): count for ms, count in mss.items()}
-        tss = {normalize_cell(ts): count for ts, count in tss.items()}
+            dss = {self._normalized_id(ds): count for ds, count in dss.items()}
+            mss = {self._normalized_id(ms): count for ms, count in mss.items()}
+            tss = {self._normalized_id(ts): count for ts, count in tss.items()}
         ###print("dss", dss)
         ###print("mss", mss)
-        dss = self._numba_extend_dict(dss)
-        mss = self._numba_extend_dict(mss)
-        tss = self._numba_extend_dict(tss)
-
-        key = (self._hash_counter(tss), self._hash_counter(dss), self._hash_counter(mss), noise, ms_noise, ts_noise)
-        if key not in self.logprobs_cache:
-            lp, alp = compute_logprobs(self._taxonomy, self._taxonomy_tasks, self._taxonomy_datasets, self._taxonomy_metrics,
-                             self.reverse_merged_p, self.reverse_metrics_p, self.reverse_tasks_p,
-                             dss, mss, tss, noise, ms_noise, ts_noise, self.ds_pb, self.ms_pb, self.ts_pb,
-                             self.max_repetitions)
+
+        key = (tuple(sorted(tss.items())), tuple(sorted(dss.items())), tuple(sorted(mss.items())),
+               noise, ms_noise, ts_noise)
+        return dss, mss, tss, key
+
+    def compute_context_logprobs(self, context, noise, ms_noise, ts_noise, logprobs, axes_logprobs):
+        dss, mss, tss, key = self._context_evidences(context, noise, ms_noise, ts_noise)
+        cached = self.logprobs_cache.get(key)
+        if cached is None:
+            lp, alp = self._compute_logprobs(dss, mss, tss, noise, ms_noise, ts_noise)
             self.logprobs_cache[key] = (lp, alp)
         else:
-            lp, alp = self.logprobs_cache[key]
+            lp, alp = cached
         logprobs += lp
         axes_logprobs[0] += alp[0]
         axes_logprobs[1] += alp[1]
         axes_logprobs[2] += alp[2]
 
+    def _context_logprobs(self, contexts, noises, context_logprobs, axes_context_logprobs):
+        for context, noise, ms_noise, ts_noise in zip(contexts, *noises):
+            self.compute_context_logprobs(context, noise, ms_noise, ts_noise, context_logprobs, axes_context_logprobs)
+
     def match(self, contexts):
         assert len(contexts) == len(self.context_noise)
         n = len(self._taxonomy)
         context_logprobs = np.zeros(n)
-        axes_context_logprobs = _to_typed_list([
+        axes_context_logprobs = [
             np.zeros(len(self._taxonomy_tasks)),
             np.zeros(len(self._taxonomy_datasets)),
             np.zeros(len(self._taxonomy_metrics)),
-        ])
+        ]
 
-        for context, noise, ms_noise, ts_noise in zip(contexts, self.context_noise, self.metrics_noise, self.task_noise):
-            self.compute_context_logprobs(context, noise, ms_noise, ts_noise, context_logprobs, axes_context_logprobs)
+        self._context_logprobs(contexts, (self.context_noise, self.metrics_noise, self.task_noise),
+                               context_logprobs, axes_context_logprobs)
         keys = self.taxonomy.taxonomy
         logprobs = context_logprobs
         #keys, logprobs = zip(*context_logprobs.items())
@@ -313,96 +620,224 @@ class ContextSearch:
             zip(self._taxonomy_metrics, axes_probs[2])
         )
 
-    def __call__(self, query, paper_context, abstract_context, table_context, caption, topk=1, debug_info=None):
-        cellstr = debug_info.cell.cell_ext_id
-        pipeline_logger("linking::taxonomy_linking::call", ext_id=cellstr, query=query,
-                        paper_context=paper_context, abstract_context=abstract_context, table_context=table_context,
-                        caption=caption)
-
-        paper_hash = ";".join(",".join(sorted(s.elements())) for s in paper_context)
-        abstract_hash = ";".join(",".join(sorted(s.elements())) for s in abstract_context)
-        mentions_hash = ";".join(",".join(sorted(s.elements())) for s in table_context)
-        key = (paper_hash, abstract_hash, mentions_hash, caption, query, topk)
-        ###print(f"[DEBUG] {cellstr}")
-        ###print("[DEBUG]", debug_info)
-        ###print("query:", query, caption)
-        if key in self.queries:
-            # print(self.queries[key])
-            # for context in key:
-            #     abbrvs = self.extract_acronyms(context)
-            #     context = normalize_cell_ws(normalize_dataset(context))
-            #     dss = set(find_datasets(context)) | set(abbrvs.keys())
-            #     mss = set(find_metrics(context))
-            #     dss -= mss
-                ###print("dss", dss)
-                ###print("mss", mss)
-
-            ###print("Taking result from cache")
-            p = self.queries[key]
-        else:
-            dists = self.match((paper_context, abstract_context, table_context, caption, query))
-
-            all_top_results = [sorted(list(dist), key=lambda x: x[1], reverse=True)[:max(topk, 5)] for dist in dists]
-            top_results, top_results_t, top_results_d, top_results_m = all_top_results
-
-            entries = []
-            for it, prob in top_results:
-                task, dataset, metric = it
-                entry = dict(task=task, dataset=dataset, metric=metric)
-                entry.update({"evidence": "", "confidence": prob})
-                entries.append(entry)
-
-            best_independent = dict(
-                task=top_results_t[0][0],
-                dataset=top_results_d[0][0],
-                metric=top_results_m[0][0])
-            best_independent.update({
-                "evidence": "",
-                "confidence": 0.79
-            })
-            entries.append(best_independent)
-
-            # entries = []
-            # for i in range(5):
-            #     best_independent = dict(
-            #         task=top_results_t[i][0],
-            #         dataset=top_results_d[i][0],
-            #         metric=top_results_m[i][0])
-            #     best_independent.update({
-            #         "evidence": "",
-            #         "confidence": np.power(top_results_t[i][1] * top_results_d[i][1] * top_results_m[i][1], 1.0/3.0)
-            #     })
-            #     entries.append(best_independent)
-                #entries = [best_independent] + entries
-
-            # best, best_p = sorted(dist, key=lambda x: x[1], reverse=True)[0]
-            # entry = et[best]
-            # p = pd.DataFrame({k:[v] for k, v in entry.items()})
-            # p["evidence"] = ""
-            # p["confidence"] = best_p
-            p = pd.DataFrame(entries).sort_values("confidence", ascending=False)
-
-            self.queries[key] = p
-
+    def _initial_state(self):
+        axes_sizes = [len(self._taxonomy_tasks), len(self._taxonomy_datasets), len(self._taxonomy_metrics)]
+        if self.backend == "pruned":
+            return [], [np.zeros(n) for n in axes_sizes]
+        return np.zeros(len(self._taxonomy)), [np.zeros(n) for n in axes_sizes]
+
+    def _add_contexts(self, state, contexts, noises):
+        """Returns a copy of state (summed log-probabilities) with contributions of contexts added."""
+        if self.backend == "pruned":
+            scores, axes_logprobs = state
+            return self._add_scores(contexts, noises, (list(scores), [a.copy() for a in axes_logprobs]))
+        logprobs, axes_logprobs = state
+        logprobs = logprobs.copy()
+        axes_logprobs = [a.copy() for a in axes_logprobs]
+        self._context_logprobs(contexts, noises, logprobs, axes_logprobs)
+        return logprobs, axes_logprobs
+
+    def _batch_logprobs(self, state, captions, queries):
+        logprobs, axes_logprobs = state
+        n = len(queries)
+        logprobs = np.tile(logprobs, (n, 1))
+        axes_logprobs = [np.tile(a, (n, 1)) for a in axes_logprobs]
+        cell_noises = tuple(noise[3:] for noise in (self.context_noise, self.metrics_noise, self.task_noise))
+        for i, (caption, query) in enumerate(zip(captions, queries)):
+            self._context_logprobs((caption, query), cell_noises, logprobs[i], [a[i] for a in axes_logprobs])
+
+        probs = softmax(logprobs, axis=1)
+        axes_probs = [softmax(a, axis=1) for a in axes_logprobs]
+        return probs, axes_probs
+
+    def match_batch(self, paper_context, abstract_context, table_context, captions, queries):
+        """
+        Computes probabilities of taxonomy entries for many cells sharing paper, abstract and table contexts
+
+        Parameters
+        ----------
+        captions: a caption shared by all cells or a list of captions, one per query
+        queries: list of per-cell queries
+
+        Returns
+        -------
+        probs : (len(queries), len(taxonomy)) matrix of probabilities of taxonomy entries
+        axes_probs : list of probability matrices for tasks, datasets and metrics
+        """
+        assert self.backend != "pruned", "pruned backend doesn't compute probabilities of all entries"
+        n = len(queries)
+        if captions is None or isinstance(captions, str):
+            captions = [captions] * n
+        assert len(captions) == n
+
+        noises = (self.context_noise, self.metrics_noise, self.task_noise)
+        state = self._add_contexts(self._initial_state(), (paper_context, abstract_context, table_context), noises)
+        return self._batch_logprobs(state, captions, queries)
+
+    def context_scores(self, context, noise, ms_noise, ts_noise):
+        """Returns scores of tasks, datasets and metrics in a context (see `SparseAxis.scores`)."""
+        dss, mss, tss, key = self._context_evidences(context, noise, ms_noise, ts_noise)
+        key = key + ("scores",)
+        cached = self.logprobs_cache.get(key)
+        if cached is None:
+            cached = self.sparse_scorer.axes_scores(self._encode(dss, 1), self._encode(mss, 2), self._encode(tss, 0),
+                                                    noise, ms_noise, ts_noise,
+                                                    self.ds_pb, self.ms_pb, self.ts_pb, self.max_repetitions)
+            self.logprobs_cache[key] = cached
+        return cached
+
+    def _add_scores(self, contexts, noises, state):
+        # scores of contexts are kept, so that the pruned backend sums them in the order of contexts
+        scores, axes_logprobs = state
+        for context, noise, ms_noise, ts_noise in zip(contexts, *noises):
+            context_scores = self.context_scores(context, noise, ms_noise, ts_noise)
+            scores.append(context_scores)
+            for axis_logprobs, (_, _, logprobs) in zip(axes_logprobs, context_scores):
+                axis_logprobs += logprobs
+        return scores, axes_logprobs
+
+    def _records(self, state, caption, queries, topk):
+        # proposals records for cells given state with summed shared contexts
+        if self.backend == "pruned":
+            cell_noises = tuple(noise[3:] for noise in (self.context_noise, self.metrics_noise, self.task_noise))
+            records = []
+            for query in queries:
+                # only taxonomy entries supported by at least one evidence are scored
+                scores, axes_logprobs = self._add_contexts(state, (caption, query), cell_noises)
+                top_results, top_probs = self.sparse_scorer.top_k(scores, max(topk, 5))
+                records.append(self._proposals_records(top_results, top_probs, [softmax(a) for a in axes_logprobs]))
+            return records
+
+        probs, axes_probs = self._batch_logprobs(state, [caption] * len(queries), queries)
+        records = []
+        for row in range(len(queries)):
+            top_results = top_k_indices(probs[row], max(topk, 5))
+            records.append(self._proposals_records(top_results, probs[row][top_results], [a[row] for a in axes_probs]))
+        return records
+
+    def _proposals_records(self, top_results, top_probs, axes_probs):
+        # names are materialized from interned ids only here
+        taxonomy = self.taxonomy
+        triples = taxonomy.triples[top_results]
+        true_metrics = list(taxonomy.true_metrics[top_results])
+        task, dataset, metric = (top_k_indices(a, 1)[0] for a in axes_probs)
+        best_idx = taxonomy.triple_ids.get(
+            (taxonomy.task_symbols[task], taxonomy.dataset_symbols[dataset], taxonomy.metric_symbols[metric]))
+        # metrics of combinations missing from taxonomy are never complementary
+        true_metrics.append(metric if best_idx is None else taxonomy.true_metrics[best_idx])
+
+        # the last entry is the best independent combination
+        confidence = np.append(np.asarray(top_probs, dtype=np.float64), 0.79)
+        records = np.rec.fromarrays([
+            taxonomy.task_symbols.lookup(list(triples[:, 0]) + [task]),
+            taxonomy.dataset_symbols.lookup(list(triples[:, 1]) + [dataset]),
+            taxonomy.metric_symbols.lookup(list(triples[:, 2]) + [metric]),
+            [""] * (len(top_results) + 1),
+            confidence,
+            taxonomy.metric_symbols.lookup(true_metrics)
+        ], dtype=proposals_dtype)
+        return records[descending_order(confidence)]
+
+    def session(self, paper_context, abstract_context):
+        """Returns a `LinkingSession` for linking cells of a single paper."""
+        return LinkingSession(self, paper_context, abstract_context)
+
+    def link_cells(self, queries, paper_context, abstract_context, table_context, caption, topk=1, debug_infos=None):
+        """
+        Links many cells of a single table at once, computing shared contexts only once.
+        Returns a list of proposals record arrays (see `proposals_dtype`), one per query.
+        """
+        return self.session(paper_context, abstract_context).link_cells(
+            queries, table_context, caption, topk=topk, debug_infos=debug_infos)
+
+    def _finalize(self, p, cellstr, topk):
         ###print(p)
 
         # error analysis only
         if self.debug_gold_df is not None:
             if cellstr in self.debug_gold_df.index:
                 gold_record = self.debug_gold_df.loc[cellstr]
-                if p.iloc[0].dataset == gold_record.dataset:
+                if p[0].dataset == gold_record.dataset:
                     print("[EA] Matching gold sota record (dataset)")
                 else:
                     print(
-                        f"[EA] Proposal dataset ({p.iloc[0].dataset}) and gold dataset ({gold_record.dataset}) mismatch")
+                        f"[EA] Proposal dataset ({p[0].dataset}) and gold dataset ({gold_record.dataset}) mismatch")
             else:
                 print("[EA] No gold sota record found for the cell")
         # end of error analysis only
-        pipeline_logger("linking::taxonomy_linking::topk", ext_id=cellstr, topk=p.head(5))
+        step = "linking::taxonomy_linking::topk"
+        if pipeline_logger.observed(step):
+            pipeline_logger(step, ext_id=cellstr, topk=pd.DataFrame(p[:5]))
+
+        return p[:topk]
 
-        q = p.head(topk).copy()
-        q["true_metric"] = q.apply(lambda row: self.taxonomy.normalize_metric(row.task, row.dataset, row.metric), axis=1)
-        return q
+    def __call__(self, query, paper_context, abstract_context, table_context, caption, topk=1, debug_info=None):
+        return self.link_cells([query], paper_context, abstract_context, table_context, caption,
+                               topk=topk, debug_infos=[debug_info])[0]
+
+
+def _fingerprint(context):
+    return ";".join(",".join(f"{k}:{v}" for k, v in sorted(s.items()) if v > 0) for s in context)
+
+
+class LinkingSession:
+    """
+    Links cells of a single paper. Paper and abstract contexts are fingerprinted and their
+    log-probabilities are summed only once per paper, table contexts once per table,
+    so linking a cell only adds contributions of its caption and query.
+    """
+    def __init__(self, context_search, paper_context, abstract_context):
+        self.context_search = context_search
+        self.taxonomy = context_search.taxonomy
+        self.paper_context = paper_context
+        self.abstract_context = abstract_context
+        self.paper_hash = _fingerprint(paper_context)
+        self.abstract_hash = _fingerprint(abstract_context)
+        noises = (context_search.context_noise, context_search.metrics_noise, context_search.task_noise)
+        self._noises = noises
+        self._paper_state = None
+        self._tables = {}
+
+    def _table_state(self, table_hash, table_context):
+        cs = self.context_search
+        if self._paper_state is None:
+            self._paper_state = cs._add_contexts(cs._initial_state(), (self.paper_context, self.abstract_context),
+                                                 tuple(noise[:2] for noise in self._noises))
+        if table_hash not in self._tables:
+            self._tables[table_hash] = cs._add_contexts(self._paper_state, (table_context,),
+                                                        tuple(noise[2:3] for noise in self._noises))
+        return self._tables[table_hash]
+
+    def link_cells(self, queries, table_context, caption, topk=1, debug_infos=None):
+        """
+        Links cells of a single table. Returns a list of proposals record arrays, one per query.
+        """
+        cs = self.context_search
+        if debug_infos is None:
+            debug_infos = [None] * len(queries)
+        cellstrs = [debug_info.cell.cell_ext_id if debug_info is not None else None for debug_info in debug_infos]
+        for cellstr, query in zip(cellstrs, queries):
+            pipeline_logger("linking::taxonomy_linking::call", ext_id=cellstr, query=query,
+                            paper_context=self.paper_context, abstract_context=self.abstract_context,
+                            table_context=table_context, caption=caption)
+
+        mentions_hash = _fingerprint(table_context)
+        keys = [(self.paper_hash, self.abstract_hash, mentions_hash, caption, query, topk) for query in queries]
+
+        results = [cs.queries.get(key) for key in keys]
+        missing = [i for i, p in enumerate(results) if p is None]
+        if missing:
+            # the same query can appear many times in a table
+            missing_queries = list(dict.fromkeys(queries[i] for i in missing))
+            state = self._table_state(mentions_hash, table_context)
+            records = cs._records(state, caption, missing_queries, topk)
+            records = dict(zip(missing_queries, records))
+            for query, proposals in records.items():
+                cs.queries[(self.paper_hash, self.abstract_hash, mentions_hash, caption, query, topk)] = proposals
+            for i in missing:
+                results[i] = records[queries[i]]
+
+        return [cs._finalize(p, cellstr, topk) for p, cellstr in zip(results, cellstrs)]
 
 
 # todo: compare regex approach (old) with find_datasets(.) (current)
@@ -411,27 +846,98 @@ class DatasetExtractor:
     def __init__(self, evidence_finder):
         self.evidence_finder = evidence_finder
         self.dataset_prefix_re = re.compile(r"[A-Z]|[a-z]+[A-Z]+|[0-9]")
+        self.trailing_reference_re = re.compile(r"xx(anchor|ref)-[^ ]*$")
         self.dataset_name_re = re.compile(r"\b(the)\b\s*(?P<name>((?!(the)\b)\w+\W+){1,10}?)(test|val(\.|idation)?|dev(\.|elopment)?|train(\.|ing)?\s+)?\bdata\s*set\b", re.IGNORECASE)
 
     def find_references(self, text, references):
         refs = r"\bxxref-(" + "|".join([re.escape(ref) for ref in references]) + r")\b"
         return set(re.findall(refs, text))
 
-    def get_table_contexts(self, paper, tables):
+    @staticmethod
+    def make_references_trie(references):
+        trie = ahocorasick.Automaton()
+        for ref in references:
+            trie.add_word("xxref-" + ref, ref)
+        trie.make_automaton()
+        return trie
+
+    @staticmethod
+    def _is_word(text, pos):
+        return 0 <= pos < len(text) and (text[pos].isalnum() or text[pos] == "_")
+
+    def _find_references(self, text, references_trie):
+        # equivalent to find_references with references automaton built by make_references_trie
+        if "xxref-" not in text:
+            return set()
+        found = set()
+        for end, ref in references_trie.iter(text):
+            start = end - len(ref) - len("xxref-") + 1
+            if not self._is_word(text, start - 1) and self._is_word(text, end) != self._is_word(text, end + 1):
+                found.add(ref)
+        return found
+
+    def _segment(self, text):
+        return self.evidence_finder.prepare(normalize_cell_ws(normalize_dataset_ws(text)))
+
+    @staticmethod
+    def _sum(contexts):
+        total = (Counter(), Counter(), Counter())
+        for context in contexts:
+            for t, c in zip(total, context):
+                t.update(c)
+        return total
+
+    @staticmethod
+    def _datasets_only(ts, ds, ms):
+        ds -= ts
+        ds -= ms
+        return ts, ds, ms
+
+    def _with_header(self, header, fragment_text, segment, found):
+        # evidences of fragment.header + "\n" + fragment.text given evidences found in the text,
+        # only the header and evidences spanning the header and beginning of the text are scanned
+        if self.trailing_reference_re.search(header):
+            # a reference at the end of header swallows beginning of the text during normalization
+            return self.evidence_finder.find_all(normalize_cell_ws(normalize_dataset_ws(header + "\n" + fragment_text)))
+        window = self.evidence_finder.max_evidence_length - 1
+        text, profile = segment
+        (in_header, _), spanning = self.evidence_finder.find_all_segments(
+            [self._segment(header), (text[:window], profile[:window])])
+        return self._sum([found, in_header, spanning])
+
+    def contexts(self, paper, tables):
+        """
+        Computes paper, abstract and table contexts in a single pass over paper fragments.
+        Evidences are found in each fragment once and aggregated to paper context (as if
+        the fragments were joined) and to contexts of tables referenced from the fragment.
+
+        Returns
+        -------
+        paper_context : (tasks, datasets, metrics) Counters of the paper text
+        abstract_context : (tasks, datasets, metrics) Counters of the abstract
+        table_contexts : list of [tasks, datasets, metrics] Counters, one per table
+        """
+        fragments = paper.text.fragments if hasattr(paper.text, "fragments") else []
+        segments = [self._segment(fragment.text) for fragment in fragments]
+        found, spanning = self.evidence_finder.find_all_segments(segments)
+        paper_context = self._datasets_only(*self._sum(found + [spanning]))
+        abstract_context = self(paper.text.abstract)
+
         ref_tables = [table for table in tables if table.figure_id and table.figure_id.replace(".", "")]
         refs = [table.figure_id.replace(".", "") for table in ref_tables]
         if not refs:
-            return [[Counter(), Counter(), Counter()] for table in tables]
+            return paper_context, abstract_context, [[Counter(), Counter(), Counter()] for table in tables]
         ref_contexts = {ref: [Counter(), Counter(), Counter()] for ref in refs}
-        if hasattr(paper.text, "fragments"):
-            for fragment in paper.text.fragments:
-                found_refs = self.find_references(fragment.text, refs)
-                if found_refs:
-                    ts, ds, ms = self(fragment.header + "\n" + fragment.text)
-                    for ref in found_refs:
-                        ref_contexts[ref][0] += ts
-                        ref_contexts[ref][1] += ds
-                        ref_contexts[ref][2] += ms
+        refs_trie = self.make_references_trie(ref_contexts)
+        for fragment, segment, fragment_found in zip(fragments, segments, found):
+            found_refs = self._find_references(fragment.text, refs_trie)
+            if found_refs:
+                ts, ds, ms = self._datasets_only(*self._with_header(fragment.header, fragment.text, segment,
+                                                                       fragment_found))
+                for ref in found_refs:
+                    ref_contexts[ref][0] += ts
+                    ref_contexts[ref][1] += ds
+                    ref_contexts[ref][2] += ms
         table_contexts = [
             ref_contexts.get(
                 table.figure_id.replace(".", ""),
@@ -439,20 +945,18 @@ class DatasetExtractor:
             ) if table.figure_id else [Counter(), Counter(), Counter()]
             for table in tables
         ]
-        return table_contexts
+        return paper_context, abstract_context, table_contexts
+
+    def get_table_contexts(self, paper, tables):
+        return self.contexts(paper, tables)[2]
 
     def from_paper(self, paper):
-        abstract = paper.text.abstract
-        text = ""
-        if hasattr(paper.text, "fragments"):
-            text += " ".join(f.text for f in paper.text.fragments)
-        return self(text), self(abstract)
+        paper_context, abstract_context, _ = self.contexts(paper, [])
+        return paper_context, abstract_context
 
     def __call__(self, text):
         text = normalize_cell_ws(normalize_dataset_ws(text))
-        ds = self.evidence_finder.find_datasets(text)
-        ts = self.evidence_finder.find_tasks(text)
-        ms = self.evidence_finder.find_metrics(text)
+        ts, ds, ms = self.evidence_finder.find_all(text)
         ds -= ts
         ds -= ms
         return ts, ds, ms
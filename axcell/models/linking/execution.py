@@ -1,11 +1,12 @@
 #  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
 
 import pandas as pd
-from django.db import connection
+from django.db import connection, connections
 from IPython.core.display import display
 
 from axcell.models.linking.metrics import Metrics
-from axcell.models.linking.format import extract_value
+from axcell.models.linking.format import extract_values
+from axcell.models.linking.parallel import fork_map
 
 
 def q(query, limit=10, index_col=None):
@@ -13,13 +14,14 @@ def q(query, limit=10, index_col=None):
         query = query.rstrip(" ;") + f" LIMIT {limit}"
     return pd.read_sql(query, connection, index_col=index_col)
 
-def execute_model_on_papers(model, papers):
-    proposals = []
-    for paper in papers:
+def execute_model_on_papers(model, papers, jobs=1):
+    def run(paper):
         print("Parsing ", paper.paper_id)
-        paper_proposals = model(paper.paper_id, paper, paper.tables)
-        proposals.append(paper_proposals)
-    proposals = pd.concat(proposals)
+        return model(paper.paper_id, paper, paper.tables)
+    if jobs != 1:
+        # forked workers would share the socket of an open connection, django reconnects when needed
+        connections.close_all()
+    proposals = pd.concat(fork_map(run, papers, jobs=jobs))
     proposals["experiment_name"] = model.__name__
     return proposals.set_index('cell_ext_id')
 
@@ -36,8 +38,7 @@ def fetch_gold_sota_records():
     JOIN sota_cell sc USING (table_id, row, col)
     JOIN sota_table st ON (sc.table_id=st.id)
     WHERE parser = 'latexml' and dataset != '' and task != '' and metric != '' and model != '';""", limit=None)
-    gold_sota_records["parsed"] = gold_sota_records[["raw_value", "format"]].apply(
-        lambda row: float(extract_value(row.raw_value, row.format)), axis=1)
+    gold_sota_records["parsed"] = extract_values(gold_sota_records["raw_value"].values, gold_sota_records["format"].values)
 
     unparsed = gold_sota_records[gold_sota_records["parsed"] != gold_sota_records["parsed"]]
     if len(unparsed):
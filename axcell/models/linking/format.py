@@ -1,13 +1,17 @@
 #  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
 
 import re
+from functools import lru_cache
 from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP, InvalidOperation
+import numpy as np
 
 float_value_re = re.compile(r"([+-]?(?:(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)")
 float_value_nc = re.compile(r"(?:[+-]?(?:(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)")
 par_re = re.compile(r"\{([^\}]*)\}")
 escaped_whitespace_re = re.compile(r"(\\\s)+")
 
+# formats are few and shared by all cells, so their regexps are compiled once
+@lru_cache(maxsize=None)
 def format_to_regexp(format):
     placeholders = par_re.split(format.strip())
     regexp = ""
@@ -38,3 +42,21 @@ def extract_value(cell_value, format):
     if match is None or not len(match.groups()):
         return Decimal('NaN')
     return fn(Decimal(match.group(1)))
+
+
+def extract_values(cell_values, formats):
+    """
+    Extracts float values of many cells at once, each distinct pair of cell value and format is parsed once.
+
+    Returns
+    -------
+    values : float array of extracted values (NaN if a value can't be extracted)
+    """
+    parsed = {}
+    values = np.empty(len(cell_values), dtype=np.float64)
+    for i, key in enumerate(zip(cell_values, formats)):
+        value = parsed.get(key)
+        if value is None:
+            value = parsed[key] = float(extract_value(*key))
+        values[i] = value
+    return values
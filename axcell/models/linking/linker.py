@@ -1,6 +1,9 @@
 #  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
 
-from .bm25_naive import linked_proposals
+import pandas as pd
+
+from .bm25_naive import linked_proposals, proposal_columns
+from .parallel import fork_map
 from ...pipeline_logger import pipeline_logger
 
 
@@ -24,5 +27,33 @@ class Linker:
         pipeline_logger(f"{Linker.step}::linked", paper=paper, tables=tables, proposals=proposals)
         return proposals
 
+    def link_many(self, papers, topk=1, jobs=-1):
+        """
+        Links tables of many papers in a pool of forked processes. Taxonomy, evidence automata
+        and probabilities are shared with the workers copy-on-write instead of being pickled.
+        Note that pipeline logger observers registered in the parent process don't receive
+        events emitted by the workers.
+
+        Parameters
+        ----------
+        papers: list of papers, tables of each paper are taken from `paper.tables`
+        jobs: number of processes, -1 uses all CPUs, 1 links in the current process
+
+        Returns
+        -------
+        proposals : proposals of all papers, in the order of papers
+        """
+        papers = list(papers)
+        warmup = getattr(self.taxonomy_linking, "warmup", None)
+        if warmup is not None:
+            # compile and cache lazily built structures once, before they are shared with workers
+            warmup()
+        # persistent caches are written once by each worker, after it linked its last paper
+        flush = getattr(self.taxonomy_linking, "flush", None)
+        proposals = fork_map(lambda paper: self(paper, paper.tables, topk=topk), papers, jobs=jobs, finalize=flush)
+        if not proposals:
+            return pd.DataFrame(columns=proposal_columns).set_index('cell_ext_id')
+        return pd.concat(proposals)
+
     def get_best_proposals(self, proposals):
         return proposals.groupby('cell_ext_id').head(1)
@@ -0,0 +1,283 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import atexit
+from collections import OrderedDict
+import hashlib
+import os
+from pathlib import Path
+import sys
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+
+def sizeof(value):
+    """
+    Rough estimate of memory used by a cached value
+
+    Handles numpy arrays, pandas objects and (nested) tuples and lists of them,
+    falls back to `sys.getsizeof` for everything else.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(index=True, deep=True)))
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Dictionary-like, thread-safe cache evicting least recently used entries
+
+    Parameters
+    ----------
+    maxsize: maximal number of entries kept in the cache, None for no limit
+    maxbytes: maximal total size (as estimated by `getsizeof`) of values kept in the cache, None for no limit
+    getsizeof: function used to estimate size of a value in bytes
+    """
+    def __init__(self, maxsize=None, maxbytes=None, getsizeof=sizeof):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.getsizeof = getsizeof
+        self._data = OrderedDict()
+        self._sizes = {}
+        self.currbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._data[key]
+            self._data.move_to_end(key)
+            return value
+
+    def get(self, key, default=None):
+        """Returns cached value and updates hit/miss counters."""
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                return self[key]
+            self.misses += 1
+            return default
+
+    def __setitem__(self, key, value):
+        size = self.getsizeof(value) if self.maxbytes is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = value
+            self._sizes[key] = size
+            self.currbytes += size
+            self._evict()
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        del self._data[key]
+        self.currbytes -= self._sizes.pop(key)
+
+    def _evict(self):
+        while (self.maxsize is not None and len(self._data) > self.maxsize) or \
+                (self.maxbytes is not None and self.currbytes > self.maxbytes):
+            key = next(iter(self._data))
+            self._remove(key)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.currbytes = 0
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        size=len(self._data), maxsize=self.maxsize, bytes=self.currbytes, maxbytes=self.maxbytes)
+
+    def __repr__(self):
+        return f"LRUCache({self.info()})"
+
+
+# marks missing entries, so that cached None values are not treated as misses
+_missing = object()
+
+# persistent caches not closed yet, flushed at exit. References are weak, so that registered caches
+# can still be garbage collected
+_open_caches = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_open_caches():
+    for cache in list(_open_caches):
+        cache.flush()
+
+
+class PersistentCache:
+    """
+    Dictionary-like cache reading through an in-memory cache to an on-disk store and writing
+    new entries behind, so that cached values survive the process.
+
+    On-disk entries are keyed by the namespace (e.g., a fingerprint of the model computing values)
+    and a digest of `persistent_key(key)`. New entries are written to disk in batches of
+    `flush_size` entries, on `flush`, on `close` and at exit (entries pending in a cache that is
+    garbage collected before are dropped). The store is opened lazily with
+    diskcache, which is needed only if a persistent cache is used. Forked processes reopen the store
+    and drop entries pending in the parent process, as the parent writes them itself.
+
+    Parameters
+    ----------
+    cache: in-memory cache, e.g., `LRUCache`
+    path: directory of the on-disk store, can be shared by many caches and processes
+    namespace: prefix of on-disk keys
+    persistent_key: function mapping keys to keys with `repr` stable across runs, identity by default
+    flush_size: number of pending writes triggering writing them to disk
+    """
+    def __init__(self, cache, path, namespace, persistent_key=None, flush_size=256):
+        self.cache = cache
+        self.path = Path(path)
+        self.namespace = namespace
+        self.persistent_key = persistent_key
+        self.flush_size = flush_size
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self._pending = {}
+        self._store = None
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+        _open_caches.add(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_store"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # connections of the parent process can't be used after fork
+            # and its pending entries are written by the parent
+            self._store = None
+            self._pending = {}
+            self._pid = os.getpid()
+
+    def get_store(self):
+        self._check_fork()
+        if self._store is None:
+            import diskcache as dc
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._store = dc.Cache(str(self.path))
+        return self._store
+
+    def _disk_key(self, key):
+        if self.persistent_key is not None:
+            key = self.persistent_key(key)
+        return f"{self.namespace}:{hashlib.sha1(repr(key).encode('utf-8')).hexdigest()}"
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def get(self, key, default=None):
+        """Returns value cached in memory or on disk and updates hit/miss counters."""
+        value = self.cache.get(key, _missing)
+        if value is not _missing:
+            return value
+        disk_key = self._disk_key(key)
+        with self._lock:
+            self._check_fork()
+            value = self._pending.get(disk_key, _missing)
+            if value is _missing:
+                value = self.get_store().get(disk_key, _missing)
+            if value is _missing:
+                self.disk_misses += 1
+                return default
+            self.disk_hits += 1
+        self.cache[key] = value
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.cache[key] = value
+        with self._lock:
+            self._check_fork()
+            self._pending[self._disk_key(key)] = value
+            if len(self._pending) >= self.flush_size:
+                self.flush()
+
+    def flush(self):
+        """Writes pending entries to disk."""
+        with self._lock:
+            self._check_fork()
+            if not self._pending:
+                return
+            store = self.get_store()
+            with store.transact():
+                for disk_key, value in self._pending.items():
+                    store[disk_key] = value
+            self._pending.clear()
+
+    def close(self):
+        """Writes pending entries and closes the store."""
+        self.flush()
+        _open_caches.discard(self)
+        with self._lock:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+
+    def clear(self):
+        """Clears in-memory cache, entries stored on disk are kept."""
+        self.cache.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self.cache.reset_stats()
+            self.disk_hits = self.disk_misses = 0
+
+    def info(self):
+        with self._lock:
+            return dict(self.cache.info(), disk_hits=self.disk_hits, disk_misses=self.disk_misses,
+                        pending=len(self._pending))
+
+    def __repr__(self):
+        return f"PersistentCache({self.info()})"
@@ -0,0 +1,96 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import gc
+import multiprocessing
+import multiprocessing.util
+import os
+import sys
+import warnings
+
+# function and items of the current fork_map, inherited by forked workers
+_task = None
+
+
+def _map(function, items, finalize):
+    results = [function(item) for item in items]
+    if finalize is not None:
+        finalize()
+    return results
+
+
+def _run(idx):
+    function, items = _task
+    return function(items[idx])
+
+
+def _init_worker(finalize):
+    if finalize is not None:
+        # finalizers run when a worker exits after the pool is closed
+        multiprocessing.util.Finalize(None, finalize, exitpriority=10)
+
+
+def _jobs_count(jobs, n):
+    if jobs is None:
+        jobs = 1
+    elif jobs < 0:
+        jobs = max(1, (os.cpu_count() or 1) + 1 + jobs)
+    return max(1, min(jobs, n))
+
+
+def _fork_safe():
+    # numba's TBB and OpenMP threading layers, once started, hang the parent process or the workers
+    # after a fork, only the workqueue layer can be forked
+    numba = sys.modules.get("numba")
+    if numba is None:
+        return True
+    try:
+        return numba.threading_layer() == "workqueue"
+    except ValueError:
+        # the threading layer is not initialized, workers start their own
+        return True
+
+
+def fork_map(function, items, jobs=-1, finalize=None):
+    """
+    Computes [function(item) for item in items] in a pool of forked processes.
+
+    Neither the function nor the items are pickled, workers inherit them from the parent process
+    and share their memory copy-on-write, only the indices of items and the results are sent
+    between processes. Falls back to computing in the current process if jobs is 1,
+    fork is unavailable or the process already runs numba parallel kernels on a threading layer
+    other than workqueue (the function and items can't be sent to spawned processes instead).
+
+    Parameters
+    ----------
+    function: function to apply, can be a closure or a bound method
+    items: list of arguments
+    jobs: number of processes, negative values count from the number of CPUs (-1 uses all of them)
+    finalize: function called once in each process after computing its last item, e.g., to write
+        buffered results (workers exit without running exit handlers)
+    """
+    global _task
+    items = list(items)
+    jobs = _jobs_count(jobs, len(items))
+    if jobs == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return _map(function, items, finalize)
+    if _task is not None:
+        raise RuntimeError("fork_map can't be nested")
+    if not _fork_safe():
+        warnings.warn(f"numba {sys.modules['numba'].threading_layer()} threading layer is not fork-safe, "
+                      "computing in a single process; set NUMBA_THREADING_LAYER=workqueue to use many processes")
+        return _map(function, items, finalize)
+
+    _task = (function, items)
+    # objects existing before fork are moved to the permanent generation, so that
+    # garbage collection in workers doesn't touch (and copy) their memory pages
+    gc.freeze()
+    try:
+        with multiprocessing.get_context("fork").Pool(jobs, _init_worker, (finalize,)) as pool:
+            results = pool.map(_run, range(len(items)), chunksize=1)
+            # let the workers exit normally, running their finalizers
+            pool.close()
+            pool.join()
+            return results
+    finally:
+        gc.unfreeze()
+        _task = None
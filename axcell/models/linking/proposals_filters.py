@@ -1,6 +1,7 @@
 #  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
 
 from ...pipeline_logger import pipeline_logger
+import numpy as np
 import pandas as pd
 from enum import Enum
 
@@ -9,7 +10,79 @@ class FilterOutReason(Enum):
     TrainDataset = "train-dataset"
     DevDataset = "dev-dataset"
     EmptyModelName = "empty-model-name"
+    EmptyModelType = "empty-model-type"
     ModelCompeting = "model-competing"
+    Confidence = "confidence"
+    ReplacedBy = "replaced by"
+
+
+reasons_by_code = list(FilterOutReason)
+reason_codes = {reason: code for code, reason in enumerate(reasons_by_code)}
+# rendered reasons indexed by codes, code -1 is used for proposals without a reason
+_reason_values = np.array([reason.value for reason in reasons_by_code] + [""], dtype=object)
+
+
+class Reasons:
+    """
+    Reasons for filtering out proposals kept as compact codes (see `reason_codes`) with an optional
+    int payload, a position of a related proposal (e.g., of the one which replaced a rejected
+    proposal) in filtered proposals or -1. Human-readable reasons are rendered only on demand.
+
+    Parameters
+    ----------
+    index: index of rejected proposals
+    codes: codes of reasons, one per rejected proposal, -1 for proposals without a reason
+    payload: payload of reasons, one per rejected proposal
+    render: function of codes and payload returning strings, by default values of `FilterOutReason`
+    """
+    def __init__(self, index, codes, payload=None, render=None):
+        self.index = index
+        self.codes = np.asarray(codes, dtype=np.int8)
+        self.payload = np.full(len(self.codes), -1, dtype=np.int64) if payload is None \
+            else np.asarray(payload, dtype=np.int64)
+        self._render = render
+        self._parts = None
+
+    @classmethod
+    def empty(cls):
+        return cls(pd.Index([]), [])
+
+    @classmethod
+    def combine(cls, index, parts):
+        """
+        Returns reasons of proposals in index combined from parts, pairs of positions in index
+        and reasons of proposals at these positions.
+        """
+        codes = np.full(len(index), -1, dtype=np.int8)
+        payload = np.full(len(index), -1, dtype=np.int64)
+        for positions, reasons in parts:
+            codes[positions] = reasons.codes
+            payload[positions] = reasons.payload
+        combined = cls(index, codes, payload)
+        combined._parts = parts
+        return combined
+
+    def __len__(self):
+        return len(self.codes)
+
+    def reasons(self):
+        """Returns a list of `FilterOutReason`s (None for proposals without a reason)."""
+        return [reasons_by_code[code] if code >= 0 else None for code in self.codes]
+
+    def render(self):
+        """Returns human-readable reasons as a series indexed by rejected proposals."""
+        if self._parts is not None:
+            values = np.full(len(self), "", dtype=object)
+            for positions, reasons in self._parts:
+                values[positions] = reasons.render().values
+        elif self._render is not None:
+            values = self._render(self.codes, self.payload)
+        else:
+            values = _reason_values[self.codes]
+        return pd.Series(values, index=self.index, dtype=object)
+
+    def __repr__(self):
+        return f"Reasons({len(self)} proposals)"
 
 
 class ProposalsFilter:
@@ -18,47 +91,158 @@ class ProposalsFilter:
     def _filter(self, proposals):
         raise NotImplementedError
 
-    def filter(self, proposals):
+    def filter_codes(self, proposals):
+        """
+        Returns a boolean series of proposals to keep and `Reasons` for filtering out the others,
+        rendered only if needed.
+        """
         which, reason = self._filter(proposals)
-        self.log(proposals=proposals, which=which, reason=reason)
+        reason = _as_reasons(reason, proposals.index[~which.values])
+        # reasons are rendered only for observers
+        if self.observed():
+            self.log(proposals=proposals, which=which, reason=reason.render())
         return which, reason
 
+    def filter(self, proposals):
+        """
+        Returns a boolean series of proposals to keep and a series of reasons for filtering out the others.
+        """
+        which, reason = self.filter_codes(proposals)
+        return which, reason.render()
+
     def __rshift__(self, other):
+        if isinstance(other, CompoundFilter):
+            return CompoundFilter([self] + other.filters)
         return CompoundFilter([self, other])
 
     def __call__(self, proposals):
-        which, reason = self.filter(proposals)
+        which, reason = self.filter_codes(proposals)
         return proposals[which]
 
+    def observed(self):
+        return pipeline_logger.observed(f"filtering::{self.step}::filtered")
+
     def log(self, **kwargs):
         pipeline_logger(f"filtering::{self.step}::filtered", **kwargs)
 
 
+class MaskFilter(ProposalsFilter):
+    """
+    Filter deciding about each proposal independently of other proposals,
+    so that it can be evaluated on all proposals at once in a `CompoundFilter`.
+    """
+    def _mask(self, proposals):
+        """Returns a boolean array of proposals to keep."""
+        raise NotImplementedError
+
+    def _reasons(self, proposals):
+        """Returns `Reasons` for filtering out given (rejected) proposals."""
+        raise NotImplementedError
+
+    def _filter(self, proposals):
+        which = pd.Series(self._mask(proposals), index=proposals.index)
+        return which, self._reasons(proposals[~which.values])
+
+
+def _as_reasons(reason, rejected):
+    # filters returning series of strings are supported as well
+    if isinstance(reason, Reasons):
+        return reason
+    if reason.index.is_unique:
+        values = reason.reindex(rejected).values
+    else:
+        values = reason.values
+    return Reasons(rejected, np.full(len(rejected), -1), render=lambda codes, payload: values)
+
+
 class CompoundFilter(ProposalsFilter):
+    """
+    Applies filters one after another, each to proposals kept by the previous ones.
+
+    Filters are run according to a plan: consecutive mask filters are evaluated together
+    on all proposals as a single boolean expression, without slicing proposals, and only
+    other filters (e.g., `BestResultFilter`) get the subset of proposals kept so far.
+    Reasons are computed only for rejected proposals and only if they're needed. Filters
+    with observers registered in pipeline logger are run separately, so that observers
+    receive the same events as if filters were applied one by one.
+    """
     step = "compound_filtering"
 
     def __init__(self, filters):
         self.filters = filters
 
-    def _filter(self, proposals):
-        agg_which = pd.Series(data=True, index=proposals.index)
-        agg_reason = pd.Series(data="", index=proposals.index)
+    def __rshift__(self, other):
+        others = other.filters if isinstance(other, CompoundFilter) else [other]
+        return CompoundFilter(self.filters + others)
 
+    def plan(self):
+        """Returns a list of stages: lists of fused mask filters or single filters."""
+        stages = []
         for f in self.filters:
-            which, reason = f.filter(proposals)
-            agg_reason[agg_which & ~which] = reason
-            agg_which &= which
-            proposals = proposals[which]
-        return agg_which, agg_reason[~agg_which]
+            if isinstance(f, MaskFilter) and not f.observed():
+                if stages and isinstance(stages[-1], list):
+                    stages[-1].append(f)
+                else:
+                    stages.append([f])
+            else:
+                stages.append(f)
+        return stages
+
+    def _run(self, proposals, reasons=True):
+        alive = np.ones(len(proposals), dtype=bool)
+        rejections = []
+        for stage in self.plan():
+            if isinstance(stage, list):
+                masks = np.array([f._mask(proposals) for f in stage], dtype=bool).reshape(len(stage), -1)
+                rejected = np.flatnonzero(alive & ~masks.all(axis=0))
+                # the first of fused filters rejecting a proposal gives the reason
+                rejections.append((stage, rejected, np.argmin(masks[:, rejected], axis=0)))
+            else:
+                kept = np.flatnonzero(alive)
+                which, reason = stage.filter_codes(proposals.iloc[kept])
+                rejected = kept[~np.asarray(which.values, dtype=bool)]
+                rejections.append((stage, rejected, (kept, reason)))
+            alive[rejected] = False
+
+        which = pd.Series(alive, index=proposals.index)
+        if not reasons:
+            return which, None
+        # positions of rejected proposals among all rejected ones
+        positions = np.cumsum(~alive) - 1
+        parts = []
+        for stage, rejected, reason in rejections:
+            if isinstance(stage, list):
+                # reason is the index of the first rejecting filter
+                for i, f in enumerate(stage):
+                    rows = rejected[reason == i]
+                    if len(rows):
+                        parts.append((positions[rows], f._reasons(proposals.iloc[rows])))
+            elif len(rejected):
+                kept, reason = reason
+                # payload positions are relative to proposals seen by the filter
+                payload = np.where(reason.payload >= 0, kept[np.maximum(reason.payload, 0)], -1)
+                parts.append((positions[rejected], Reasons(reason.index, reason.codes, payload,
+                                                           render=lambda codes, payload, r=reason: r.render().values)))
+        return which, Reasons.combine(proposals.index[~alive], parts)
+
+    def _filter(self, proposals):
+        return self._run(proposals)
+
+    def __call__(self, proposals):
+        if self.observed():
+            return super().__call__(proposals)
+        which, _ = self._run(proposals, reasons=False)
+        return proposals[which]
 
 
-class NopFilter(ProposalsFilter):
+class NopFilter(MaskFilter):
     step = "nop_filtering"
 
-    def _filter(self, proposals):
-        which = pd.Series(data=True, index=proposals.index)
-        reason = pd.Series()
-        return which, reason
+    def _mask(self, proposals):
+        return np.ones(len(proposals), dtype=bool)
+
+    def _reasons(self, proposals):
+        return Reasons(proposals.index, np.full(len(proposals), -1))
 
 
 # filter proposals for which structure prediction
@@ -66,31 +250,38 @@ class NopFilter(ProposalsFilter):
 # * found dataset cell containing "dev" or "train"
 # this filter could be applied before taxonomy linking,
 # but to make error analysis easier it's applied after
-class StructurePredictionFilter(ProposalsFilter):
+class StructurePredictionFilter(MaskFilter):
     step = "structure_filtering"
 
-    def _filter(self, proposals):
-        which = (proposals.struct_model_type != '') \
-                         & ~proposals.struct_dataset.str.contains('dev') \
-                         & ~proposals.struct_dataset.str.contains('train')
-        reason = pd.Series(data="", index=proposals.index)
-        reason[proposals.struct_dataset.str.contains('train')] = "train-dataset"
-        reason[proposals.struct_dataset.str.contains('dev')] = "dev-dataset"
-        reason[proposals.struct_model_type == ''] = "empty-model-type"
+    def _mask(self, proposals):
+        return ((proposals.struct_model_type != '') \
+                & ~proposals.struct_dataset.str.contains('dev') \
+                & ~proposals.struct_dataset.str.contains('train')).values
 
-        return which, reason[~which]
+    def _reasons(self, proposals):
+        codes = np.full(len(proposals), -1)
+        codes[proposals.struct_dataset.str.contains('train').values] = reason_codes[FilterOutReason.TrainDataset]
+        codes[proposals.struct_dataset.str.contains('dev').values] = reason_codes[FilterOutReason.DevDataset]
+        codes[(proposals.struct_model_type == '').values] = reason_codes[FilterOutReason.EmptyModelType]
+        return Reasons(proposals.index, codes)
 
 
-class ConfidenceFilter(ProposalsFilter):
+class ConfidenceFilter(MaskFilter):
     step = "confidence_filtering"
 
     def __init__(self, confidence=-1):
         self.confidence = confidence
 
-    def _filter(self, proposals):
-        which = proposals.confidence >= self.confidence
-        reason = "confidence " + proposals[~which].confidence.round(2).astype(str) + f" < {self.confidence}"
-        return which, reason[~which]
+    def _mask(self, proposals):
+        return (proposals.confidence >= self.confidence).values
+
+    def _reasons(self, proposals):
+        confidence, threshold = proposals.confidence, self.confidence
+
+        def render(codes, payload):
+            return ("confidence " + confidence.round(2).astype(str) + f" < {threshold}").values
+        return Reasons(proposals.index, np.full(len(proposals), reason_codes[FilterOutReason.Confidence]),
+                       render=render)
 
     def log(self, **kwargs):
         super().log(**kwargs, confidence=self.confidence)
@@ -103,20 +294,13 @@ class BestResultFilter(ProposalsFilter):
         assert context in ["paper", "table"]
         self.metrics_info = taxonomy.metrics_info
         self.context = context
+        self._directions = {}
 
-    def _filter(self, proposals):
-        reason = pd.Series(data="", index=proposals.index)
-        indices = []
-
-        if self.context == "paper":
-            context_column = proposals.index.to_series().str.split('/', expand=False).apply(lambda x: x[0])
-        else:
-            context_column = proposals.index.to_series().str.split('/', expand=False).apply(lambda x: x[0] + "/" + x[1])
-
-        for key_all, group in proposals[(proposals.model_type == 'model-best') & ~proposals.parsed.isna()].groupby(
-                by=["dataset", "metric", "task", context_column]):
-            dataset, metric, task, paper = key_all
-            key = (task, dataset, metric)
+    def direction(self, task, dataset, metric):
+        """Returns 1 if higher values of metric are better for a given task and dataset, -1 otherwise."""
+        key = (task, dataset, metric)
+        d = self._directions.get(key)
+        if d is None:
             d = 0
             if key in self.metrics_info:
                 d = self.metrics_info[key]
@@ -126,17 +310,63 @@ class BestResultFilter(ProposalsFilter):
                 d = -1
             elif 'accuracy' in metric.lower():
                 d = 1
+            d = 1 if d >= 0 else -1
+            self._directions[key] = d
+        return d
 
-            if d >= 0:
-                index = group.parsed.idxmax()
-            else:
-                index = group.parsed.idxmin()
-            indices.append(index)
-            reason[group.index[group.index != index]] = "replaced by " + str(index)
+    def context_ids(self, index):
+        """Returns ids of papers or tables of cells in index, split once per distinct cell."""
+        parts = 1 if self.context == "paper" else 2
+        codes, cells = pd.factorize(index)
+        contexts = np.array(["/".join(cell.split('/')[:parts]) for cell in cells], dtype=object)
+        return contexts[codes]
 
-        reason[proposals.struct_model_type == 'model-competing'] = "model-competing"
-        which = proposals.index.to_series().isin(indices)
-        return which, reason[~which]
+    def _filter(self, proposals):
+        index = proposals.index
+        is_candidate = ((proposals.model_type == 'model-best') & ~proposals.parsed.isna()).values
+        candidates = proposals[is_candidate]
+        # groups are numbered in the order of sorted keys, as in groupby
+        groups = candidates.groupby(by=[candidates.dataset.values, candidates.metric.values,
+                                        candidates.task.values, self.context_ids(candidates.index)]).ngroup().values
+        valid = groups >= 0
+        candidates, groups = candidates[valid], groups[valid]
+        positions = np.flatnonzero(is_candidate)[valid]
+
+        # directions are resolved once per group
+        first = np.unique(groups, return_index=True)[1]
+        directions = np.array([self.direction(task, dataset, metric) for task, dataset, metric in
+                               zip(candidates.task.values[first], candidates.dataset.values[first],
+                                   candidates.metric.values[first])], dtype=np.float64)
+
+        # the first of the best results of each group, as in idxmax / idxmin
+        order = np.lexsort((-directions[groups] * candidates.parsed.values.astype(np.float64), groups))
+        sorted_groups = groups[order]
+        best = order[np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]] if len(order) else order
+        best_labels = index.values[positions[best]]
+        winners = np.empty(len(first), dtype=object)
+        winners[:] = best_labels
+
+        # reasons are assigned to labels, other proposals of a cell share its reason
+        labels = index.values[positions]
+        losers = np.flatnonzero(labels != winners[groups])
+        losers = losers[np.argsort(groups[losers], kind="stable")]
+        replaced_by = pd.Series(positions[best][groups[losers]], index=labels[losers], dtype=np.int64)
+        replaced_by = replaced_by[~replaced_by.index.duplicated(keep="last")]
+        payload = index.map(replaced_by).fillna(-1).values.astype(np.int64)
+        codes = np.where(payload >= 0, reason_codes[FilterOutReason.ReplacedBy], -1)
+        competing = (proposals.struct_model_type == 'model-competing').values
+        codes[competing] = reason_codes[FilterOutReason.ModelCompeting]
+        payload[competing] = -1
+
+        which = index.to_series().isin(best_labels)
+        rejected = ~which.values
+
+        def render(codes, payload):
+            values = _reason_values[codes]
+            replaced = codes == reason_codes[FilterOutReason.ReplacedBy]
+            values[replaced] = ["replaced by " + str(label) for label in index.values[payload[replaced]]]
+            return values
+        return which, Reasons(index[rejected], codes[rejected], payload[rejected], render=render)
 
     def log(self, **kwargs):
         super().log(**kwargs, context=self.context)
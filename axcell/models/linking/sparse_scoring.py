@@ -0,0 +1,264 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import math
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def top_k_indices(scores, k):
+    """
+    Returns indices of k largest scores in descending order of scores. Ties are ordered by index,
+    the same as with stable sorting. Uses partial selection instead of sorting all scores.
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    if k < n:
+        kth = np.partition(scores, n - k)[n - k]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+def _inverted_index(values, size):
+    # CSR-like index: entries[indptr[v]:indptr[v+1]] are positions i with values[i] == v
+    entries = np.argsort(values, kind="stable").astype(np.int32)
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(values, minlength=size), out=indptr[1:])
+    return indptr, entries
+
+
+class SparseAxis:
+    """
+    Reverse probabilities Pr(axis value | evidence) of a single taxonomy axis stored as
+    a CSR matrix with rows indexed by axis values and columns indexed by evidences.
+
+    Parameters
+    ----------
+    names: ordered list of axis values (tasks, datasets or metrics)
+    reverse_probs: reverse_probs[name][evidence] = Pr(name | evidence)
+    """
+    def __init__(self, names, reverse_probs):
+        self.names = list(names)
+        self.evidence_ids = {}
+        rows, cols, data = [], [], []
+        for row, name in enumerate(self.names):
+            for evidence, p in reverse_probs.get(name, {}).items():
+                col = self.evidence_ids.setdefault(evidence, len(self.evidence_ids))
+                rows.append(row)
+                cols.append(col)
+                data.append(p)
+        self.matrix = csr_matrix((np.array(data, dtype=np.float64), (rows, cols)),
+                                 shape=(len(self.names), len(self.evidence_ids)))
+        self.matrix.sum_duplicates()
+        self._log_matrices = {}
+
+    @classmethod
+    def from_arrays(cls, names, evidences, data, indices, indptr):
+        axis = cls.__new__(cls)
+        axis.names = list(names)
+        axis.evidence_ids = {evidence: i for i, evidence in enumerate(evidences)}
+        axis.matrix = csr_matrix((data, indices, indptr), shape=(len(axis.names), len(axis.evidence_ids)))
+        axis._log_matrices = {}
+        return axis
+
+    def to_arrays(self):
+        evidences = sorted(self.evidence_ids, key=self.evidence_ids.get)
+        return self.names, evidences, self.matrix.data, self.matrix.indices, self.matrix.indptr
+
+    def to_dict(self):
+        """Returns reverse probabilities as a nested dictionary (see `reverse_probs`)."""
+        evidences = sorted(self.evidence_ids, key=self.evidence_ids.get)
+        reverse = {}
+        for row, name in enumerate(self.names):
+            start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+            if start < end:
+                reverse[name] = {evidences[col]: float(p) for col, p in
+                                 zip(self.matrix.indices[start:end], self.matrix.data[start:end])}
+        return reverse
+
+    def _log_terms(self, noise, pb):
+        # log(noise * pb + (1 - noise) * p) for every non-zero p (in CSC format, to select columns of
+        # found evidences) and log(noise * pb) of evidences not supporting an axis value. Terms are
+        # computed one by one with libm log, the same as by `axis_logprobs`. Cached as there are
+        # only a few distinct noise parameters
+        key = (noise, pb)
+        if key not in self._log_matrices:
+            if noise * pb <= 0:
+                raise ValueError("Sparse scoring requires positive noise and prior probability")
+            m = self.matrix.tocsc()
+            m.data = np.array([math.log(noise * pb + (1 - noise) * p) for p in m.data.tolist()], dtype=np.float64)
+            self._log_matrices[key] = (m, math.log(noise * pb))
+        return self._log_matrices[key]
+
+    def columns(self, symbols):
+        """Returns an array mapping ids of evidences in symbols table to columns of the matrix (-1 if missing)."""
+        columns = np.full(len(symbols), -1, dtype=np.int32)
+        for evidence, col in self.evidence_ids.items():
+            columns[symbols.ids[evidence]] = col
+        return columns
+
+    def found_columns(self, found_evidences, max_repetitions):
+        """
+        Returns matrix columns (-1 for evidences missing from the vocabulary) and counts, capped
+        at max_repetitions, of found evidences in their order. found_evidences is either a dictionary
+        from evidences to counts or a pair of arrays of columns and counts (see `columns`).
+        """
+        if isinstance(found_evidences, tuple):
+            columns, counts = found_evidences
+        else:
+            columns = np.array([self.evidence_ids.get(evidence, -1) for evidence in found_evidences], dtype=np.int64)
+            counts = np.fromiter(found_evidences.values(), dtype=np.float64, count=len(found_evidences))
+        return np.asarray(columns, dtype=np.int64), np.minimum(counts, max_repetitions)
+
+    def scores(self, found_evidences, noise, pb, max_repetitions):
+        """
+        Computes log-probabilities of all axis values given found evidences.
+
+        Terms of found evidences are summed in their order, the same as in `axis_logprobs`,
+        so the log-probabilities are identical to these of the numba backend. Only axis values
+        supported by at least one of the evidences are summed separately, all the other values
+        share the same log-probability.
+
+        Returns
+        -------
+        base : log-probability of axis values not supported by any of found evidences
+        supported : sorted indices of axis values supported by found evidences
+        logprobs : log-probabilities of all axis values
+        """
+        columns, counts = self.found_columns(found_evidences, max_repetitions)
+        log_terms, floor_term = self._log_terms(noise, pb)
+        known = np.flatnonzero(columns >= 0)
+        found = log_terms[:, columns[known]].tocoo()
+        supported = np.unique(found.row)
+
+        # one row of terms per supported axis value and the last one for all the other values
+        terms = np.full((len(supported) + 1, len(columns) + 1), floor_term)
+        terms[np.searchsorted(supported, found.row), known[found.col] + 1] = found.data
+        terms[:, 1:] *= counts
+        terms[:, 0] = 0.0
+        sums = np.add.accumulate(terms, axis=1)[:, -1]
+
+        base = float(sums[-1])
+        logprobs = np.full(len(self.names), base)
+        logprobs[supported] = sums[:-1]
+        return base, supported, logprobs
+
+    def logprobs(self, found_evidences, noise, pb, max_repetitions):
+        return self.scores(found_evidences, noise, pb, max_repetitions)[2]
+
+
+class SparseScorer:
+    """
+    Vectorized equivalent of `compute_logprobs`. Log-probabilities of tasks, datasets
+    and metrics are summed only for axis values supported by found evidences (see
+    `SparseAxis.scores`) and then gathered into taxonomy entries.
+
+    Parameters
+    ----------
+    triples: (n, 3) array of indices of (task, dataset, metric) of taxonomy entries in axes names
+    tasks, datasets, metrics: `SparseAxis` for each axis
+    """
+    def __init__(self, triples, tasks, datasets, metrics):
+        self.tasks = tasks
+        self.datasets = datasets
+        self.metrics = metrics
+
+        triples = np.asarray(triples, dtype=np.int32).reshape(-1, 3)
+        self.task_idx = np.ascontiguousarray(triples[:, 0])
+        self.dataset_idx = np.ascontiguousarray(triples[:, 1])
+        self.metric_idx = np.ascontiguousarray(triples[:, 2])
+        self.size = len(self.task_idx)
+
+        # inverted index from axis values to taxonomy entries
+        self.entries_by_axis = (
+            _inverted_index(self.task_idx, len(self.tasks.names)),
+            _inverted_index(self.dataset_idx, len(self.datasets.names)),
+            _inverted_index(self.metric_idx, len(self.metrics.names))
+        )
+
+    def __call__(self, dss, mss, tss, noise, ms_noise, ts_noise, ds_pb, ms_pb, ts_pb, max_repetitions):
+        ts_lp = self.tasks.logprobs(tss, ts_noise, ts_pb, max_repetitions)
+        ds_lp = self.datasets.logprobs(dss, noise, ds_pb, 1)
+        ms_lp = self.metrics.logprobs(mss, ms_noise, ms_pb, 1)
+        logprobs = ds_lp[self.dataset_idx] + ms_lp[self.metric_idx] + ts_lp[self.task_idx]
+        return logprobs, (ts_lp, ds_lp, ms_lp)
+
+    def axes_scores(self, dss, mss, tss, noise, ms_noise, ts_noise, ds_pb, ms_pb, ts_pb, max_repetitions):
+        """Returns `SparseAxis.scores` of tasks, datasets and metrics."""
+        return (
+            self.tasks.scores(tss, ts_noise, ts_pb, max_repetitions),
+            self.datasets.scores(dss, noise, ds_pb, 1),
+            self.metrics.scores(mss, ms_noise, ms_pb, 1)
+        )
+
+    def candidates(self, supported):
+        """Returns sorted indices of taxonomy entries with at least one of supported tasks, datasets or metrics."""
+        parts = []
+        for (indptr, entries), values in zip(self.entries_by_axis, supported):
+            for value in np.unique(values):
+                parts.append(entries[indptr[value]:indptr[value + 1]])
+        if not parts:
+            return np.array([], dtype=np.int32)
+        return np.unique(np.concatenate(parts))
+
+    def top_k(self, contexts, k):
+        """
+        Finds k most probable taxonomy entries given `axes_scores` of contexts, in the order
+        in which the contexts are summed. Only entries with at least one axis value supported
+        by evidences are scored, all the other entries share the same log-probability and are
+        accounted for analytically in the softmax normalization.
+
+        Log-probabilities are summed in the same order as with `__call__`, so the top entries are
+        the same as of the full softmax, probabilities can differ by rounding of the normalization.
+
+        Returns
+        -------
+        indices : indices of the top k entries (ties ordered by index)
+        probs : probabilities of the top k entries
+        """
+        candidates = self.candidates([np.concatenate([scores[axis][1] for scores in contexts]).astype(np.int64)
+                                      for axis in range(3)] if contexts else [])
+        dataset_idx = self.dataset_idx[candidates]
+        metric_idx = self.metric_idx[candidates]
+        task_idx = self.task_idx[candidates]
+        floor = 0.0
+        logprobs = np.zeros(len(candidates))
+        for (ts_base, _, ts_lp), (ds_base, _, ds_lp), (ms_base, _, ms_lp) in contexts:
+            floor += ds_base + ms_base + ts_base
+            logprobs += ds_lp[dataset_idx] + ms_lp[metric_idx] + ts_lp[task_idx]
+        n_floor = self.size - len(candidates)
+
+        m = max(logprobs.max() if len(candidates) else -np.inf, floor if n_floor else -np.inf)
+        exps = np.exp(logprobs - m)
+        floor_exp = np.exp(floor - m)
+        norm = exps.sum() + n_floor * floor_exp
+        probs = exps / norm
+        floor_prob = floor_exp / norm
+
+        above = probs > floor_prob
+        top = top_k_indices(probs[above], k)
+        indices = list(candidates[above][top])
+        top_probs = list(probs[above][top])
+
+        # fill with entries having the floor probability, in index order
+        if len(indices) < k:
+            other = set(candidates[probs != floor_prob].tolist())
+            for idx in range(self.size):
+                if len(indices) >= k:
+                    break
+                if idx not in other:
+                    indices.append(idx)
+                    top_probs.append(floor_prob)
+
+        # and with entries below the floor
+        if len(indices) < k:
+            below = probs < floor_prob
+            top = top_k_indices(probs[below], k - len(indices))
+            indices.extend(candidates[below][top])
+            top_probs.extend(probs[below][top])
+        return np.array(indices, dtype=np.int64), np.array(top_probs)
@@ -3,9 +3,42 @@
 from pathlib import Path
 import json
 from collections import OrderedDict
+import numpy as np
 from axcell.models.linking.manual_dicts import complementary_metrics
 
 
+class SymbolTable:
+    """Interns names as consecutive integer ids."""
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        idx = self.ids.get(name)
+        if idx is None:
+            idx = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return idx
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, idx):
+        return self.names[idx]
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def get(self, name, default=-1):
+        return self.ids.get(name, default)
+
+    def lookup(self, ids):
+        """Materializes names of an array of ids."""
+        return [self.names[idx] for idx in ids]
+
+
 class Taxonomy:
     def __init__(self, taxonomy, metrics_info):
         self.taxonomy = self._get_taxonomy(taxonomy)
@@ -13,6 +46,22 @@ class Taxonomy:
         self.tasks = self._get_axis('task')
         self.datasets = self._get_axis('dataset')
         self.metrics = self._get_axis('metric')
+        self._init_symbols()
+
+    def _init_symbols(self):
+        # integer ids used internally by linking, names are materialized only for final proposals.
+        # Names are sorted, so that ids don't depend on the iteration order of sets (i.e., the hash seed)
+        self.task_symbols = SymbolTable(sorted(self.tasks))
+        self.dataset_symbols = SymbolTable(sorted(self.datasets))
+        self.metric_symbols = SymbolTable(sorted(self.metrics))
+        self.triples = np.array([
+            (self.task_symbols.ids[t], self.dataset_symbols.ids[d], self.metric_symbols.ids[m])
+            for t, d, m in self.taxonomy
+        ], dtype=np.int32).reshape(-1, 3)
+        self.true_metrics = np.array([
+            self.metric_symbols.ids[self.normalize_metric(t, d, m)] for t, d, m in self.taxonomy
+        ], dtype=np.int32)
+        self.triple_ids = {triple: i for i, triple in enumerate(self.taxonomy)}
 
     def normalize_metric(self, task, dataset, metric):
         if (task, dataset, metric) in self._complementary:
@@ -1,5 +1,6 @@
 #  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
 
+from functools import lru_cache, wraps
 from unidecode import unidecode
 import re
 
@@ -25,32 +26,79 @@ def clean_cell(cell):
 year_2k_re = re.compile(r"20(\d\d)")
 hyphens_re = re.compile(r"[-_'`–’→]")
 ws_re = re.compile(r"\s+")
+hyphens_run_re = re.compile(r"[-_'`–’→]+")
+
+# \w matches the same characters as str.isalnum, \s as str.isspace, plus underscore
+non_alnum_re = re.compile(r"[\W_]+")
+non_alnum_ws_re = re.compile(r"(?:[^\w\s]|_)+")
+non_ascii_re = re.compile(r"[^\x00-\x7f]+")
+# str.translate is fast for ASCII strings only
+delete_non_alnum_ascii = str.maketrans("", "", "".join(chr(c) for c in range(128) if not chr(c).isalnum()))
+delete_non_alnum_ws_ascii = str.maketrans("", "", "".join(chr(c) for c in range(128)
+                                                           if not (chr(c).isalnum() or chr(c).isspace())))
+
+
+def memoized(max_length=64, maxsize=2**16):
+    """
+    Memoizes results of a function of a string for strings of at most max_length characters,
+    long texts (e.g., whole papers) are rarely repeated and are processed directly.
+    """
+    def decorator(function):
+        cached = lru_cache(maxsize=maxsize)(function)
+
+        @wraps(function)
+        def wrapper(s):
+            if len(s) <= max_length:
+                return cached(s)
+            return function(s)
+        wrapper.cache_info = cached.cache_info
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return decorator
+
+
+def _unidecode(s):
+    # unidecode transliterates each character independently and keeps ASCII characters
+    if s.isascii():
+        return s
+    return non_ascii_re.sub(lambda m: unidecode(m.group()), s)
 
 
 refs_re = re.compile(r"(xxtable-)?xxanchor-[^ ]*|xxref-[^ ]*")
 
 def remove_references(s):
-    return refs_re.sub("", s)
+    return refs_re.sub("", s) if "xx" in s else s
 
+# " ".join(s.split()) collapses whitespaces as ws_re and strips the result
+
+@memoized()
 def normalize_dataset_ws(name):
     name = remove_references(name)
-    name = hyphens_re.sub(" ", name)
-    name = year_2k_re.sub(r"\1", name)
-    name = ws_re.sub(" ", name)
-    return unidecode(name.strip().lower())
+    name = hyphens_run_re.sub(" ", name)
+    if "20" in name:
+        name = year_2k_re.sub(r"\1", name)
+    return _unidecode(" ".join(name.split()).lower())
 
+@memoized()
 def normalize_dataset(name):
     name = remove_references(name)
-    name = year_2k_re.sub(r"\1", name)
-    name = hyphens_re.sub("", name)
-    name = ws_re.sub(" ", name)
-    return unidecode(name.strip().lower())
+    # years are shortened before removing hyphens, which can join digits
+    if "20" in name:
+        name = year_2k_re.sub(r"\1", name)
+    name = hyphens_run_re.sub("", name)
+    return _unidecode(" ".join(name.split()).lower())
 
 
+@memoized()
 def normalize_cell(s):
-    return unidecode("".join([x for x in s if x.isalnum()]))
+    if s.isascii():
+        return s.translate(delete_non_alnum_ascii)
+    return _unidecode(non_alnum_re.sub("", s))
 
+@memoized()
 def normalize_cell_ws(s):
-    return unidecode("".join([x for x in s if x.isalnum() or x.isspace()]))
+    if s.isascii():
+        return s.translate(delete_non_alnum_ws_ascii)
+    return _unidecode(non_alnum_ws_re.sub("", s))
 
 # end of cleaning & normalization
@@ -23,6 +23,10 @@ class PipelineLogger:
                 pattern = re.compile(pattern)
             self.observers = [(p, o) for p, o in self.observers if o != observer or p.pattern != pattern.pattern]
 
+    def observed(self, step):
+        """Returns True if any observer is registered for step, so that costly event arguments can be skipped."""
+        return any(pattern.match(step) for pattern, _ in self.observers)
+
     def __call__(self, step, **args):
         for pattern, observer in self.observers:
             if pattern.match(step):
@@ -0,0 +1,94 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+# Micro-benchmark of text normalization primitives from axcell.models.linking.utils
+# against their original per-character implementations, on whole paper texts
+# (as normalized by DatasetExtractor) and on short evidence names (as normalized by ContextSearch).
+#
+#   python benchmarks/normalization.py [--path paper.txt] [--repeat 5]   (with axcell installed)
+
+from pathlib import Path
+import random
+import re
+import timeit
+
+from unidecode import unidecode
+
+from axcell.models.linking import utils
+from axcell.models.linking.utils import remove_references, year_2k_re, hyphens_re, ws_re
+
+
+def reference_normalize_dataset_ws(name):
+    name = remove_references(name)
+    name = hyphens_re.sub(" ", name)
+    name = year_2k_re.sub(r"\1", name)
+    name = ws_re.sub(" ", name)
+    return unidecode(name.strip().lower())
+
+
+def reference_normalize_dataset(name):
+    name = remove_references(name)
+    name = year_2k_re.sub(r"\1", name)
+    name = hyphens_re.sub("", name)
+    name = ws_re.sub(" ", name)
+    return unidecode(name.strip().lower())
+
+
+def reference_normalize_cell(s):
+    return unidecode("".join([x for x in s if x.isalnum()]))
+
+
+def reference_normalize_cell_ws(s):
+    return unidecode("".join([x for x in s if x.isalnum() or x.isspace()]))
+
+
+functions = ["normalize_dataset_ws", "normalize_dataset", "normalize_cell", "normalize_cell_ws"]
+
+
+def synthetic_paper(length=100000, seed=0):
+    rnd = random.Random(seed)
+    words = ["we", "evaluate", "our", "model", "on", "the", "ImageNet", "CIFAR-10", "test", "set", "and",
+             "achieve", "top-1", "accuracy", "of", "state-of-the-art", "results", "in", "2017", "BLEU",
+             "WMT'14", "English–German", "xxref-Vaswani2017", "xxanchor-tab:results", "(see", "Table)",
+             "F1", "score", "SQuAD", "v1.1", "→", "Müller", "et", "al."]
+    text = []
+    size = 0
+    while size < length:
+        word = rnd.choice(words)
+        text.append(word)
+        size += len(word) + 1
+    return " ".join(text)
+
+
+def _time(function, inputs, repeat):
+    return min(timeit.repeat(lambda: [function(x) for x in inputs], number=1, repeat=repeat))
+
+
+def _report(name, label, before, after):
+    print(f"{name:22} {label:6} {before * 1000:9.2f} ms -> {after * 1000:9.2f} ms ({before / after:5.1f}x)")
+
+
+def benchmark(path=None, repeat=5):
+    """Prints times of original and current normalization of a paper text and of short names in it."""
+    text = Path(path).read_text() if path is not None else synthetic_paper()
+    names = re.findall(r"\S+(?: \S+)?", text)
+    print(f"paper: {len(text)} characters, names: {len(names)} ({len(set(names))} distinct)")
+    for name in functions:
+        reference = globals()[f"reference_{name}"]
+        current = getattr(utils, name)
+        assert reference(text) == current(text), f"{name} output differs"
+        assert [reference(x) for x in names] == [current(x) for x in names], f"{name} output differs"
+        current.cache_clear()
+        for label, inputs in [("paper", [text]), ("names", names)]:
+            before = _time(reference, inputs, repeat)
+            after = _time(current, inputs, repeat)
+            _report(name, label, before, after)
+
+    # paper context of DatasetExtractor
+    before = _time(lambda x: reference_normalize_cell_ws(reference_normalize_dataset_ws(x)), [text], repeat)
+    after = _time(lambda x: utils.normalize_cell_ws(utils.normalize_dataset_ws(x)), [text], repeat)
+    _report("both _ws", "paper", before, after)
+
+
+if __name__ == "__main__":
+    from fire import Fire
+    Fire(benchmark)
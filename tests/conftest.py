@@ -0,0 +1,69 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import os
+import random
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# numba parallel kernels of the session run on the fork-safe threading layer, so that
+# fork_map tests still fork after them
+os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+
+linking_data = Path(__file__).resolve().parent / "data" / "linking"
+
+words = ("we evaluate our model on ImageNet and CIFAR-10 top-1 accuracy error rate SQuAD1.1 EM F1 exact match "
+         "WMT2014 English-German BLEU score Cityscapes mean IoU LibriSpeech test-clean word error rate WER "
+         "question answering image classification machine translation results show state of the art dev "
+         "the of and in xxref-Table1 xxref-Table2 xxref-Table3 table figure appendix").split()
+
+
+def make_paper(seed, n_tables=3, rows=8, cols=6, n_fragments=30):
+    """Returns a random paper with tables of numeric results, linkable with the taxonomy from data/linking."""
+    rnd = random.Random(seed)
+    fragments = [SimpleNamespace(header=f"{i} Section",
+                                 text=" ".join(rnd.choice(words) for _ in range(rnd.randint(20, 120))))
+                 for i in range(n_fragments)]
+    tables = []
+    for t in range(n_tables):
+        matrix = [["" for _ in range(cols)] for _ in range(rows)]
+        tags = [["" for _ in range(cols)] for _ in range(rows)]
+        matrix[0][0] = "Model"
+        for c in range(1, cols):
+            matrix[0][c] = rnd.choice(["ImageNet", "CIFAR-10 top-1", "SQuAD EM", "F1", "BLEU", "WMT14 En-De",
+                                       "test-clean WER", "dev"])
+            tags[0][c] = rnd.choice(["dataset", "dataset", "dataset-sub", "metric"])
+        for r in range(1, rows):
+            matrix[r][0] = rnd.choice(["ResNet", "BERT", "Ours", "Transformer", "LSTM"]) + str(r)
+            tags[r][0] = rnd.choice(["model-best", "model-paper", "model-competing", ""])
+            for c in range(1, cols):
+                value = rnd.choice(["{:.1f}", "{:.2f}", "{:.1f}%", "{:.1f} ± 0.2", "0.{:02.0f}", "-", "{:.3f}"])
+                matrix[r][c] = value.format(rnd.uniform(0, 99)) if "{" in value else value
+        caption = f"Table {t + 1}: results on " + " ".join(rnd.choice(words) for _ in range(8))
+        tables.append(SimpleNamespace(matrix=matrix, matrix_tags=tags, caption=caption, name=f"table_{t + 1:02d}.csv",
+                                      figure_id=f"Table{t + 1}" if t < 2 else None))
+    text = SimpleNamespace(abstract=" ".join(rnd.choice(words) for _ in range(50)), fragments=fragments)
+    return SimpleNamespace(paper_id=f"1234.{seed:05d}", text=text, tables=tables)
+
+
+@pytest.fixture(scope="session")
+def linking_data_path():
+    return linking_data
+
+
+@pytest.fixture(scope="session")
+def taxonomy():
+    from axcell.models.linking import Taxonomy
+    return Taxonomy(taxonomy=linking_data / "taxonomy.json", metrics_info=linking_data / "metrics.json")
+
+
+@pytest.fixture(scope="session")
+def evidence_finder(taxonomy):
+    from axcell.models.linking import EvidenceFinder
+    return EvidenceFinder(taxonomy, abbreviations_path=linking_data / "abbreviations.json")
+
+
+@pytest.fixture(scope="session")
+def papers():
+    return [make_paper(seed) for seed in range(12)]
@@ -0,0 +1,113 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import re
+from types import SimpleNamespace
+
+import pytest
+from axcell.models.linking import acronym_extractor
+from axcell.models.linking.acronym_extractor import AcronymExtractor
+
+abbreviation_re = re.compile(r"((?:\w+ )+)\((\w+)\)")
+
+
+class Abbreviation(str):
+    def __new__(cls, short, long):
+        abbreviation = super().__new__(cls, short)
+        abbreviation._ = SimpleNamespace(long_form=long)
+        return abbreviation
+
+
+class FakeAbbreviationsNlp:
+    """Recognizes "long (short)" if capitals of short are initials of the last words of long."""
+    def __init__(self):
+        self.texts = []
+
+    def add_pipe(self, pipe):
+        pass
+
+    def disable_pipes(self, *names):
+        pass
+
+    def pipe(self, texts, batch_size=None, n_process=None):
+        for text in texts:
+            self.texts.append(text)
+            abbreviations = []
+            for long, short in abbreviation_re.findall(text):
+                capitals = "".join(c for c in short if c.isupper())
+                long = " ".join(long.split()[-len(capitals):])
+                if "".join(word[0] for word in long.split()).upper() == capitals:
+                    abbreviations.append(Abbreviation(short, long))
+            yield SimpleNamespace(_=SimpleNamespace(abbreviations=abbreviations))
+
+
+@pytest.fixture
+def make_extractor(monkeypatch):
+    monkeypatch.setattr(acronym_extractor.spacy, "load", lambda name: FakeAbbreviationsNlp())
+    monkeypatch.setattr(acronym_extractor, "AbbreviationDetector", lambda nlp: None)
+    extractors = []
+
+    def make(cache_path=None):
+        extractor = AcronymExtractor(cache_path)
+        extractors.append(extractor)
+        return extractor
+
+    yield make
+    for extractor in extractors:
+        extractor.close()
+
+
+texts = [
+    "we report word error rate (WER) on LibriSpeech",
+    "results on the Penn Tree Bank (PTB)",
+    "no abbreviations here",
+    "we report word error rate (WER) on LibriSpeech",
+    "Stanford Question Answering Dataset (SQuAD) and Penn Tree Bank (PTB)",
+    "results on the Penn Tree Bank (PTB)",
+]
+
+expected = [
+    dict(wer="worderrorrate"),
+    dict(ptb="penntreebank"),
+    {},
+    dict(wer="worderrorrate"),
+    dict(squad="stanfordquestionansweringdataset", ptb="penntreebank"),
+    dict(ptb="penntreebank"),
+]
+
+
+def test_extract_many(make_extractor):
+    extractor = make_extractor()
+    assert extractor.extract_many(iter(texts)) == expected
+    # repeated texts are processed once, in order of their first occurrence
+    assert extractor.nlp.texts == list(dict.fromkeys(texts))
+    assert extractor.extract_many([]) == []
+    assert [extractor(text) for text in texts] == expected
+
+
+def test_extract_many_independent_results(make_extractor):
+    extractor = make_extractor()
+    results = extractor.extract_many(texts)
+    results[0]["wer"] = "changed"
+    assert results[3] == dict(wer="worderrorrate")
+
+
+def test_extract_many_cached(make_extractor, tmp_path):
+    cache_path = tmp_path / "cache" / "abbreviations"
+    extractor = make_extractor(cache_path)
+    assert extractor.extract_many(texts[:3]) == expected[:3]
+    assert extractor.nlp.texts == texts[:3]
+
+    # only texts missing in the cache are processed
+    extractor.nlp.texts.clear()
+    assert extractor.extract_many(texts) == expected
+    assert extractor.nlp.texts == [texts[4]]
+
+    extractor.nlp.texts.clear()
+    assert extractor.extract_many(reversed(texts)) == expected[::-1]
+    assert extractor.nlp.texts == []
+
+    # the cache persists across extractors
+    extractor.close()
+    extractor = make_extractor(cache_path)
+    assert extractor.extract_many(texts) == expected
+    assert extractor.nlp.texts == []
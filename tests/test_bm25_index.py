@@ -0,0 +1,82 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import json
+
+import pandas as pd
+import pytest
+from axcell.models.linking.bm25_index import TaxonomyIndex, analyze_standard, analyze_ngrams, standard_tokens
+from axcell.models.linking.bm25_naive import MatchSearch, mkquery_fullmatch
+
+
+@pytest.fixture(scope="module")
+def records(linking_data_path):
+    return json.loads((linking_data_path / "taxonomy.json").read_text())
+
+
+@pytest.fixture(scope="module")
+def index(records):
+    return TaxonomyIndex(records)
+
+
+# Responses of an Elasticsearch index with the et_taxonomy mapping (axcell/data/elastic.py) of taxonomy.json
+# entries, indexed in order with ids being their positions, to the requests of MatchSearch linking test papers
+# and to a few other queries.
+@pytest.fixture(scope="module")
+def responses(linking_data_path):
+    return json.loads((linking_data_path / "bm25_responses.json").read_text())
+
+
+def test_recorded_responses(index, responses):
+    for response in responses:
+        hits = index.search("et_taxonomy", doc_type="doc", body=response["request"])["hits"]
+        assert hits["total"] == response["total"]
+        assert [hit["_id"] for hit in hits["hits"]] == [doc_id for doc_id, _ in response["hits"]]
+        assert [hit["_score"] for hit in hits["hits"]] == pytest.approx([score for _, score in response["hits"]],
+                                                                        rel=1e-6)
+
+
+def test_msearch(index, responses):
+    requests = [response["request"] for response in responses]
+    body = [line for request in requests for line in ({}, request)]
+    actual = index.msearch(body=body, index="et_taxonomy", doc_type="doc")["responses"]
+    assert actual == [index.search(body=request) for request in requests]
+
+
+def test_source(index, records):
+    hits = index.search(body=dict(mkquery_fullmatch("ImageNet"), size=2, _source=["dataset"]))["hits"]["hits"]
+    assert [hit["_source"] for hit in hits] == [dict(dataset="ImageNet")] * 2
+    hits = index.search(body=dict(mkquery_fullmatch("ImageNet"), _source=False))["hits"]["hits"]
+    assert len(hits) == 10 and all("_source" not in hit for hit in hits)
+    hits = index.search(body=mkquery_fullmatch("SVHN"))["hits"]["hits"]
+    assert hits[0]["_source"] == records[int(hits[0]["_id"])]
+
+
+def test_explain(index):
+    body = mkquery_fullmatch("ImageNet top-1")
+    for hit in index.search(body=body)["hits"]["hits"]:
+        explanation = index.explain("et_taxonomy", doc_type="doc", id=hit["_id"], body=body)
+        assert explanation["matched"] and explanation["explanation"]["value"] == hit["_score"]
+    assert not index.explain(id="0", body=mkquery_fullmatch("nothing"))["matched"]
+
+
+def test_analyzers():
+    assert standard_tokens("SQuAD1.1 dataset:WMT14 U.S.A. 1,234.5 12:30 top-1 x² _x_ __ it's 日本") == \
+        ["SQuAD1.1", "dataset:WMT14", "U.S.A", "1,234.5", "12", "30", "top", "1", "x", "_x_", "it's", "日", "本"]
+    # stacked tokens of the word delimiter are shingled as consecutive tokens
+    assert [position[0] for position in analyze_standard("ImageNet top-1")] == \
+        ["imagenet", "image", "imagenet", "net", "top", "1"]
+    assert analyze_standard("ImageNet top-1")[3] == ["net", "net top", "net top 1"]
+    assert [position[0] for position in analyze_standard("it's AbCd-12")] == \
+        ["it's", "it", "abcd", "ab", "abcd", "cd", "12"]
+    assert analyze_ngrams("Top-1 abc") == [["to"], ["top"], ["op"], ["ab"], ["abc"], ["bc"]]
+
+
+def test_match_search_backend(taxonomy):
+    match_search = MatchSearch(es=TaxonomyIndex.from_taxonomy(taxonomy), taxonomy=taxonomy)
+    queries = ["ImageNet top-1", "CIFAR-10 top-1", "SQuAD EM", "WMT14 En-De", ""]
+    caption = "Table 1: image classification results"
+    frames = match_search.match_many(queries, None, caption)
+    assert frames[0]["dataset"].tolist() == ["ImageNet"] * 3
+    assert match_search.match_many(["SVHN"], None, None)[0]["dataset"].tolist() == ["SVHN"] * 3
+    for query, actual in zip(queries, frames):
+        pd.testing.assert_frame_equal(match_search(query, None, caption), actual, check_exact=True)
@@ -0,0 +1,75 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import json
+import shutil
+import warnings
+
+import pandas as pd
+import pytest
+from axcell.models.linking import Taxonomy, ContextSearch, DatasetExtractor, Linker
+from axcell.models.linking.bundle import LinkingBundle, compile_bundle, load_bundle
+
+
+def link_papers(context_search, evidence_finder, papers):
+    linker = Linker("linking", context_search, DatasetExtractor(evidence_finder))
+    return [linker(paper, paper.tables, topk=3) for paper in papers]
+
+
+@pytest.fixture
+def models_path(tmp_path, linking_data_path):
+    for name in ["taxonomy.json", "metrics.json", "abbreviations.json"]:
+        shutil.copy(linking_data_path / name, tmp_path / name)
+    return tmp_path
+
+
+@pytest.mark.parametrize("backend", ["numba", "sparse"])
+def test_bundle_roundtrip(models_path, taxonomy, evidence_finder, papers, backend):
+    compile_bundle(models_path)
+    bundle = LinkingBundle.load(models_path / "linking.bundle", mmap=True)
+    # probabilities are read-only views of the mapped file
+    assert not any(axis.matrix.data.flags.writeable for axis in bundle.sparse_axes)
+    assert bundle.taxonomy.taxonomy == taxonomy.taxonomy
+
+    papers = papers[:4]
+    expected = link_papers(ContextSearch(taxonomy, evidence_finder), evidence_finder, papers)
+    actual = link_papers(bundle.context_search(backend=backend), bundle.evidence_finder, papers)
+    for e, a in zip(expected, actual):
+        pd.testing.assert_frame_equal(a, e, check_exact=True)
+
+
+def test_bundle_default_backend(models_path, monkeypatch):
+    compile_bundle(models_path)
+    bundle = load_bundle(models_path)
+
+    def typed_dicts(*args):
+        raise AssertionError("typed dicts built on startup from a bundle")
+
+    monkeypatch.setattr(ContextSearch, "_numba_update_nested_dict", typed_dicts)
+    context_search = bundle.context_search()
+    assert context_search.backend == "sparse"
+    # probabilities are scored directly from the mapped arrays
+    scorer = context_search.sparse_scorer
+    assert (scorer.tasks, scorer.datasets, scorer.metrics) == bundle.sparse_axes
+    assert not hasattr(context_search, "reverse_merged_p")
+
+
+def test_outdated_bundle(models_path):
+    compile_bundle(models_path)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        bundle = load_bundle(models_path)
+    assert bundle.is_compiled_from(models_path / "taxonomy.json", models_path / "metrics.json",
+                                   models_path / "abbreviations.json")
+
+    records = json.loads((models_path / "taxonomy.json").read_text())
+    (models_path / "taxonomy.json").write_text(json.dumps(records[:-1]))
+    taxonomy = Taxonomy(taxonomy=models_path / "taxonomy.json", metrics_info=models_path / "metrics.json")
+    assert taxonomy.taxonomy != bundle.taxonomy.taxonomy
+    with pytest.warns(UserWarning, match="outdated"):
+        bundle = load_bundle(models_path)
+    assert bundle.taxonomy.taxonomy == taxonomy.taxonomy
+
+    compile_bundle(models_path)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert load_bundle(models_path).taxonomy.taxonomy == taxonomy.taxonomy
@@ -0,0 +1,76 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import os
+import subprocess
+import sys
+import warnings
+from pathlib import Path
+
+import pytest
+import pandas as pd
+from numba.core.errors import NumbaTypeSafetyWarning
+from axcell.models.linking import ContextSearch, DatasetExtractor, Linker
+
+
+def link_papers(taxonomy, evidence_finder, papers, **kwargs):
+    context_search = ContextSearch(taxonomy, evidence_finder, **kwargs)
+    linker = Linker("linking", context_search, DatasetExtractor(evidence_finder))
+    return [linker(paper, paper.tables, topk=3) for paper in papers]
+
+
+@pytest.fixture(scope="module")
+def numba_proposals(taxonomy, evidence_finder, papers):
+    return link_papers(taxonomy, evidence_finder, papers, backend="numba")
+
+
+@pytest.mark.parametrize("backend", ["sparse", "pruned"])
+def test_backends(taxonomy, evidence_finder, papers, numba_proposals, backend):
+    proposals = link_papers(taxonomy, evidence_finder, papers, backend=backend)
+    for expected, actual in zip(numba_proposals, proposals):
+        pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+
+
+@pytest.mark.parametrize("numba_mode", ["nogil", "parallel"])
+def test_numba_modes(taxonomy, evidence_finder, papers, numba_proposals, numba_mode):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", NumbaTypeSafetyWarning)
+        proposals = link_papers(taxonomy, evidence_finder, papers, numba_mode=numba_mode)
+    for expected, actual in zip(numba_proposals, proposals):
+        pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+
+
+def test_link_cells_without_debug_infos(taxonomy, evidence_finder, papers):
+    context_search = ContextSearch(taxonomy, evidence_finder)
+    paper = papers[0]
+    paper_context, abstract_context, table_contexts = DatasetExtractor(evidence_finder).contexts(paper, paper.tables)
+    table = paper.tables[0]
+    queries = ["top-1", "BLEU", "top-1"]
+    linked = context_search.link_cells(queries, paper_context, abstract_context, table_contexts[0], table.caption,
+                                       topk=3)
+    assert len(linked) == len(queries)
+    for query, records in zip(queries, linked):
+        expected = context_search(query, paper_context, abstract_context, table_contexts[0], table.caption, topk=3)
+        assert records.tolist() == expected.tolist()
+    session_linked = context_search.session(paper_context, abstract_context).link_cells(
+        queries, table_contexts[0], table.caption, topk=3)
+    assert [records.tolist() for records in session_linked] == [records.tolist() for records in linked]
+
+
+def test_fingerprint_independent_of_hash_seed():
+    # persistent caches are shared by processes with different hash seeds
+    script = """
+import sys
+sys.path.insert(0, "tests")
+from conftest import linking_data
+from axcell.models.linking import ContextSearch, EvidenceFinder, Taxonomy
+taxonomy = Taxonomy(taxonomy=linking_data / "taxonomy.json", metrics_info=linking_data / "metrics.json")
+evidence_finder = EvidenceFinder(taxonomy, abbreviations_path=linking_data / "abbreviations.json")
+print(ContextSearch(taxonomy, evidence_finder, backend="sparse").fingerprint())
+"""
+    fingerprints = []
+    for seed in ["1", "2"]:
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=120,
+                                cwd=Path(__file__).resolve().parents[1], env=dict(os.environ, PYTHONHASHSEED=seed))
+        assert result.returncode == 0, result.stderr
+        fingerprints.append(result.stdout.strip())
+    assert fingerprints[0] == fingerprints[1]
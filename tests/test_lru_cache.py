@@ -0,0 +1,178 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import gc
+import weakref
+
+import pytest
+import numpy as np
+from axcell.models.linking import lru_cache
+from axcell.models.linking.lru_cache import LRUCache, PersistentCache, sizeof
+from axcell.models.linking.parallel import fork_map
+
+
+def test_eviction_order():
+    cache = LRUCache(maxsize=3)
+    for key in "abc":
+        cache[key] = key
+    assert cache["a"] == "a"   # a becomes the most recently used
+    cache["d"] = "d"
+    assert "b" not in cache
+    assert list(cache._data) == ["c", "a", "d"]
+    cache["c"] = "C"           # overwriting also refreshes the entry
+    cache["e"] = "e"
+    assert list(cache._data) == ["d", "c", "e"]
+    assert cache.evictions == 2
+
+
+def test_maxbytes_eviction():
+    cache = LRUCache(maxbytes=10, getsizeof=len)
+    cache["a"] = "xxxx"
+    cache["b"] = "yyyy"
+    cache["c"] = "zzzz"
+    assert list(cache._data) == ["b", "c"]
+    assert cache.currbytes == 8
+    assert cache.evictions == 1
+
+
+def test_too_large_value_is_refused():
+    cache = LRUCache(maxbytes=10, getsizeof=len)
+    cache["a"] = "xxxx"
+    cache["b"] = "y" * 11
+    assert "b" not in cache
+    assert list(cache._data) == ["a"] and cache.currbytes == 4
+    # a too large value replacing an existing entry removes it
+    cache["a"] = "x" * 11
+    assert "a" not in cache and len(cache) == 0 and cache.currbytes == 0
+    assert cache.evictions == 0
+
+
+def test_bytes_accounting():
+    cache = LRUCache(maxbytes=100, getsizeof=len)
+    cache["a"] = "x" * 10
+    cache["b"] = "x" * 20
+    assert cache.currbytes == 30
+    cache["a"] = "x" * 5
+    assert cache.currbytes == 25
+    del cache["b"]
+    assert cache.currbytes == 5
+    with pytest.raises(KeyError):
+        del cache["b"]
+    assert cache.currbytes == 5
+    cache.clear()
+    assert cache.currbytes == 0 and len(cache) == 0
+
+
+def test_no_limits():
+    cache = LRUCache()
+    for i in range(1000):
+        cache[i] = np.zeros(100)
+    assert len(cache) == 1000 and cache.evictions == 0
+    # sizes are estimated only when maxbytes is set
+    assert cache.currbytes == 0
+
+
+def test_counters():
+    cache = LRUCache(maxsize=1)
+    assert cache.get("a") is None
+    assert cache.get("a", 42) == 42
+    cache["a"] = 1
+    assert cache.get("a") == 1
+    cache["b"] = 2
+    assert cache.get("a") is None
+    assert cache.info() == dict(hits=1, misses=3, evictions=1, size=1, maxsize=1, bytes=0, maxbytes=None)
+    cache.reset_stats()
+    assert cache.info()["hits"] == cache.info()["misses"] == cache.info()["evictions"] == 0
+    assert cache["b"] == 2     # indexing doesn't update counters
+    assert cache.hits == 0
+
+
+def test_sizeof():
+    array = np.zeros(100)
+    assert sizeof(array) == array.nbytes
+    assert sizeof((array, [array, array])) > 3 * array.nbytes
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    pytest.importorskip("diskcache")
+    return tmp_path / "cache"
+
+
+def test_persistent_cache_reopen(cache_path):
+    cache = PersistentCache(LRUCache(), cache_path, "ns")
+    cache["a"] = np.arange(3)
+    cache["none"] = None
+    cache.close()
+
+    cache = PersistentCache(LRUCache(), cache_path, "ns")
+    assert cache["a"].tolist() == [0, 1, 2]
+    # a cached None is a hit
+    assert cache.get("none", 42) is None
+    assert cache.get("b") is None
+    with pytest.raises(KeyError):
+        cache["b"]
+    assert cache.disk_hits == 2 and cache.disk_misses == 2
+    assert "a" in cache and "none" in cache
+    cache.close()
+
+
+def test_persistent_cache_namespaces(cache_path):
+    cache = PersistentCache(LRUCache(), cache_path, "ns")
+    cache["a"] = 1
+    cache.close()
+    other = PersistentCache(LRUCache(), cache_path, "other")
+    assert other.get("a") is None
+    other["a"] = 2
+    other.close()
+    assert PersistentCache(LRUCache(), cache_path, "ns")["a"] == 1
+
+
+def test_persistent_cache_flush_size(cache_path):
+    cache = PersistentCache(LRUCache(), cache_path, "ns", flush_size=2)
+    cache["a"] = 1
+    assert cache.info()["pending"] == 1
+    cache["b"] = 2
+    assert cache.info()["pending"] == 0
+    assert PersistentCache(LRUCache(), cache_path, "ns")["b"] == 2
+    cache.close()
+
+
+def test_persistent_cache_flushed_at_exit(cache_path):
+    cache = PersistentCache(LRUCache(), cache_path, "ns")
+    cache["a"] = 1
+    assert cache in lru_cache._open_caches
+    lru_cache._flush_open_caches()
+    assert cache.info()["pending"] == 0
+    assert PersistentCache(LRUCache(), cache_path, "ns")["a"] == 1
+    cache.close()
+    assert cache not in lru_cache._open_caches
+
+
+def test_persistent_cache_not_kept_alive(cache_path):
+    # caches waiting to be flushed at exit can be garbage collected
+    cache = PersistentCache(LRUCache(), cache_path, "ns")
+    ref = weakref.ref(cache)
+    del cache
+    gc.collect()
+    assert ref() is None
+
+
+def test_persistent_cache_fork(cache_path):
+    import diskcache
+    cache = PersistentCache(LRUCache(), cache_path, "ns")
+    cache["parent"] = 0
+
+    def write(x):
+        cache[f"child-{x}"] = x
+        pending = cache.info()["pending"]
+        cache.flush()
+        return pending
+
+    # children don't write entries pending in the parent
+    assert fork_map(write, [1, 2], jobs=2) == [1, 1]
+    with diskcache.Cache(str(cache_path)) as store:
+        assert cache._disk_key("parent") not in store
+        assert store[cache._disk_key("child-1")] == 1 and store[cache._disk_key("child-2")] == 2
+    assert cache.info()["pending"] == 1
+    cache.close()
+    assert PersistentCache(LRUCache(), cache_path, "ns")["parent"] == 0
@@ -0,0 +1,170 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import json
+import re
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from axcell.models.linking import DatasetExtractor, Linker
+from axcell.models.linking import bm25_naive
+from axcell.models.linking.bm25_naive import MatchSearch, split_re
+
+token_re = re.compile(r"[a-z0-9]+")
+
+
+class FakeElasticsearch:
+    """Scores taxonomy entries by the number of query tokens in their (boosted) fields."""
+    fields = dict(dataset=3, metric=1, task=1)
+
+    def __init__(self, records):
+        self.records = records
+        self.requests = []
+
+    def _hits(self, body):
+        tokens = token_re.findall(body["query"]["multi_match"]["query"].lower())
+        hits = []
+        for i, record in enumerate(self.records):
+            score = sum(boost * sum(token in token_re.findall(record[field].lower()) for token in tokens)
+                        for field, boost in self.fields.items()) * 0.75
+            if score > 0:
+                source = body.get("_source", True)
+                hits.append(dict(_id=str(i), _score=score,
+                                 **({"_source": dict(record)} if source is not False else {})))
+        hits.sort(key=lambda hit: -hit["_score"])
+        return dict(hits=hits[:body.get("size", 10)])
+
+    def search(self, index, doc_type, body):
+        self.requests.append([body])
+        return dict(hits=self._hits(body))
+
+    def msearch(self, body, index, doc_type):
+        self.requests.append(body[1::2])
+        return dict(responses=[dict(hits=self._hits(query)) for query in body[1::2]])
+
+
+class Abbreviation(str):
+    def __new__(cls, short, long):
+        abbreviation = super().__new__(cls, short)
+        abbreviation._ = SimpleNamespace(long_form=long)
+        return abbreviation
+
+
+class FakeAbbreviationsNlp:
+    """Recognizes "long (short)" if short are initials of the words of long."""
+    def __init__(self):
+        self.calls = 0
+
+    def pipe(self, texts, batch_size=None):
+        self.calls += 1
+        for text in texts:
+            long, short = re.fullmatch(r"! (.*) \((.*)\)", text).groups()
+            initials = "".join(word[0] for word in token_re.findall(long.lower()))
+            abbreviations = [Abbreviation(short, long)] if initials == short.lower() else []
+            yield SimpleNamespace(_=SimpleNamespace(abbreviations=abbreviations))
+
+
+def old_match(match_search, query, datasets, caption):
+    """Links a single cell the way MatchSearch did before batching."""
+    query = match_search.preproc(query, datasets).strip()
+    if caption:
+        query += " " + match_search.preproc(caption).strip()[:400]
+    hits = match_search.search(query)["hits"][:3]
+    df = pd.DataFrame.from_records([
+        dict(**hit["_source"], confidence=hit["_score"] / len(split_re.split(query)), evidence=query)
+        for hit in hits
+    ], columns=["dataset", "metric", "task", "confidence", "evidence"])
+    if len(df):
+        scores = []
+        for dataset in df["dataset"]:
+            r = match_search.search(dataset)
+            scores.append(dict(ok_score=r['hits'][0]['_score'] / len(split_re.split(dataset)),
+                               bad_score=r['hits'][1]['_score'] / len(split_re.split(dataset))))
+        scores = pd.DataFrame.from_records(scores)
+        df['confidence'] = ((scores['ok_score'] - scores['bad_score']) / scores['bad_score']) * df['confidence'] / scores['ok_score']
+    return df[["dataset", "metric", "task", "confidence", "evidence"]]
+
+
+class PerCellLinker:
+    def __init__(self, match_search):
+        self.match_search = match_search
+        self.taxonomy = match_search.taxonomy
+
+    def __call__(self, query, paper_context, abstract_context, table_context, caption, topk=1, debug_info=None):
+        df = old_match(self.match_search, query, None, caption)
+        return df.head(topk).assign(true_metric=df["metric"])
+
+
+@pytest.fixture
+def records(linking_data_path):
+    return json.loads((linking_data_path / "taxonomy.json").read_text())
+
+
+@pytest.fixture
+def match_search(records, taxonomy, monkeypatch):
+    monkeypatch.setattr(bm25_naive, "abbreviations_cache", bm25_naive.LRUCache())
+    match_search = MatchSearch(es=FakeElasticsearch(records), taxonomy=taxonomy)
+    match_search._nlp = FakeAbbreviationsNlp()
+    return match_search
+
+
+queries = ["ImageNet", "CIFAR-10 top-1", "SQuAD EM", "F1", "ImageNet", "dataset: WMT14 En-De", "",
+           "test-clean WER", "unknown"]
+
+
+@pytest.mark.parametrize("datasets", [None, ["Stanford Question Answering Dataset", "ImageNet"]])
+def test_match_many(match_search, datasets):
+    caption = "Table 1: results of machine translation and question answering"
+    frames = match_search.match_many(queries, datasets, caption)
+    assert len(frames) == len(queries)
+    # one request for all queries and one for normalization scores
+    assert len(match_search.es.requests) == 2
+    assert len(match_search.es.requests[0]) == len(set(queries))
+    # abbreviations of all queries are resolved in a single batch
+    assert match_search._nlp.calls == (1 if datasets else 0)
+    for query, actual in zip(queries, frames):
+        pd.testing.assert_frame_equal(actual, old_match(match_search, query, datasets, caption), check_exact=True)
+        pd.testing.assert_frame_equal(match_search(query, datasets, caption), actual, check_exact=True)
+
+    # normalization scores are memoized
+    match_search.es.requests.clear()
+    match_search.match_many(queries, datasets, caption)
+    assert len(match_search.es.requests) == 1
+
+
+def test_abbreviations(match_search):
+    assert match_search.preproc("SQuAD", ["Stanford Question Answering Dataset", "ImageNet"]) == "SQuAD"
+    assert match_search.preproc("SQAD", ["Stanford Question Answering Dataset", "ImageNet"]) == \
+        "SQAD Stanford Question Answering Dataset"
+
+
+def test_normalization_scores(records, match_search):
+    # "Cityscapes" matches only a single entry and "nothing" none
+    match_search.es = FakeElasticsearch([record for record in records if record["dataset"] != "Cityscapes"] +
+                                        [dict(task="Semantic Segmentation", dataset="Cityscapes", metric="Mean IoU")])
+    ok_score, bad_score = match_search.normalization_scores(["Cityscapes"])[0]
+    assert ok_score == 0.75 * 3 and pd.isna(bad_score)
+    assert pd.isna(list(match_search.normalization_scores(["nothing"])[0])).all()
+
+    df = match_search("Cityscapes", None, None)
+    # confidence of datasets without the second best hit is not normalized
+    assert df["confidence"].tolist() == [0.75 * 3]
+
+
+def test_linked_proposals(match_search, evidence_finder, papers):
+    dataset_extractor = DatasetExtractor(evidence_finder)
+    batched = Linker("match", match_search, dataset_extractor)
+    per_cell = Linker("match", PerCellLinker(match_search), dataset_extractor)
+    for paper in papers[:4]:
+        match_search.es.requests.clear()
+        expected = per_cell(paper, paper.tables, topk=2)
+        assert len(match_search.es.requests) > 2 * len(paper.tables)
+
+        match_search.es.requests.clear()
+        match_search.norm_scores.clear()
+        proposals = batched(paper, paper.tables, topk=2)
+        # at most one request for cells and one for normalization scores per table
+        assert len(match_search.es.requests) <= 2 * len(paper.tables)
+        # abbreviations are not expanded, as when linking single cells without datasets
+        assert match_search._nlp.calls == 0
+        pd.testing.assert_frame_equal(proposals, expected, check_exact=True)
@@ -1,8 +1,11 @@
 #  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
 
 import pytest
+import re
+import numpy as np
 from decimal import Decimal
-from axcell.models.linking.bm25_naive import convert_metric
+from axcell.models.linking import bm25_naive
+from axcell.models.linking.bm25_naive import convert_metric, TableValues, numeric_cells_mask
 
 raw_values = ["0.21", "0.21%", "21", "21%"]
 ranges = ["0-1", "1-100", "abs", ""]
@@ -35,3 +38,51 @@ def test_ranges(raw_value, rng, complementary, expected):
     assert value == expected, (f"{'complement of ' if complementary else ''}"
         f"raw value {raw_value}, assuming {rng if rng else 'empty'} range "
         f"should be extracted as {expected}, not {value}")
+
+
+# values parsed once per table, including values that can't be parsed
+table_raw_values = raw_values + ["12.5 ± 0.3", "± 0.3", "95.1%", " 7 ", "1e-3", "-0.5", "1,234.5", "(3.2)",
+                                 "-", "", "n/a", "abc", "12.5", "0.21"]
+
+
+@pytest.mark.parametrize("rng", ranges)
+@pytest.mark.parametrize("complementary", [False, True])
+def test_table_values(rng, complementary):
+    values = TableValues(table_raw_values)
+    expected = np.array([float(convert_metric(value, rng, complementary)) for value in table_raw_values])
+    np.testing.assert_array_equal(values.converted(rng, complementary), expected)
+    np.testing.assert_array_equal(values.valid, ~np.isnan(expected))
+    np.testing.assert_array_equal(values.percent, ['%' in value for value in table_raw_values])
+
+
+def test_table_values_parsed_once(monkeypatch):
+    original = bm25_naive.extract_value
+    parsed = []
+
+    def extract_value(value, format):
+        parsed.append(value)
+        return original(value, format)
+
+    monkeypatch.setattr(bm25_naive, "extract_value", extract_value)
+    values = TableValues(table_raw_values * 3)
+    # each distinct raw value is parsed once
+    assert sorted(parsed) == sorted(set(table_raw_values))
+    assert [str(value) for value in values.values] == \
+        [str(original(value, "{x}%" if "%" in value else "{x}")) for value in table_raw_values * 3]
+    assert len(TableValues([]).converted("", False)) == 0
+
+
+@pytest.mark.parametrize("raw_value,rng,complementary,expected", cases)
+def test_table_values_ranges(raw_value, rng, complementary, expected):
+    assert TableValues([raw_value]).converted(rng, complementary)[0] == float(expected)
+
+
+def test_numeric_cells_mask():
+    number_re = re.compile(r'(^[± Ee/()^0-9.%,_+-]{2,}$)|(^\s*[0-9]\s*$)')
+    matrix = np.array([table_raw_values, table_raw_values[::-1]])
+    structure = np.full(matrix.shape, '', dtype=object)
+    structure[0, :4] = 'model-best'
+    expected = [[structure[r, c] == '' and number_re.match(matrix[r, c].strip()) is not None
+                 for c in range(matrix.shape[1])] for r in range(matrix.shape[0])]
+    np.testing.assert_array_equal(numeric_cells_mask(matrix, structure), expected)
+    assert numeric_cells_mask(np.empty((0, 3), dtype=str), np.empty((0, 3), dtype=object)).shape == (0, 3)
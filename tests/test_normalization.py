@@ -0,0 +1,72 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import pytest
+from unidecode import unidecode
+from axcell.models.linking import utils
+from axcell.models.linking.utils import remove_references, year_2k_re, hyphens_re, ws_re
+
+
+# implementations preceding the ASCII fast paths and memoization
+def old_normalize_dataset_ws(name):
+    name = remove_references(name)
+    name = hyphens_re.sub(" ", name)
+    name = year_2k_re.sub(r"\1", name)
+    name = ws_re.sub(" ", name)
+    return unidecode(name.strip().lower())
+
+
+def old_normalize_dataset(name):
+    name = remove_references(name)
+    name = year_2k_re.sub(r"\1", name)
+    name = hyphens_re.sub("", name)
+    name = ws_re.sub(" ", name)
+    return unidecode(name.strip().lower())
+
+
+def old_normalize_cell(s):
+    return unidecode("".join([x for x in s if x.isalnum()]))
+
+
+def old_normalize_cell_ws(s):
+    return unidecode("".join([x for x in s if x.isalnum() or x.isspace()]))
+
+
+functions = ["normalize_dataset_ws", "normalize_dataset", "normalize_cell", "normalize_cell_ws"]
+
+inputs = [
+    # ASCII
+    "", "ImageNet", "CIFAR-10", "SQuAD1.1 EM", "WMT2014 English-German", "WMT'14 En-De", "top-1 error (%)",
+    "2017", "20200", "x20x", "Table_2", "`quoted'", "a-b_c'd`e", "xxref-Table1 results", "see xxanchor-tab:res.",
+    "xxtable-xxanchor-1 Results", "xx", "ROUGE-L / F1", "#params", "-", "--", "a - - b", "—",
+    # accented and other Unicode
+    "Müller", "Café Crème", "naïve Bayes", "Ångström", "ﬁne-tuning", "Straße", "İstanbul", "ΑΒΓ δε",
+    "東京 2020", "µ-law", "½ precision", "²³", "Ⅻ", "٣٤", "x́y", "è ", "🙂 emoji",
+    # dashes and arrows
+    "English\u2013German", "English\u2014German", "En\u2192De", "don\u2019t", "a\u2010b", "a\u2212b", "a_\u2013_b",
+    # whitespace
+    "  padded  ", "tab\tseparated", "new\nline", "nbsp\xa0here", "thin\u2009space", "ideographic\u3000space",
+    "\u2028line sep", "\x1c\x1d\x1e\x1f", " \t\n\r\x0b\x0c ", "mixed \xa0\t\u2003 ws",
+]
+
+
+@pytest.mark.parametrize("name", functions)
+def test_normalization(name):
+    old = globals()[f"old_{name}"]
+    new = getattr(utils, name)
+    for s in inputs:
+        assert new(s) == old(s), s
+        # long strings are not memoized
+        long = " ".join([s] * 20) + " " + "x" * 64
+        assert new(long) == old(long), long
+
+
+@pytest.mark.parametrize("name", functions)
+def test_normalization_code_points(name):
+    old = globals()[f"old_{name}"]
+    new = getattr(utils, name)
+    code_points = [chr(c) for c in range(0x30000) if not 0xd800 <= c < 0xe000]
+    for c in code_points:
+        assert new(c) == old(c), c
+    for start in range(0, len(code_points), 500):
+        s = "a" + "a".join(code_points[start:start + 500])
+        assert new(s) == old(s), (start, s)
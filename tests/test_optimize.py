@@ -0,0 +1,198 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+from dataclasses import replace
+
+import pytest
+import numpy as np
+import pandas as pd
+
+# plotting helpers need matplotlib, confusion matrices of the reference sweep need the full (fastai) environment
+pytest.importorskip("matplotlib")
+
+from axcell.helpers.optimize import find_threshold_intervals, sweep_thresholds
+
+
+def update_cm(proposal, cm, is_activated):
+    d = 1 if is_activated else -1
+    if proposal.equal and proposal.pred_positive and proposal.gold_positive:
+        cm = replace(cm, tp=cm.tp + d, fn=cm.fn - d)
+    if proposal.equal and not proposal.pred_positive and not proposal.gold_positive:
+        cm = replace(cm, tn=cm.tn + d)
+    if proposal.pred_positive and (not proposal.equal or not proposal.gold_positive):
+        cm = replace(cm, fp=cm.fp + d)
+    return cm
+
+
+def reference_sweep_thresholds(df):
+    CM = pytest.importorskip("axcell.models.linking.metrics").CM
+    cm = CM(fn=sum(df.gold_positive))
+    df = df[df.min_threshold < df.max_threshold]
+
+    sweeps = df.reset_index().melt(id_vars="cell_ext_id", value_vars=["min_threshold", "max_threshold"],
+                                   var_name="threshold_type", value_name="threshold")
+
+    sweeps = sweeps.sort_values(by=["threshold", "threshold_type"]).reset_index(drop=True)
+
+    steps = sweeps.threshold.drop_duplicates().index
+
+    results = []
+    for i, idx1 in enumerate(steps[:-1]):
+        th1 = sweeps.threshold[idx1]
+
+        to_restore = cm
+        for j, idx2 in enumerate(steps[i + 1:], i + 1):
+            th2 = sweeps.threshold[idx2]
+            precision = cm.tp / (cm.tp + cm.fp + 1e-8)
+            recall = cm.tp / (cm.tp + cm.fn + 1e-8)
+            f1 = 2 * precision * recall / (precision + recall + 1e-8)
+
+            result = dict(threshold1=th1, threshold2=sweeps.threshold[idx2 - 1], tp=cm.tp, tn=cm.tn, fp=cm.fp, fn=cm.fn,
+                          precision=precision, recall=recall, f1=f1)
+            results.append(result)
+            for _, row in sweeps[sweeps.threshold == sweeps.threshold[idx2 - 1]].iterrows():
+                proposal = df.loc[row.cell_ext_id]
+                is_activated = row.threshold_type == 'min_threshold'
+                if not is_activated and proposal.min_threshold < th1:
+                    cm = update_cm(proposal, cm, is_activated)
+
+        precision = cm.tp / (cm.tp + cm.fp + 1e-8)
+        recall = cm.tp / (cm.tp + cm.fn + 1e-8)
+        f1 = 2 * precision * recall / (precision + recall + 1e-8)
+
+        result = dict(threshold1=th1, threshold2=th2, tp=cm.tp, tn=cm.tn, fp=cm.fp, fn=cm.fn,
+                      precision=precision, recall=recall, f1=f1)
+        results.append(result)
+
+        cm = to_restore
+
+        for _, row in sweeps[sweeps.threshold == th1].iterrows():
+            proposal = df.loc[row.cell_ext_id]
+
+            is_activated = row.threshold_type == 'min_threshold'
+            cm = update_cm(proposal, cm, is_activated)
+
+    return df, sweeps, steps, pd.DataFrame(results)
+
+
+def random_proposals(size, seed):
+    rng = np.random.RandomState(seed)
+    # few distinct thresholds to get ties between activations and deactivations
+    thresholds = np.round(rng.uniform(0, 1, size=8), 3)
+    df = pd.DataFrame(dict(
+        cell_ext_id=[f"paper/table_{i // 10:02}.csv/{i % 10}.0" for i in range(size)],
+        min_threshold=rng.choice(thresholds, size=size),
+        max_threshold=rng.choice(np.append(thresholds, 1.0), size=size),
+        equal=rng.rand(size) < 0.6,
+        pred_positive=rng.rand(size) < 0.7,
+        gold_positive=rng.rand(size) < 0.5,
+    ))
+    return df.set_index("cell_ext_id")
+
+
+@pytest.mark.parametrize("size,seed", [(0, 0), (1, 0), (2, 1), (5, 2), (20, 3), (40, 4), (60, 5)])
+def test_sweep_thresholds(size, seed):
+    df = random_proposals(size, seed)
+    expected = reference_sweep_thresholds(df)
+    actual = sweep_thresholds(df)
+    pd.testing.assert_frame_equal(actual[0], expected[0])
+    pd.testing.assert_frame_equal(actual[1], expected[1])
+    pd.testing.assert_index_equal(actual[2], expected[2])
+    pd.testing.assert_frame_equal(actual[3], expected[3])
+
+
+def reference_find_threshold_intervals(proposals, metrics_info, context="paper"):
+    proposals["max_threshold"] = proposals.confidence
+    proposals["min_threshold"] = 0.0
+    ignore = (proposals.model_type_pred != 'model-best') | (proposals.struct_model_type == '') | \
+             (proposals.struct_dataset.str.contains('dev')) | (proposals.struct_dataset.str.contains('train'))
+    proposals.loc[ignore, "min_threshold"] = 1.0
+    proposals.loc[ignore, "max_threshold"] = 0.0
+
+    all_proposals = proposals
+    proposals = proposals[~ignore]
+
+    if context == "paper":
+        context_column = proposals.index.to_series().str.split('/', expand=False).apply(lambda x: x[0])
+    else:
+        context_column = proposals.index.to_series().str.split('/', expand=False).apply(lambda x: x[0] + "/" + x[1])
+
+    for i, p in proposals.iterrows():
+        # proposals without value are never superseded
+        if pd.isna(p.parsed_pred):
+            continue
+        key = (p.task_pred, p.dataset_pred, p.metric_pred)
+        proposals_context = proposals[context_column == context_column[p.name]]
+        proposals_context = proposals_context[~proposals_context.parsed_pred.isna()]
+        proposals_context = proposals_context[
+            (proposals_context.task_pred == p.task_pred) &
+            (proposals_context.dataset_pred == p.dataset_pred) &
+            (proposals_context.metric_pred == p.metric_pred)
+            ]
+        d = 0
+        if key in metrics_info:
+            d = metrics_info[key]
+        elif p.metric_pred in metrics_info:
+            d = metrics_info[p.metric_pred]
+        elif 'error' in p.metric_pred.lower():
+            d = -1
+        elif 'accuracy' in p.metric_pred.lower():
+            d = 1
+        d = 1 if d >= 0 else -1
+
+        which = d * proposals_context.parsed_pred > d * p.parsed_pred
+        if np.any(which.values):
+            all_proposals.at[i, "min_threshold"] = proposals_context[which].confidence.values.max()
+        else:
+            which = proposals_context[proposals_context.parsed_pred == p.parsed_pred].iloc[0]
+            if which.name != p.name:
+                all_proposals.at[i, "min_threshold"] = which.confidence
+
+    return all_proposals
+
+
+# both directions given by metrics info (per triple or per metric) or guessed from metric names
+metrics_info = {("QA", "SQuAD", "F1"): 1, ("QA", "SQuAD", "EM"): -1, "Perplexity": -1, "BLEU": 1}
+
+
+def random_linked_proposals(size, seed):
+    rng = np.random.RandomState(seed)
+    keys = [("QA", "SQuAD", "F1"), ("QA", "SQuAD", "EM"), ("QA", "TriviaQA", "EM"), ("LM", "PTB", "Perplexity"),
+            ("MT", "WMT", "BLEU"), ("IC", "ImageNet", "Top-1 Error"), ("IC", "ImageNet", "Top-1 Accuracy"),
+            ("IC", "CIFAR-10", "Params")]
+    cells = rng.choice(60, size=size, replace=False)
+    key = rng.randint(len(keys), size=size)
+    # object index also for no proposals
+    cell_ext_id = pd.Index([f"paper{cell // 20}/table_{cell // 5 % 4:02}.csv/{cell % 5}.1" for cell in cells],
+                           dtype=object, name="cell_ext_id")
+    df = pd.DataFrame(dict(
+        model_type_pred=rng.choice(["model-best", "model-best", "model-best", "model-paper"], size=size),
+        struct_model_type=rng.choice(["model-best", "model-best", "model-competing", ""], size=size),
+        struct_dataset=rng.choice(["", "test", "dev set", "train"], size=size, p=[0.5, 0.3, 0.1, 0.1]),
+        task_pred=[keys[k][0] for k in key],
+        dataset_pred=[keys[k][1] for k in key],
+        metric_pred=[keys[k][2] for k in key],
+        # few distinct values and confidences to get ties
+        parsed_pred=rng.choice([np.nan, 1.0, 2.0, 2.5, 10.0], size=size),
+        confidence=rng.choice([0.1, 0.25, 0.5, 0.75, 0.9], size=size),
+    ), index=cell_ext_id)
+    return df
+
+
+@pytest.mark.parametrize("context", ["paper", "table"])
+@pytest.mark.parametrize("size,seed", [(0, 0), (1, 0), (2, 1), (5, 2), (20, 3), (40, 4), (60, 5), (60, 6)])
+def test_find_threshold_intervals(size, seed, context):
+    df = random_linked_proposals(size, seed)
+    expected = reference_find_threshold_intervals(df.copy(), metrics_info, context=context)
+    actual = find_threshold_intervals(df.copy(), metrics_info, context=context)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_find_threshold_intervals_ignored_groups():
+    # all proposals of the group are filtered out or have no value
+    df = random_linked_proposals(20, 7).assign(struct_model_type="")
+    actual = find_threshold_intervals(df.copy(), metrics_info)
+    assert (actual.min_threshold == 1.0).all() and (actual.max_threshold == 0.0).all()
+    df = random_linked_proposals(20, 7).assign(parsed_pred=np.nan, model_type_pred="model-best",
+                                               struct_model_type="model-best", struct_dataset="")
+    actual = find_threshold_intervals(df.copy(), metrics_info)
+    assert (actual.min_threshold == 0.0).all() and actual.max_threshold.equals(df.confidence)
@@ -0,0 +1,124 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from axcell.models.linking import ContextSearch, DatasetExtractor, Linker
+from axcell.models.linking.parallel import fork_map
+
+
+def test_fork_map_order():
+    offset = 100
+
+    def slow_square(x):
+        # earlier items finish later
+        time.sleep((10 - x) * 0.01)
+        return x * x + offset
+
+    assert fork_map(slow_square, range(10), jobs=4) == [x * x + offset for x in range(10)]
+    assert fork_map(slow_square, range(10), jobs=1) == [x * x + offset for x in range(10)]
+    assert fork_map(slow_square, [], jobs=4) == []
+
+
+def test_fork_map_exception():
+    def fail(x):
+        if x == 3:
+            raise ValueError(f"failed on {x}")
+        return x
+
+    with pytest.raises(ValueError, match="failed on 3"):
+        fork_map(fail, range(6), jobs=3)
+    # the pool is cleaned up after the failure
+    assert fork_map(lambda x: -x, range(6), jobs=3) == [-x for x in range(6)]
+
+
+def test_fork_map_nested():
+    with pytest.raises(RuntimeError):
+        fork_map(lambda x: fork_map(abs, [x, -x], jobs=2), range(2), jobs=2)
+
+
+@pytest.mark.parametrize("layer", [None, "tbb", "omp", "workqueue"])
+def test_fork_map_after_numba_parallel(layer):
+    # forking after numba parallel kernels started TBB or OpenMP threads used to hang
+    script = """
+import os
+import warnings
+import numpy as np
+from numba import njit, prange, threading_layer
+from axcell.models.linking.parallel import fork_map
+
+@njit(parallel=True)
+def total(a):
+    s = 0.0
+    for i in prange(len(a)):
+        s += a[i]
+    return s
+
+total(np.ones(10))
+with warnings.catch_warnings(record=True) as caught:
+    warnings.simplefilter("always")
+    results = fork_map(lambda n: (total(np.ones(n)), os.getpid()), range(4), jobs=2)
+print([value for value, pid in results])
+print(threading_layer(), any("not fork-safe" in str(w.message) for w in caught),
+      os.getpid() in [pid for value, pid in results])
+"""
+    env = {name: value for name, value in os.environ.items() if name != "NUMBA_THREADING_LAYER"}
+    if layer is not None:
+        env["NUMBA_THREADING_LAYER"] = layer
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=120,
+                            cwd=Path(__file__).resolve().parents[1], env=env)
+    assert result.returncode == 0, result.stderr
+    values, state = result.stdout.strip().split("\n")
+    assert values == "[0.0, 1.0, 2.0, 3.0]"
+    used_layer, warned, in_process = state.split()
+    forked = used_layer == "workqueue"
+    # only the workqueue layer is forked, other layers compute in the current process with a warning
+    assert warned == in_process == str(not forked)
+
+
+@pytest.fixture(scope="module")
+def linker(taxonomy, evidence_finder):
+    return Linker("linking", ContextSearch(taxonomy, evidence_finder), DatasetExtractor(evidence_finder))
+
+
+def test_link_many(linker, papers):
+    papers = papers[:5]
+    expected = pd.concat([linker(paper, paper.tables) for paper in papers])
+    proposals = linker.link_many(papers, jobs=3)
+    pd.testing.assert_frame_equal(proposals, expected)
+    pd.testing.assert_frame_equal(linker.link_many(papers[::-1], jobs=3),
+                                  pd.concat([linker(paper, paper.tables) for paper in papers[::-1]]))
+
+
+def test_link_many_exception(linker, papers):
+    broken = SimpleNamespace(paper_id="broken", tables=papers[0].tables)
+    with pytest.raises(AttributeError):
+        linker.link_many([papers[0], broken, papers[1]], jobs=2)
+
+
+def test_link_many_persistent_cache(taxonomy, evidence_finder, papers, tmp_path):
+    pytest.importorskip("diskcache")
+    papers = papers[:4]
+    context_search = ContextSearch(taxonomy, evidence_finder, cache_path=tmp_path)
+    linker = Linker("linking", context_search, DatasetExtractor(evidence_finder))
+    flushes = []
+    flush = context_search.flush
+    context_search.flush = lambda: flushes.append(1) or flush()
+    expected = linker.link_many(papers, jobs=1)
+    assert len(flushes) == 1
+
+    # workers write their entries once, before they exit
+    context_search = ContextSearch(taxonomy, evidence_finder, cache_path=tmp_path / "forked")
+    Linker("linking", context_search, DatasetExtractor(evidence_finder)).link_many(papers, jobs=2)
+    context_search = ContextSearch(taxonomy, evidence_finder, cache_path=tmp_path / "forked")
+    linker = Linker("linking", context_search, DatasetExtractor(evidence_finder))
+    pd.testing.assert_frame_equal(linker.link_many(papers, jobs=1), expected)
+    info = context_search.cache_info()
+    # all queries are read from the disk
+    assert info["queries"]["disk_hits"] > 0 and info["queries"]["disk_misses"] == 0
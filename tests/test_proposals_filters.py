@@ -0,0 +1,192 @@
+#  Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+
+import numpy as np
+import pandas as pd
+import pytest
+from axcell.models.linking import (ContextSearch, DatasetExtractor, Linker, BestResultFilter, CompoundFilter,
+                                   ConfidenceFilter, StructurePredictionFilter, NopFilter, FilterOutReason)
+
+
+# Loop implementations of filters preceding the vectorized ones. They align rejected proposals
+# by positions instead of labels, so that they work on proposals with many rows per cell.
+class OldFilter:
+    def __rshift__(self, other):
+        return OldCompoundFilter([self, other])
+
+
+class OldCompoundFilter(OldFilter):
+    def __init__(self, filters):
+        self.filters = filters
+
+    def __rshift__(self, other):
+        return OldCompoundFilter(self.filters + [other])
+
+    def filter(self, proposals):
+        index = proposals.index
+        agg_which = np.ones(len(proposals), dtype=bool)
+        agg_reason = np.full(len(proposals), "", dtype=object)
+        for f in self.filters:
+            which, reason = f.filter(proposals)
+            rejected = np.flatnonzero(agg_which)[~which.values]
+            agg_reason[rejected] = reason.values
+            agg_which[rejected] = False
+            proposals = proposals[which.values]
+        return pd.Series(agg_which, index=index), pd.Series(agg_reason[~agg_which], index=index[~agg_which])
+
+
+class OldStructurePredictionFilter(OldFilter):
+    def filter(self, proposals):
+        which = (proposals.struct_model_type != '') \
+                & ~proposals.struct_dataset.str.contains('dev') \
+                & ~proposals.struct_dataset.str.contains('train')
+        reason = pd.Series(data="", index=proposals.index)
+        reason[proposals.struct_dataset.str.contains('train').values] = "train-dataset"
+        reason[proposals.struct_dataset.str.contains('dev').values] = "dev-dataset"
+        reason[(proposals.struct_model_type == '').values] = "empty-model-type"
+        return which, reason[~which.values]
+
+
+class OldConfidenceFilter(OldFilter):
+    def __init__(self, confidence=-1):
+        self.confidence = confidence
+
+    def filter(self, proposals):
+        which = proposals.confidence >= self.confidence
+        reason = "confidence " + proposals[~which].confidence.round(2).astype(str) + f" < {self.confidence}"
+        return which, reason
+
+
+class OldBestResultFilter(OldFilter):
+    def __init__(self, taxonomy, context="paper"):
+        self.metrics_info = taxonomy.metrics_info
+        self.context = context
+
+    def filter(self, proposals):
+        reason = pd.Series(data="", index=proposals.index)
+        indices = []
+        parts = 1 if self.context == "paper" else 2
+        context_column = np.array(["/".join(cell.split('/')[:parts]) for cell in proposals.index], dtype=object)
+        candidates = ((proposals.model_type == 'model-best') & ~proposals.parsed.isna()).values
+        for key_all, group in proposals[candidates].groupby(by=[proposals.dataset.values[candidates],
+                                                                 proposals.metric.values[candidates],
+                                                                 proposals.task.values[candidates],
+                                                                 context_column[candidates]]):
+            dataset, metric, task, paper = key_all
+            key = (task, dataset, metric)
+            d = 0
+            if key in self.metrics_info:
+                d = self.metrics_info[key]
+            elif metric in self.metrics_info:
+                d = self.metrics_info[metric]
+            elif 'error' in metric.lower():
+                d = -1
+            elif 'accuracy' in metric.lower():
+                d = 1
+            if d >= 0:
+                index = group.parsed.idxmax()
+            else:
+                index = group.parsed.idxmin()
+            indices.append(index)
+            reason[reason.index.isin(group.index[group.index != index])] = "replaced by " + str(index)
+        reason[(proposals.struct_model_type == 'model-competing').values] = "model-competing"
+        which = proposals.index.to_series().isin(indices)
+        return which, reason[~which.values]
+
+
+def assert_filtered_equal(proposals_filter, old_filter, proposals):
+    which, reason = proposals_filter.filter(proposals)
+    assert isinstance(which, pd.Series) and isinstance(reason, pd.Series)
+    old_which, old_reason = old_filter.filter(proposals)
+    assert which.values.dtype == bool
+    np.testing.assert_array_equal(which.values, old_which.values)
+    assert which.index.equals(proposals.index)
+    assert reason.index.equals(old_reason.index)
+    assert reason.tolist() == old_reason.tolist()
+
+
+@pytest.fixture(scope="module")
+def proposals(taxonomy, evidence_finder, papers):
+    """Linked proposals, cells of the first papers have a single row and cells of the others many rows."""
+    linker = Linker("linking", ContextSearch(taxonomy, evidence_finder), DatasetExtractor(evidence_finder))
+    proposals = pd.concat([linker(paper, paper.tables, topk=1 if i < 3 else 3) for i, paper in enumerate(papers[:6])])
+    assert not proposals.index.is_unique
+    return proposals
+
+
+@pytest.fixture(scope="module")
+def unique_proposals(proposals):
+    return proposals[~proposals.index.duplicated(keep=False)]
+
+
+def chains(taxonomy):
+    return {
+        "structure": (StructurePredictionFilter(), OldStructurePredictionFilter()),
+        "confidence": (ConfidenceFilter(0.5), OldConfidenceFilter(0.5)),
+        "best-paper": (BestResultFilter(taxonomy), OldBestResultFilter(taxonomy)),
+        "best-table": (BestResultFilter(taxonomy, context="table"), OldBestResultFilter(taxonomy, context="table")),
+        # mask filters removing rows before and after BestResultFilter, as in ResultsExtractor
+        "extractor": (
+            StructurePredictionFilter() >> ConfidenceFilter(0.5) >> BestResultFilter(taxonomy) >> ConfidenceFilter(0.6),
+            OldStructurePredictionFilter() >> OldConfidenceFilter(0.5) >> OldBestResultFilter(taxonomy) >>
+            OldConfidenceFilter(0.6)),
+        "best-first": (
+            BestResultFilter(taxonomy, context="table") >> StructurePredictionFilter() >> ConfidenceFilter(0.7),
+            OldBestResultFilter(taxonomy, context="table") >> OldStructurePredictionFilter() >> OldConfidenceFilter(0.7)),
+        "nested": (
+            CompoundFilter([ConfidenceFilter(0.3), CompoundFilter([BestResultFilter(taxonomy), ConfidenceFilter(0.7)])]),
+            OldCompoundFilter([OldConfidenceFilter(0.3),
+                               OldCompoundFilter([OldBestResultFilter(taxonomy), OldConfidenceFilter(0.7)])])),
+    }
+
+
+@pytest.mark.parametrize("chain", ["structure", "confidence", "best-paper", "best-table", "extractor", "best-first",
+                                   "nested"])
+def test_filters(taxonomy, proposals, unique_proposals, chain):
+    proposals_filter, old_filter = chains(taxonomy)[chain]
+    for df in [unique_proposals, proposals, proposals.iloc[::-1], proposals.iloc[:0]]:
+        assert_filtered_equal(proposals_filter, old_filter, df)
+        which, _ = old_filter.filter(df)
+        pd.testing.assert_frame_equal(proposals_filter(df), df[which.values])
+
+
+def test_old_filters(taxonomy, unique_proposals):
+    # on unique cell ids, positional reference filters agree with label-aligned filtering
+    which, reason = OldCompoundFilter([OldStructurePredictionFilter(), OldConfidenceFilter(0.5)]).filter(unique_proposals)
+    struct_which, struct_reason = OldStructurePredictionFilter().filter(unique_proposals)
+    conf_which, conf_reason = OldConfidenceFilter(0.5).filter(unique_proposals[struct_which])
+    expected = pd.concat([struct_reason, conf_reason]).reindex(unique_proposals.index[~which.values])
+    pd.testing.assert_series_equal(reason, expected, check_names=False)
+
+
+def test_plan(taxonomy):
+    best = BestResultFilter(taxonomy)
+    structure, confidence, nop = StructurePredictionFilter(), ConfidenceFilter(0.5), NopFilter()
+    assert CompoundFilter([structure, confidence, best, nop]).plan() == [[structure, confidence], best, [nop]]
+    assert (structure >> best >> confidence).filters == [structure, best, confidence]
+
+
+def test_filter_codes(taxonomy, unique_proposals):
+    proposals_filter = StructurePredictionFilter() >> BestResultFilter(taxonomy) >> ConfidenceFilter(0.9)
+    which, reason = proposals_filter.filter(unique_proposals)
+    codes_which, codes = proposals_filter.filter_codes(unique_proposals)
+    pd.testing.assert_series_equal(codes_which, which)
+    pd.testing.assert_series_equal(codes.render(), reason)
+    rendered = {code: reason.values[i] for i, code in enumerate(codes.reasons()) if code is not None}
+    assert rendered[FilterOutReason.EmptyModelType] == "empty-model-type"
+    assert rendered[FilterOutReason.Confidence].startswith("confidence ")
+    assert rendered[FilterOutReason.ReplacedBy].split("replaced by ")[1] in unique_proposals.index
+
+
+def test_filter_of_strings(unique_proposals):
+    # filters returning reasons as strings can be chained with the others
+    class LowConfidenceFilter(ConfidenceFilter):
+        def _filter(self, proposals):
+            which = proposals.confidence >= self.confidence
+            return which, ("low " + proposals.confidence.astype(str))[~which]
+
+    which, reason = (StructurePredictionFilter() >> LowConfidenceFilter(0.5)).filter(unique_proposals)
+    old_which, old_reason = (OldStructurePredictionFilter() >> OldConfidenceFilter(0.5)).filter(unique_proposals)
+    np.testing.assert_array_equal(which.values, old_which.values)
+    assert reason.index.equals(old_reason.index)
+    assert reason.str.replace("^low .*", "low", regex=True).tolist() == \
+        old_reason.str.replace("^confidence .*", "low", regex=True).tolist()